@@ -45,6 +45,9 @@ import lookup_dict
 import time
 import datetime
 
+# compiled XML schemas, by path: (schema file mtime, schema)
+_schemas = {}
+
 
 def map_md5_to_tar(tar_list, md5_list):
     """
@@ -417,24 +420,62 @@ def get_regional_params(fn_in, csv_in):
     return param_dict
 
 
+def load_schema(schema):
+    """
+    Get compiled XML schema, compiling it only on first use or if the schema
+    file has changed since.
+
+    :param schema: <str> Path to XML schema.
+    :return: <lxml.etree.XMLSchema>
+    """
+    mtime = os.path.getmtime(schema)
+
+    if schema not in _schemas or _schemas[schema][0] != mtime:
+        _schemas[schema] = (mtime, etree.XMLSchema(etree.parse(schema)))
+
+    return _schemas[schema][1]
+
+
+def xml_errors(xml_in, schema):
+    """
+    Validate XML against schema, returning each error found.
+
+    :param xml_in: <str> Path to XML file to be checked.
+    :param schema: <str> Path to XML schema.
+    :return: <list> Dicts of line, column and message of each error; empty
+             if valid.
+    """
+    xmlschema = load_schema(schema)
+
+    try:
+        xmlfile = etree.parse(xml_in)
+    except etree.XMLSyntaxError as e:
+        return [{'line': i.line, 'column': i.column, 'message': i.message}
+                for i in e.error_log] or \
+            [{'line': None, 'column': None, 'message': str(e)}]
+
+    if xmlschema.validate(xmlfile):
+        return []
+
+    return [{'line': i.line, 'column': i.column, 'message': i.message}
+            for i in xmlschema.error_log]
+
+
 def verify_xml(xml_in, schema):
     """
     Verify XML against schema.
 
     :param xml_in: <str> Path to XML file to be checked.
     :param schema: <str> Path to XML schema.
-    :return:
+    :return: <bool> True if valid.
     """
-    # read schema
-    xmlschema = etree.XMLSchema(etree.parse(schema))
-
-    # read XML
-    xmlfile = etree.parse(xml_in)
+    errors = xml_errors(xml_in, schema)
 
-    # do validation
-    result = xmlschema.validate(xmlfile)
+    for err in errors:
+        print("{0} line {1}: {2}".format(os.path.basename(xml_in),
+                                         err['line'], err['message']))
 
-    return result
+    return not errors
 
 
 def verify_proj(ds, params):
@@ -0,0 +1,342 @@
+"""
+bench_cfmask_diag.py
+
+
+Purpose: micro-benchmark of the cfmask_diag per-tile tests (tile_tests,
+         tile_probs, tile_conf) on a synthetic tile, reporting how many
+         full-tile array passes and new array allocations each stage makes,
+         its peak traced memory and its run time. Optionally compares with
+         another version of cfmask_diag.py (e.g. taken from git history).
+
+
+Counting: arrays are viewed as a counting ndarray subclass; each ufunc
+          (operators included), array function (np.where, np.maximum, ...),
+          type conversion or boolean-mask read/write on a tile-sized array is
+          one pass, and each of them that creates a new tile-sized array is
+          one allocation. Timing and memory are measured without counting.
+
+
+Example usage:  python bench_cfmask_diag.py -rows 512 -cols 4096
+                git show HEAD~1:cloud-masking/cfmask_diag.py > /tmp/old.py
+                python bench_cfmask_diag.py -baseline /tmp/old.py
+
+
+Created:  16 October 2026
+Version:  1.0
+"""
+import os
+
+# thresholds used for the probability and confidence stages
+T_TEMPL = 1500.0
+T_TEMPH = 3500.0
+T_WTEMP = 2000.0
+T_BUFFER = 400.0
+CLR_MASK = 45.0
+WCLR_MASK = 40.0
+
+STAGES = ('tile_tests', 'tile_probs', 'tile_conf')
+
+
+def synthetic_tile(rows, cols, seed=0):
+    """
+    Build a tile of TOA reflectance and brightness temperature with cloud,
+    water, snow, saturated and fill pixels.
+
+    :param rows: <int> Rows of the tile.
+    :param cols: <int> Columns of the tile.
+    :param seed: <int> Random seed.
+    :return: <list> blue, green, red, nir, swir1, swir2 and thermal bands
+             (int16).
+    """
+    import numpy as np
+
+    rng = np.random.RandomState(seed)
+
+    base = rng.randint(300, 1500, (rows, cols))
+    bands = [base + rng.randint(0, 300, (rows, cols)),
+             base + rng.randint(0, 400, (rows, cols)),
+             base + rng.randint(0, 500, (rows, cols)),
+             rng.randint(1500, 4500, (rows, cols)),
+             rng.randint(800, 3000, (rows, cols)),
+             rng.randint(300, 2000, (rows, cols)),
+             rng.randint(2850, 3150, (rows, cols))]
+
+    cloud = rng.rand(rows, cols) < 0.3
+    for b, lo, hi in zip(bands, (4000, 4000, 4000, 4000, 2500, 1500, 2400),
+                         (9000, 9000, 9000, 8000, 5000, 3500, 2950)):
+        b[cloud] = rng.randint(lo, hi, np.count_nonzero(cloud))
+
+    water = ~cloud & (rng.rand(rows, cols) < 0.2)
+    for b, hi in zip(bands[3:6], (400, 900, 900)):
+        b[water] = rng.randint(20, hi, np.count_nonzero(water))
+
+    snow = ~cloud & ~water & (rng.rand(rows, cols) < 0.05)
+    bands[1][snow] = rng.randint(5000, 9000, np.count_nonzero(snow))
+    bands[3][snow] = rng.randint(3000, 8000, np.count_nonzero(snow))
+    bands[4][snow] = rng.randint(100, 900, np.count_nonzero(snow))
+    bands[6][snow] = rng.randint(2500, 2780, np.count_nonzero(snow))
+
+    bands[0][rng.rand(rows, cols) < 0.002] = 20000
+    bands[6][rng.rand(rows, cols) < 0.001] = 19999
+
+    fill = np.zeros((rows, cols), dtype=bool)
+    fill[:, :cols // 10] = True
+    bands = [b.astype(np.int16) for b in bands]
+    for b in bands:
+        b[fill] = -9999
+
+    return bands
+
+
+def load_module(path, name):
+    """
+    Load a version of cfmask_diag.py from a file.
+
+    :param path: <str> Path to the module file.
+    :param name: <str> Name given to the module.
+    :return: <module> The loaded module.
+    """
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def run_stages(module, tile, timer=None):
+    """
+    Run the per-tile stages of a cfmask_diag module on a tile.
+
+    :param module: <module> cfmask_diag module.
+    :param tile: <list> Bands from synthetic_tile.
+    :param timer: <callable> Called with each stage name as it finishes.
+    :return: <tuple> Diagnostic word, confidence, land and water cloud
+             probabilities.
+    """
+    t = module.tile_tests(*tile)
+    if timer:
+        timer('tile_tests')
+
+    final_prob, wfinal_prob = module.tile_probs(t, T_TEMPL, T_TEMPH, T_WTEMP)
+    if timer:
+        timer('tile_probs')
+
+    word, c_conf = module.tile_conf(t, final_prob, wfinal_prob, T_TEMPL,
+                                    T_BUFFER, CLR_MASK, WCLR_MASK)
+    if timer:
+        timer('tile_conf')
+
+    return word, c_conf, final_prob, wfinal_prob
+
+
+def count_passes(module, tile):
+    """
+    Count full-tile passes and allocations of each stage.
+
+    :param module: <module> cfmask_diag module.
+    :param tile: <list> Bands from synthetic_tile.
+    :return: <dict> [passes, allocations] by stage name.
+    """
+    import numpy as np
+
+    size = tile[0].size
+    stats = {'passes': 0, 'allocs': 0}
+
+    def note(result, inputs=()):
+        big = [a for a in inputs if np.size(a) >= size]
+        if isinstance(result, np.ndarray) and result.size >= size:
+            stats['passes'] += 1
+            if not any(np.shares_memory(result, a) for a in big
+                       if isinstance(a, np.ndarray)):
+                stats['allocs'] += 1
+        elif big:
+            stats['passes'] += 1
+
+    def plain(a):
+        return a.view(np.ndarray) if isinstance(a, Counted) else a
+
+    def counted(a):
+        if isinstance(a, np.ndarray) and not isinstance(a, Counted) and \
+                type(a) is np.ndarray:
+            return a.view(Counted)
+        return a
+
+    class Counted(np.ndarray):
+        def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+            outs = kwargs.get('out', ())
+            kwargs = dict((k, plain(v)) for k, v in kwargs.items())
+            if outs:
+                kwargs['out'] = tuple(plain(o) for o in outs)
+            result = getattr(ufunc, method)(*[plain(a) for a in inputs],
+                                            **kwargs)
+            if outs:
+                stats['passes'] += 1
+                return outs[0] if len(outs) == 1 else outs
+            note(result, inputs)
+            return counted(result)
+
+        def __array_function__(self, func, types, args, kwargs):
+            if func in (np.shape, np.ndim, np.size):
+                return func(*[plain(a) for a in args], **kwargs)
+            args = [[plain(b) for b in a] if isinstance(a, (tuple, list))
+                    else plain(a) for a in args]
+            kwargs = dict((k, plain(v)) for k, v in kwargs.items())
+            result = func(*args, **kwargs)
+            flat = [b for a in args for b in
+                    (a if isinstance(a, (tuple, list)) else [a])]
+            note(result, flat)
+            return counted(result)
+
+        def __getitem__(self, key):
+            result = np.ndarray.__getitem__(self, plain(key))
+            if isinstance(key, np.ndarray) and key.dtype == bool:
+                stats['passes'] += 1
+                stats['allocs'] += 1
+            return counted(result)
+
+        def __setitem__(self, key, value):
+            np.ndarray.__setitem__(self, plain(key), plain(value))
+            if isinstance(key, np.ndarray) and key.dtype == bool or \
+                    isinstance(key, tuple) and any(np.size(k) >= size
+                                                   for k in key):
+                stats['passes'] += 1
+
+    # keep conversions and new arrays counted
+    saved = dict((n, getattr(np, n)) for n in ('asarray', 'zeros', 'empty'))
+
+    def asarray(a, dtype=None, **kwargs):
+        result = np.asanyarray(a, dtype=dtype, **kwargs)
+        if result is not a and np.size(result) >= size:
+            stats['passes'] += 1
+            stats['allocs'] += 1
+        return counted(result)
+
+    def creator(func):
+        def create(*args, **kwargs):
+            result = func(*args, **kwargs)
+            if result.size >= size:
+                stats['allocs'] += 1
+            return counted(result)
+        return create
+
+    counts = {}
+
+    def timer(stage):
+        counts[stage] = [stats['passes'], stats['allocs']]
+        stats['passes'] = stats['allocs'] = 0
+
+    np.asarray = asarray
+    np.zeros = creator(saved['zeros'])
+    np.empty = creator(saved['empty'])
+    try:
+        run_stages(module, [counted(b.copy()) for b in tile], timer)
+    finally:
+        for n, f in saved.items():
+            setattr(np, n, f)
+
+    return counts
+
+
+def measure(module, tile, repeat):
+    """
+    Time each stage and trace its peak memory.
+
+    :param module: <module> cfmask_diag module.
+    :param tile: <list> Bands from synthetic_tile.
+    :param repeat: <int> Runs timed; the fastest is kept.
+    :return: <tuple> Seconds by stage name, peak traced MB and outputs.
+    """
+    import time
+    import tracemalloc
+
+    best = {}
+    for i in range(repeat):
+        t0 = [time.time()]
+
+        def timer(stage):
+            t1 = time.time()
+            best[stage] = min(best.get(stage, t1 - t0[0]), t1 - t0[0])
+            t0[0] = t1
+
+        out = run_stages(module, [b.copy() for b in tile], timer)
+
+    tracemalloc.start()
+    run_stages(module, [b.copy() for b in tile])
+    peak = tracemalloc.get_traced_memory()[1] / float(1 << 20)
+    tracemalloc.stop()
+
+    return best, peak, out
+
+
+def bench(rows=512, cols=4096, baseline=None, repeat=3):
+    """
+    Benchmark cfmask_diag's per-tile stages and print a report.
+
+    :param rows: <int> Rows of the synthetic tile.
+    :param cols: <int> Columns of the synthetic tile.
+    :param baseline: <str> Path to another cfmask_diag.py to compare with.
+    :param repeat: <int> Timed runs of each version.
+    """
+    import numpy as np
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    versions = [('current', load_module(here + os.sep + 'cfmask_diag.py',
+                                        'cfmask_diag_current'))]
+    if baseline:
+        versions.append(('baseline', load_module(baseline,
+                                                 'cfmask_diag_baseline')))
+
+    tile = synthetic_tile(rows, cols)
+    print("Tile: {0} x {1} ({2} pixels)".format(rows, cols, rows * cols))
+
+    outputs = []
+    for name, module in versions:
+        counts = count_passes(module, tile)
+        seconds, peak, out = measure(module, tile, repeat)
+        outputs.append(out)
+
+        print("\n{0} ({1})".format(name, module.__file__))
+        print("{0:<12}{1:>8}{2:>8}{3:>10}".format("stage", "passes",
+                                                  "allocs", "ms"))
+        for stage in STAGES:
+            print("{0:<12}{1:>8}{2:>8}{3:>10.1f}".format(
+                stage, counts[stage][0], counts[stage][1],
+                seconds[stage] * 1000))
+        print("{0:<12}{1:>8}{2:>8}{3:>10.1f}".format(
+            "total", sum(counts[s][0] for s in STAGES),
+            sum(counts[s][1] for s in STAGES),
+            sum(seconds.values()) * 1000))
+        print("peak traced memory: {0:.1f} MB".format(peak))
+
+    if len(outputs) == 2:
+        same = all(np.array_equal(a, b, equal_nan=True)
+                   for a, b in zip(outputs[0], outputs[1]))
+        print("\nOutputs identical to baseline: {0}".format(same))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-rows', action='store', dest='rows', type=int,
+                        help='Rows of the synthetic tile (default=512)',
+                        required=False, default=512)
+
+    parser.add_argument('-cols', action='store', dest='cols', type=int,
+                        help='Columns of the synthetic tile (default=4096)',
+                        required=False, default=4096)
+
+    parser.add_argument('-baseline', action='store', dest='baseline',
+                        type=str, help='Another cfmask_diag.py to compare '
+                                       'with', required=False, default=None)
+
+    parser.add_argument('-repeat', action='store', dest='repeat', type=int,
+                        help='Timed runs of each version (default=3)',
+                        required=False, default=3)
+
+    arguments = parser.parse_args()
+
+    bench(**vars(arguments))
@@ -0,0 +1,473 @@
+"""
+cfmask_batch.py
+
+
+Purpose: run cfmask_diag over many scenes in a process pool, paying Python,
+         NumPy and GDAL startup once per worker instead of once per scene.
+
+
+Inputs: .tar.gz archives (see cfmask_diag.py), given as any mix of
+        directories (all *.tar.gz in them), glob patterns and manifests
+        (text files of archive paths, one per line; '#' starts a comment).
+
+
+Outputs:  1) cfmask_diag outputs of each scene, in a directory of its own
+             (named after the archive) under the output directory, with the
+             scene's log (cfmask_diag.log) and statistics
+             (cfmask_diag_stats.json).
+          2) Summary table of all scenes (cfmask_batch_summary.csv): status,
+             clear/water/land percentages and thresholds.
+
+          Scenes whose four output rasters exist and are newer than their
+          archive are skipped (their statistics are read back if saved).
+
+
+Memory: each worker's address space can be capped (-max_mem_mb, as
+        RLIMIT_AS; POSIX only). A scene over the cap fails with a
+        MemoryError and is reported in the summary; the worker goes on with
+        the next scene. If the cap kills the worker instead (e.g. an
+        allocation failing inside GDAL), the scenes it was running with are
+        rerun one at a time, the one killing its worker is reported failed
+        and its partial outputs removed, and the other scenes go on in a new
+        pool. The address space includes libraries and thread stacks, so
+        leave headroom over the scene's working set (see -tile_rows).
+
+
+Example usage:  python cfmask_batch.py -i /path/to/archives -o /path/to/out
+                python cfmask_batch.py -i 'scenes/*/*.tar.gz' manifest.txt
+                    -o /path/to/out -workers 8 -max_mem_mb 2048
+
+
+Created:  16 October 2026
+Version:  1.0
+"""
+import os
+import sys
+
+# summary table, in the output directory
+SUMMARY_NAME = "cfmask_batch_summary.csv"
+
+# log and statistics of each scene, in its output directory
+LOG_NAME = "cfmask_diag.log"
+STATS_NAME = "cfmask_diag_stats.json"
+
+SUMMARY_HEADER = ('archive', 'dir_out', 'status', 'scene_id', 'seconds',
+                  'valid', 'clear_pct', 'water_pct', 'land_pct', 't_templ',
+                  't_temph', 't_wtemp', 'clr_mask', 'wclr_mask', 'error')
+
+# archive suffixes, stripped to name scene directories
+ARCHIVE_EXTS = ('.tar.gz', '.tgz')
+
+
+def find_archives(inputs):
+    """
+    Expand directories, glob patterns and manifests to archive paths.
+
+    :param inputs: <list> Directories, glob patterns, manifests or archives.
+    :return: <list> Absolute archive paths, in order, without duplicates.
+    """
+    import glob
+
+    found = []
+    for i in inputs:
+        if os.path.isdir(i):
+            paths = sorted(p for ext in ARCHIVE_EXTS
+                           for p in glob.glob(os.path.join(i, '*' + ext)))
+
+        elif os.path.isfile(i) and not i.endswith(ARCHIVE_EXTS):
+            with open(i) as f:
+                lines = [line.split('#', 1)[0].strip() for line in f]
+
+            # manifest entries are relative to the manifest
+            base = os.path.dirname(os.path.abspath(i))
+            paths = [os.path.join(base, line) for line in lines if line]
+
+        else:
+            paths = sorted(glob.glob(i))
+
+        if not paths:
+            print("Warning: no archives found for {0}".format(i))
+
+        found.extend(os.path.abspath(p) for p in paths)
+
+    seen = set()
+
+    return [p for p in found if not (p in seen or seen.add(p))]
+
+
+def scene_dir(archive, dir_out):
+    """
+    Output (and extraction) directory of a scene.
+
+    :param archive: <str> Path to the scene's archive.
+    :param dir_out: <str> Output directory of all scenes.
+    :return: <str>
+    """
+    name = os.path.basename(archive)
+    for ext in ARCHIVE_EXTS:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+            break
+
+    return os.path.join(dir_out, name)
+
+
+def up_to_date(archive, dir_scene):
+    """
+    Check if a scene's output rasters all exist and are newer than its
+    archive.
+
+    :param archive: <str> Path to the scene's archive.
+    :param dir_scene: <str> Output directory of the scene.
+    :return: <bool>
+    """
+    import glob
+    from cfmask_diag import OUTPUT_SUFFIXES
+
+    mtime = os.path.getmtime(archive)
+
+    for suffix in OUTPUT_SUFFIXES:
+        outs = glob.glob(os.path.join(dir_scene, '*' + suffix))
+        if not outs or min(os.path.getmtime(o) for o in outs) <= mtime:
+            return False
+
+    return True
+
+
+def _limit_memory(max_mem_mb):
+    """Pool initializer: cap this worker's address space."""
+    if not max_mem_mb:
+        return
+
+    try:
+        import resource
+    except ImportError:
+        print("Warning: resource limits not supported; memory not capped.")
+        return
+
+    cap = int(max_mem_mb) << 20
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        cap = min(cap, hard)
+
+    resource.setrlimit(resource.RLIMIT_AS, (cap, hard))
+
+
+def clean_scene(dir_scene):
+    """
+    Remove partial outputs and extracted bands of a failed scene; partial
+    outputs would pass as up to date.
+
+    :param dir_scene: <str> Output directory of the scene.
+    """
+    import glob
+    from cfmask_diag import del_file, OUTPUT_SUFFIXES
+
+    for pattern in [s for s in OUTPUT_SUFFIXES] + ['band*.tif', '.xml']:
+        for f in glob.glob(os.path.join(dir_scene, '*' + pattern)):
+            del_file(f)
+
+
+def run_scene(job):
+    """
+    Pool task: run cfmask_diag on one scene, unless it is up to date. The
+    scene's output is written to its log.
+
+    :param job: <tuple> Archive path, scene output directory, diag keyword
+                arguments and whether to rerun up-to-date scenes.
+    :return: <dict> Summary row of the scene.
+    """
+    import json
+    import time
+    import traceback
+    from cfmask_diag import diag
+
+    archive, dir_scene, kwargs, force = job
+
+    row = {'archive': archive, 'dir_out': dir_scene}
+
+    if not force and up_to_date(archive, dir_scene):
+        row['status'] = 'skipped'
+        try:
+            with open(os.path.join(dir_scene, STATS_NAME)) as f:
+                row.update(json.load(f))
+        except (IOError, OSError, ValueError):
+            pass
+
+        return row
+
+    if not os.path.isdir(dir_scene):
+        os.makedirs(dir_scene)
+
+    t0 = time.time()
+    stdout = sys.stdout
+    log = open(os.path.join(dir_scene, LOG_NAME), 'w')
+    sys.stdout = log
+
+    try:
+        stats = diag(archive, dir_out=dir_scene, **kwargs)
+        row['status'] = 'done'
+
+    # diag exits on archives it cannot extract
+    except (Exception, SystemExit) as e:
+        traceback.print_exc(file=log)
+        row['status'] = 'failed'
+        row['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        stats = None
+
+    finally:
+        sys.stdout = stdout
+        log.close()
+
+    if stats is not None:
+        del stats['outputs']
+        stats['seconds'] = time.time() - t0
+        row.update(stats)
+
+        with open(os.path.join(dir_scene, STATS_NAME), 'w') as f:
+            json.dump(stats, f, indent=1, sort_keys=True)
+    else:
+        row['seconds'] = time.time() - t0
+
+        # extracted bands are not cleaned up by diag on failure
+        clean_scene(dir_scene)
+
+    return row
+
+
+def run_pool(jobs, workers, max_mem_mb, report):
+    """
+    Run scenes in a process pool, at most one per worker at a time. If a
+    worker dies (its pool is then broken), the scenes still running are
+    rerun one at a time, each in a pool of its own, so only a scene that
+    kills its worker fails; the other scenes go on in a new pool.
+
+    :param jobs: <list> Jobs of run_scene.
+    :param workers: <int> Scenes processed at a time.
+    :param max_mem_mb: <int> Address space cap of each worker in MB; 0 for
+                       none.
+    :param report: <function> Called with the summary row of each scene as
+                   it finishes.
+    """
+    from concurrent.futures import ProcessPoolExecutor, wait, \
+        FIRST_COMPLETED
+    from concurrent.futures.process import BrokenProcessPool
+
+    def new_pool(n):
+        return ProcessPoolExecutor(n, initializer=_limit_memory,
+                                   initargs=(max_mem_mb,))
+
+    todo = list(reversed(jobs))
+    suspects = []
+
+    while todo or suspects:
+        for job in suspects:
+            pool = new_pool(1)
+            try:
+                row = pool.submit(run_scene, job).result()
+
+            except BrokenProcessPool:
+                row = {'archive': job[0], 'dir_out': job[1],
+                       'status': 'failed',
+                       'error': 'worker died (over -max_mem_mb?)'}
+                clean_scene(job[1])
+
+            finally:
+                pool.shutdown(wait=True)
+
+            report(row)
+
+        suspects = []
+
+        pool = new_pool(workers)
+        running = {}
+        try:
+            while todo or running:
+                broken = False
+                while todo and len(running) < workers and not broken:
+                    try:
+                        running[pool.submit(run_scene, todo[-1])] = todo[-1]
+                        todo.pop()
+                    except BrokenProcessPool:
+                        broken = True
+
+                done = wait(running, return_when=FIRST_COMPLETED)[0]
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        row = future.result()
+                    except BrokenProcessPool:
+                        suspects.append(job)
+                        broken = True
+                        continue
+
+                    report(row)
+
+                if broken:
+                    # the other running scenes failed with the pool, unless
+                    # they finished first
+                    pool.shutdown(wait=True)
+                    for future, job in running.items():
+                        if future.exception() is None:
+                            report(future.result())
+                        else:
+                            suspects.append(job)
+                    break
+
+        finally:
+            pool.shutdown(wait=True)
+
+
+def write_summary(fn_out, rows):
+    """
+    Write the summary table.
+
+    :param fn_out: <str> Path to the summary CSV.
+    :param rows: <list> Summary rows of the scenes (dicts).
+    """
+    import csv
+
+    with open(fn_out, 'w') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(SUMMARY_HEADER)
+        for row in rows:
+            writer.writerow([row.get(k, '') for k in SUMMARY_HEADER])
+
+
+def batch(inputs, dir_out, workers=None, max_mem_mb=0, force=False,
+          cloud_prob_threshold=22.5, t_buffer=400.0, tile_rows=None,
+          diag_encoding='decimal', prob_bins=0):
+    """
+    Run cfmask_diag over many scenes and write the summary table.
+
+    :param inputs: <list> Directories, glob patterns, manifests or archives.
+    :param dir_out: <str> Output directory; each scene gets a directory in
+                    it.
+    :param workers: <int> Scenes processed at a time; default is the number
+                    of CPUs.
+    :param max_mem_mb: <int> Address space cap of each worker in MB; 0 for
+                       none.
+    :param force: <bool> Rerun scenes that are up to date.
+    :param cloud_prob_threshold...prob_bins: passed to cfmask_diag.diag.
+    :return: <list> Summary rows of the scenes.
+    """
+    import time
+    import multiprocessing
+    from cfmask_diag import TILE_ROWS
+
+    t0 = time.time()
+
+    archives = find_archives(inputs)
+    print("{0} archives found.".format(len(archives)))
+
+    if not os.path.isdir(dir_out):
+        os.makedirs(dir_out)
+
+    kwargs = {'cloud_prob_threshold': cloud_prob_threshold,
+              't_buffer': t_buffer,
+              'tile_rows': TILE_ROWS if tile_rows is None else tile_rows,
+              'diag_encoding': diag_encoding,
+              'prob_bins': prob_bins}
+
+    jobs = [(a, scene_dir(a, dir_out), kwargs, force) for a in archives]
+
+    workers = min(workers or multiprocessing.cpu_count(), len(jobs)) or 1
+
+    rows = []
+
+    def report(row):
+        rows.append(row)
+        print("[{0}/{1}] {2}: {3}{4}".format(
+            len(rows), len(jobs), os.path.basename(row['archive']),
+            row['status'],
+            " ({0})".format(row['error']) if row.get('error') else ""))
+
+    if workers > 1:
+        run_pool(jobs, workers, max_mem_mb, report)
+
+        # archive order in the summary
+        order = dict((a, i) for i, a in enumerate(archives))
+        rows.sort(key=lambda r: order[r['archive']])
+
+    else:
+        _limit_memory(max_mem_mb)
+        for job in jobs:
+            report(run_scene(job))
+
+    fn_out = os.path.join(dir_out, SUMMARY_NAME)
+    write_summary(fn_out, rows)
+
+    print("Done: {0}, skipped: {1}, failed: {2}".format(
+        *[sum(1 for r in rows if r['status'] == s)
+          for s in ('done', 'skipped', 'failed')]))
+    print("Summary written to {0}".format(fn_out))
+    print("Total time: {0} minutes.".format(round((time.time() - t0) / 60,
+                                                  3)))
+
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+    from cfmask_diag import TILE_ROWS, DIAG_ENCODINGS
+
+    parser = argparse.ArgumentParser()
+
+    req_named = parser.add_argument_group('Required named arguments')
+
+    req_named.add_argument('-i', action='store', dest='inputs', type=str,
+                           nargs='+', help='Directories, glob patterns or '
+                                           'manifests of .tar.gz archives.',
+                           required=True)
+
+    req_named.add_argument('-o', action='store', dest='dir_out', type=str,
+                           help='Output directory (one directory per '
+                                'scene, and the summary table).',
+                           required=True)
+
+    req_named.add_argument('-workers', action='store', dest='workers',
+                           type=int, help='Scenes processed at a time '
+                                          '(default=number of CPUs)',
+                           required=False, default=None)
+
+    req_named.add_argument('-max_mem_mb', action='store', dest='max_mem_mb',
+                           type=int, help='Address space cap of each worker '
+                                          'in MB; 0 for none (default=0)',
+                           required=False, default=0)
+
+    req_named.add_argument('-force', action='store_true', dest='force',
+                           help='Rerun scenes whose outputs are up to date',
+                           required=False)
+
+    req_named.add_argument('-cloud_prob_threshold', action='store',
+                           dest='cloud_prob_threshold', type=float,
+                           help='Cloud probability threshold (default=22.5)',
+                           required=False, default=22.5)
+
+    req_named.add_argument('-t_buffer', action='store', dest='t_buffer',
+                           type=float, help='Temperature probability buffer '
+                                            '(default=400.0)', required=False,
+                                            default=400.0)
+
+    req_named.add_argument('-tile_rows', action='store', dest='tile_rows',
+                           type=int, help='Rows read at a time; 0 reads the '
+                                          'whole scene (default={0})'.
+                                          format(TILE_ROWS), required=False,
+                                          default=TILE_ROWS)
+
+    req_named.add_argument('-diag_encoding', action='store',
+                           dest='diag_encoding', choices=DIAG_ENCODINGS,
+                           help='Diag band encoding (default=decimal)',
+                           required=False, default='decimal')
+
+    req_named.add_argument('-prob_bins', action='store', dest='prob_bins',
+                           type=int, help='Fixed bins for the cloud '
+                                          'probability percentiles; 0 '
+                                          'selects them exactly (default=0)',
+                           required=False, default=0)
+
+    arguments = parser.parse_args()
+
+    rows = batch(**vars(arguments))
+
+    sys.exit(1 if any(r['status'] == 'failed' for r in rows) else 0)
@@ -17,7 +17,23 @@ Outputs:  1) Diagnostic band.
           2) cfmask_conf band.
 
 
-Diagnostic band (*_cfmask_diag.tif) interpretation:
+Processing: the scene is read in tiles (strips of full rows) over several
+            passes, so memory is bounded by the tile size, not the scene:
+              1) tests and scene statistics (clear/land/water counts,
+                 temperature percentiles)
+              2) cloud probabilities, for the dynamic cloud thresholds (one
+                 pass or more, until their percentiles are resolved exactly)
+              3) confidence tests; outputs written tile by tile
+            Results are the same as processing the whole scene at once.
+            Temperature percentiles come from exact histograms of the
+            integer thermal values. Cloud probability percentiles are
+            selected exactly, or with -prob_bins taken from a fixed-bin
+            histogram in a single pass (error at most one bin width).
+            Percentile counts of separate tiles can be merged.
+
+
+Diagnostic band (*_cfmask_diag.tif) interpretation, decimal-coded (default;
+sum of the values below, uint32):
     0000 0000 0001 = basic cloud test passed
     0000 0000 0010 = thermal threshold cloud test passed
     0000 0000 0100 = whiteness cloud test passed
@@ -31,6 +47,16 @@ Diagnostic band (*_cfmask_diag.tif) interpretation:
     0000 0000 0002 = water cloud confidence (test d) passed (med conf set)
     0000 0000 0020 = land cloud confidence (test e) passed (med conf set)
 
+  With -diag_encoding bits, each test sets one bit of a uint16 word instead,
+  so a test is read as (diag & mask) != 0; the bit table is also written to
+  *_cfmask_diag_bits.csv:
+    bit  0 (1)    = basic cloud test        bit  6 (64)   = basic water test
+    bit  1 (2)    = thermal threshold test  bit  7 (128)  = conf. test a
+    bit  2 (4)    = whiteness test          bit  8 (256)  = conf. test b
+    bit  3 (8)    = haze optimized test 1   bit  9 (512)  = conf. test c
+    bit  4 (16)   = haze optimized test 2   bit 10 (1024) = conf. test d
+    bit  5 (32)   = basic snow test         bit 11 (2048) = conf. test e
+
 
 cfmask_conf band (*_cfmask_conf_diag.tif) interpretation:
     0 = fill
@@ -45,8 +71,8 @@ Example usage:  python '/path/to/scripts/cfmask_diag.py'
 
 Author:   Steve Foga
 Created:  14 September 2016
-Modified: 15 March 2017
-Version:  1.1
+Modified: 16 October 2026
+Version:  1.2
 
 
 Changelog:
@@ -54,6 +80,15 @@ Changelog:
     19-Oct-2016 - 1.0 - First correctly working version
     15-Mar-2017 - 1.1 - PEP8 compliance, added argparse, overall code cleanup,
                         allow t_buffer and cloud_prob_threshold to be toggled
+    16-Oct-2026 - 1.2 - Tiled multi-pass processing with bounded memory;
+                        exact percentiles by radix selection; optional
+                        bit-packed uint16 diag band
+                        Test masks computed once and applied in place (see
+                        bench_cfmask_diag.py); mergeable percentile
+                        selection, optional fixed-bin cloud probability
+                        percentiles (-prob_bins)
+                        Output directory (-o); diag() returns the scene
+                        statistics (see cfmask_batch.py)
 
 
 Caveats/Known issues:
@@ -79,314 +114,829 @@ References:
 
 """
 ###############################################################################
-def diag(input_gz, cloud_prob_threshold=22.5, t_buffer=400.0):
-    # load libraries
-    import os
-    import sys
-    import tarfile
-    import glob
-    import time
+# rows of each tile (strip of full rows) read at a time; 0 reads the whole
+# scene as one tile
+TILE_ROWS = 128
+
+# bits of the histogram counted per pass when selecting percentiles
+DIGIT_BITS = 16
+
+# once the histogram bucket holding a percentile has at most this many
+# values, they are gathered and sorted in the next pass
+GATHER_MAX = 1 << 22
+
+# range of the fixed-bin histograms of cloud probabilities (-prob_bins);
+# percentiles outside it are selected exactly
+PROB_RANGE = (0.0, 1000.0)
+
+# bit set by each test in the diagnostic word
+D_BASIC = 1 << 0
+D_THERMAL = 1 << 1
+D_WHITENESS = 1 << 2
+D_HOT1 = 1 << 3
+D_HOT2 = 1 << 4
+D_SNOW = 1 << 5
+D_WATER = 1 << 6
+D_CONF_A = 1 << 7
+D_CONF_B = 1 << 8
+D_CONF_C = 1 << 9
+D_CONF_D = 1 << 10
+D_CONF_E = 1 << 11
+
+# bit, value in the decimal-coded diag band and meaning of each test
+DIAG_TESTS = (
+    (D_BASIC, 1, "basic cloud test passed"),
+    (D_THERMAL, 10, "thermal threshold cloud test passed"),
+    (D_WHITENESS, 100, "whiteness cloud test passed"),
+    (D_HOT1, 1000, "haze optimized test 1 passed (still possibly cloud)"),
+    (D_HOT2, 10000, "haze optimized test 2 passed (still possibly cloud)"),
+    (D_SNOW, 100000, "basic snow test passed (snow bit set)"),
+    (D_WATER, 1000000, "basic water test passed (water bit set)"),
+    (D_CONF_A, 10000000, "thermal thresh. confidence (test a) passed "
+                         "(high conf set)"),
+    (D_CONF_B, 100000000, "water cloud confidence (test b) passed "
+                          "(high conf set)"),
+    (D_CONF_C, 1000000000, "land cloud confidence (test c) passed "
+                           "(high conf set)"),
+    (D_CONF_D, 2, "water cloud confidence (test d) passed (med conf set)"),
+    (D_CONF_E, 20, "land cloud confidence (test e) passed (med conf set)"))
+
+# diag band encodings
+DIAG_ENCODINGS = ('decimal', 'bits')
+
+# suffixes of the output rasters, after the scene ID
+OUTPUT_SUFFIXES = ('_cfmask_diag.tif', '_cfmask_conf_diag.tif', '_prob.tif',
+                   '_wprob.tif')
+
+
+# assign bands to colors, return dict
+def band_by_sensor(landsat_8, bnds):
+    b_c = {}
+
+    if landsat_8:
+        b_c['blue'] = [b for b in bnds if "band2" in b][0]
+        b_c['green'] = [b for b in bnds if "band3" in b][0]
+        b_c['red'] = [b for b in bnds if "band4" in b][0]
+        b_c['nir'] = [b for b in bnds if "band5" in b][0]
+        b_c['swir1'] = [b for b in bnds if "band6" in b][0]
+        b_c['swir2'] = [b for b in bnds if "band7" in b][0]
+        b_c['therm'] = [b for b in bnds if "band10" in b][0]
+
+    else:
+        b_c['blue'] = [b for b in bnds if "band1" in b][0]
+        b_c['green'] = [b for b in bnds if "band2" in b][0]
+        b_c['red'] = [b for b in bnds if "band3" in b][0]
+        b_c['nir'] = [b for b in bnds if "band4" in b][0]
+        b_c['swir1'] = [b for b in bnds if "band5" in b][0]
+        b_c['swir2'] = [b for b in bnds if "band7" in b][0]
+        b_c['therm'] = [b for b in bnds if "band6." in b][0]
+
+    print("Thermal band: {0}".format(b_c['therm']))
+    print(b_c)
+    return b_c
+
+
+# read tiles of bands as arrays
+def read_tiles(rasts, tile_rows=TILE_ROWS):
+    """
+    Read bands tile by tile.
+
+    :param rasts: <list> GDAL datasets of the bands.
+    :param tile_rows: <int> Rows per tile; 0 reads the whole scene.
+    :return: <generator> Row offset and list of band arrays of each tile.
+    """
+    import numpy as np
+
+    ncol = rasts[0].RasterXSize
+    nrow = rasts[0].RasterYSize
+
+    step = tile_rows if tile_rows > 0 else nrow
+
+    for yoff in range(0, nrow, step):
+        nrows = min(step, nrow - yoff)
+
+        yield yoff, [np.array(r.GetRasterBand(1).ReadAsArray(0, yoff, ncol,
+                                                             nrows))
+                     for r in rasts]
+
+
+# find minimum bounding mask for bands
+def min_bound(*args):
+    import numpy as np
+
+    # pixel is nodata if its minimum over all bands is nodata, i.e. if any
+    # band is nodata (no 3d stack of the bands is built)
+    stack_mask = np.less_equal(args[0], -9999)
+    tmp = np.empty_like(stack_mask)
+    for b in args[1:]:
+        stack_mask |= np.less_equal(b, -9999, out=tmp)
+
+    return stack_mask
+
+
+# calculate spectral index
+def calc_si(a, b):
     import numpy as np
+
+    # do calculation (sum computed once, in the bands' type)
+    a_b = a + b
+    s_i = np.asarray(a - b, dtype=np.float64)
+    s_i /= a_b
+
+    # if (a+b) == 0, set pixel(s) to 0.01
+    s_i[a_b == 0] = 0.01
+
+    return s_i
+
+
+# clean up files
+def del_file(a):
+    import os
+
     try:
-        from osgeo import gdal
-    except ImportError:
-        import gdal
+        os.remove(a)
+    except (OSError, IndexError):
+        pass
 
-    t0 = time.time()
-    print("Start time: {0}".format(time.asctime()))
 
-    '''
-    define functions
-    '''
+def percentile_ranks(n, q):
+    """
+    Ranks interpolated for a percentile of n sorted values, as
+    numpy.percentile computes them (linear method).
+
+    :param n: <int> Number of values (NaNs included).
+    :param q: <float> Percentile (0-100).
+    :return: <tuple> Virtual index, lower rank and upper rank.
+    """
+    import numpy as np
+
+    vi = (n - 1) * np.true_divide(q, 100)
+    lo = min(max(int(np.floor(vi)), 0), n - 1)
+    hi = min(lo + 1, n - 1)
+
+    return vi, lo, hi
 
-    # assign bands to colors, return dict
-    def band_by_sensor(landsat_8, bnds):
-        b_c = {}
 
-        if landsat_8:
-            b_c['blue'] = [b for b in bnds if "band2" in b][0]
-            b_c['green'] = [b for b in bnds if "band3" in b][0]
-            b_c['red'] = [b for b in bnds if "band4" in b][0]
-            b_c['nir'] = [b for b in bnds if "band5" in b][0]
-            b_c['swir1'] = [b for b in bnds if "band6" in b][0]
-            b_c['swir2'] = [b for b in bnds if "band7" in b][0]
-            b_c['therm'] = [b for b in bnds if "band10" in b][0]
+def interpolate(a, b, vi, lo):
+    """
+    Interpolate a percentile between the values at its lower and upper
+    ranks, as numpy.percentile does (linear method).
 
+    :param a: <numpy.float64> Value at the lower rank.
+    :param b: <numpy.float64> Value at the upper rank.
+    :param vi: <numpy.float64> Virtual index (see percentile_ranks).
+    :param lo: <int> Lower rank.
+    :return: <numpy.float64>
+    """
+    import numpy as np
+
+    gamma = vi - np.float64(lo)
+
+    diff_b_a = b - a
+    if gamma >= 0.5:
+        return b - diff_b_a * (1 - gamma)
+
+    return a + diff_b_a * gamma
+
+
+class RankSelect(object):
+    """
+    Exact percentiles of values seen tile by tile, over one or more passes,
+    without holding the values (radix selection). Values are mapped to
+    unsigned integer keys that sort like the values. The first pass counts
+    the keys under their top DIGIT_BITS bits; each further pass counts the
+    next DIGIT_BITS bits of the buckets that hold a wanted rank, or gathers
+    a bucket's keys once it holds at most GATHER_MAX of them. Integers of up
+    to 16 bits are resolved in the first pass.
+
+    Percentiles are interpolated as numpy.percentile does (linear method).
+
+    Tiles may be counted by several selectors: fork() gives one in the
+    same state with nothing counted this pass, merge() adds its counts back
+    before finish_pass().
+    """
+    def __init__(self, dtype, percentiles):
+        """
+        :param dtype: <numpy.dtype> Data type of the values.
+        :param percentiles: <list> Percentiles wanted (0-100).
+        """
+        import numpy as np
+
+        self.dtype = np.dtype(dtype)
+        self.percentiles = percentiles
+
+        # integer keys are offset values; others are float64 bit patterns
+        if self.dtype.kind in 'iu' and self.dtype.itemsize <= 2:
+            self.bits = 8 * self.dtype.itemsize
+            self.offset = int(np.iinfo(self.dtype).min)
         else:
-            b_c['blue'] = [b for b in bnds if "band1" in b][0]
-            b_c['green'] = [b for b in bnds if "band2" in b][0]
-            b_c['red'] = [b for b in bnds if "band3" in b][0]
-            b_c['nir'] = [b for b in bnds if "band4" in b][0]
-            b_c['swir1'] = [b for b in bnds if "band5" in b][0]
-            b_c['swir2'] = [b for b in bnds if "band7" in b][0]
-            b_c['therm'] = [b for b in bnds if "band6." in b][0]
-            
-        print("Thermal band: {0}".format(b_c['therm']))
-        print(b_c)
-        return b_c
+            self.bits = 64
+            self.offset = None
+
+        self.n = 0
+        self.n_nan = 0
+        self.passes = 0
+
+        # first pass histogram
+        self.hist = np.zeros(1 << min(DIGIT_BITS, self.bits), dtype=np.int64)
+
+        # [prefix, prefix bits, rank within bucket, bucket count] of each
+        # wanted rank, and the key of each resolved rank
+        self.ranks = {}
+        self.keys_of = {}
 
-    # read bands as array
-    def read_bands(band_in):
-        rast = gdal.Open(band_in, gdal.GA_ReadOnly)
+        # histogram or gathered keys of each bucket searched this pass
+        self.buckets = {}
 
-        rast_arr = np.array(rast.GetRasterBand(1).ReadAsArray())
+    def _keys(self, values):
+        """Map values to sort keys; NaNs are counted and dropped."""
+        import numpy as np
 
-        return rast_arr
+        values = np.asarray(values).ravel()
 
-    # mask nodata from bands
-    def mask_nd(mask_in, band_in):
-        band_out = np.ma.masked_where(mask_in == 0, band_in)
+        if self.offset is not None:
+            return (values.astype(np.int64) - self.offset).astype(np.uint64)
 
-        return band_out
+        values = np.asarray(values, dtype=np.float64)
 
-    # find minimum bounding mask for bands
-    def min_bound(*args):
+        nan = np.isnan(values)
+        if nan.any():
+            self.n_nan += int(np.count_nonzero(nan))
+            values = values[~nan]
 
-        # for each band: find nodata & put data in 3d stack (np.dstack)
-        it = 0
-        for b in args:
+        keys = values.view(np.uint64)
+        neg = (keys >> np.uint64(63)).astype(bool)
 
-            if it == 0:
-                stack = b
-                it += 1
+        return np.where(neg, ~keys, keys | np.uint64(1 << 63))
 
+    def _value(self, key):
+        """Map a sort key back to its value."""
+        import numpy as np
+
+        if self.offset is not None:
+            return self.dtype.type(int(key) + self.offset)
+
+        if key >> 63:
+            key &= (1 << 63) - 1
+        else:
+            key = ~key & ((1 << 64) - 1)
+
+        return np.array([key], dtype=np.uint64).view(np.float64)[0]
+
+    def _wanted(self):
+        """Ranks needed for the percentiles: (virtual index, lower rank,
+        upper rank) of each."""
+        return [percentile_ranks(self.n + self.n_nan, q)
+                for q in self.percentiles]
+
+    def done(self):
+        """Check if all percentiles are resolved."""
+        return self.passes > 0 and not self.ranks
+
+    def update(self, values):
+        """
+        Add values of a tile, in every pass.
+
+        :param values: <numpy.ndarray> Values of the tile to select from.
+        """
+        import numpy as np
+
+        keys = self._keys(values)
+
+        if self.passes == 0:
+            self.n += len(keys)
+            d_bits = min(DIGIT_BITS, self.bits)
+            self.hist += np.bincount(
+                (keys >> np.uint64(self.bits - d_bits)).astype(np.intp),
+                minlength=1 << d_bits)
+            return
+
+        for (prefix, p_bits), bucket in self.buckets.items():
+            shift = self.bits - p_bits
+            sel = keys[(keys >> np.uint64(shift)) == np.uint64(prefix)]
+
+            if not len(sel):
+                continue
+
+            if bucket['keys'] is not None:
+                bucket['keys'].append(sel)
+                continue
+
+            d_bits = min(DIGIT_BITS, shift)
+            digits = (sel >> np.uint64(shift - d_bits)) & \
+                np.uint64((1 << d_bits) - 1)
+            bucket['hist'] += np.bincount(digits.astype(np.intp),
+                                          minlength=1 << d_bits)
+            bucket['min'] = min(bucket['min'], int(sel.min()))
+            bucket['max'] = max(bucket['max'], int(sel.max()))
+
+    def fork(self):
+        """
+        Get a selector in the same state with nothing counted in this pass,
+        e.g. to count some of the tiles in another process.
+
+        :return: <RankSelect>
+        """
+        import copy
+        import numpy as np
+
+        part = copy.copy(self)
+
+        if self.passes == 0:
+            part.n = 0
+            part.n_nan = 0
+            part.hist = np.zeros_like(self.hist)
+
+        part.buckets = {}
+        for b, bucket in self.buckets.items():
+            if bucket['keys'] is not None:
+                part.buckets[b] = {'keys': []}
             else:
-                stack = np.dstack((stack, b))
-                it += 1
+                part.buckets[b] = {'keys': None,
+                                   'hist': np.zeros_like(bucket['hist']),
+                                   'min': 1 << 64, 'max': -1}
+
+        return part
+
+    def merge(self, other):
+        """
+        Add the counts of a selector forked from this one (or built alike)
+        for the same pass, e.g. over other tiles.
+
+        :param other: <RankSelect> Selector in the same pass.
+        :return: <RankSelect> This selector.
+        """
+        if other.dtype != self.dtype or \
+                other.percentiles != self.percentiles or \
+                other.passes != self.passes or \
+                set(other.buckets) != set(self.buckets):
+            raise ValueError("Cannot merge percentile selections in "
+                             "different states.")
+
+        if self.passes == 0:
+            self.n += other.n
+            self.n_nan += other.n_nan
+            self.hist += other.hist
+
+        for b, bucket in other.buckets.items():
+            mine = self.buckets[b]
+
+            if bucket['keys'] is not None:
+                mine['keys'].extend(bucket['keys'])
+                continue
+
+            mine['hist'] += bucket['hist']
+            mine['min'] = min(mine['min'], bucket['min'])
+            mine['max'] = max(mine['max'], bucket['max'])
+
+        return self
+
+    @staticmethod
+    def _locate(hist, rank):
+        """Find the histogram bucket holding a rank: bucket, rank within it
+        and count of the bucket."""
+        import numpy as np
+
+        cum = np.cumsum(hist)
+        digit = int(np.searchsorted(cum, rank, side='right'))
+
+        return digit, rank - int(cum[digit] - hist[digit]), int(hist[digit])
+
+    def finish_pass(self):
+        """
+        End a pass over all tiles.
+
+        :return: <bool> True if all percentiles are resolved.
+        """
+        import numpy as np
+
+        if self.passes == 0:
+            d_bits = min(DIGIT_BITS, self.bits)
+
+            # NaNs sort last, as in numpy.percentile
+            if self.n > 0:
+                for vi, lo, hi in self._wanted():
+                    for r in (lo, hi):
+                        if r < self.n and r not in self.ranks:
+                            digit, r_in, count = self._locate(self.hist, r)
+                            self.ranks[r] = [digit, d_bits, r_in, count]
 
-        # find mutual nodata in stack
-        stack_min = np.ndarray.min(stack, axis=2)
-        stack_mask = np.ma.masked_where(stack_min <= -9999, stack_min).mask
+        else:
+            for r, (prefix, p_bits, r_in, count) in \
+                    list(self.ranks.items()):
+                bucket = self.buckets[(prefix, p_bits)]
+
+                if bucket['keys'] is not None:
+                    keys = np.sort(np.concatenate(bucket['keys']))
+                    self.keys_of[r] = int(keys[r_in])
+                    del self.ranks[r]
+
+                elif bucket['min'] == bucket['max']:
+                    self.keys_of[r] = bucket['min']
+                    del self.ranks[r]
+
+                else:
+                    d_bits = len(bucket['hist']).bit_length() - 1
+                    digit, r_in, count = self._locate(bucket['hist'], r_in)
+                    self.ranks[r] = [(prefix << d_bits) | digit,
+                                     p_bits + d_bits, r_in, count]
+
+        self.passes += 1
+        self.buckets = {}
+
+        for r, (prefix, p_bits, r_in, count) in list(self.ranks.items()):
+            if p_bits == self.bits:
+                self.keys_of[r] = prefix
+                del self.ranks[r]
+                continue
+
+            if (prefix, p_bits) in self.buckets:
+                continue
+
+            if count <= GATHER_MAX:
+                self.buckets[(prefix, p_bits)] = {'keys': []}
+            else:
+                d_bits = min(DIGIT_BITS, self.bits - p_bits)
+                self.buckets[(prefix, p_bits)] = {
+                    'keys': None,
+                    'hist': np.zeros(1 << d_bits, dtype=np.int64),
+                    'min': 1 << 64, 'max': -1}
+
+        return self.done()
+
+    def percentile(self, q, transform=None):
+        """
+        Get a resolved percentile.
+
+        :param q: <float> Percentile (0-100), one of those given.
+        :param transform: <function> Applied to the two values interpolated,
+                          as an array, before interpolating (default=None).
+        :return: <numpy.float64> Percentile; None if there were no values.
+        """
+        import numpy as np
+
+        if self.n + self.n_nan == 0:
+            return None
+
+        if self.n_nan:
+            return np.float64(np.nan)
+
+        vi, lo, hi = self._wanted()[self.percentiles.index(q)]
+
+        vals = np.array([self._value(self.keys_of[lo]),
+                         self._value(self.keys_of[hi])])
+
+        if transform is not None:
+            vals = transform(vals)
+
+        return interpolate(vals[0], vals[1], vi, lo)
+
+
+class BinnedPercentile(object):
+    """
+    Approximate percentiles of values seen tile by tile, from a histogram
+    of fixed bins over a range, in one pass. A percentile within the range
+    is interpolated between rank estimates inside their bins, so it is off
+    by at most one bin width, (hi - lo) / bins. Values outside the range are
+    only counted; a percentile falling among them is not resolved, and
+    should be selected exactly instead (see RankSelect).
+
+    Tiles may be counted by several histograms of the same bins and merged.
+    """
+    def __init__(self, value_range, bins, percentiles):
+        """
+        :param value_range: <tuple> Lower and upper edges of the bins.
+        :param bins: <int> Number of bins.
+        :param percentiles: <list> Percentiles wanted (0-100).
+        """
+        import numpy as np
+
+        self.lo = float(value_range[0])
+        self.hi = float(value_range[1])
+        self.bins = int(bins)
+        self.width = (self.hi - self.lo) / self.bins
+        self.percentiles = percentiles
+
+        self.n = 0
+        self.n_nan = 0
+        self.n_under = 0
+        self.n_over = 0
+        self.passes = 0
+
+        self.hist = np.zeros(self.bins, dtype=np.int64)
+
+        # estimated values of the percentiles, by percentile
+        self.values = {}
+
+    def update(self, values):
+        """
+        Add values of a tile.
+
+        :param values: <numpy.ndarray> Values of the tile to select from.
+        """
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+
+        nan = np.isnan(values)
+        if nan.any():
+            self.n_nan += int(np.count_nonzero(nan))
+            values = values[~nan]
+
+        self.n += len(values)
+
+        under = values < self.lo
+        over = values > self.hi
+        self.n_under += int(np.count_nonzero(under))
+        self.n_over += int(np.count_nonzero(over))
+
+        # upper edge belongs to the last bin
+        idx = values[~(under | over)]
+        idx -= self.lo
+        idx /= self.width
+        idx = np.minimum(idx.astype(np.intp), self.bins - 1)
+        self.hist += np.bincount(idx, minlength=self.bins)
 
-        return stack_mask
+    def fork(self):
+        """
+        Get an empty histogram of the same bins, e.g. to count some of the
+        tiles in another process.
 
-    # calculate spectral index
-    def calc_si(a, b):
-        # do calculation
-        s_i = np.asfarray(a - b) / np.asfarray(a + b)
+        :return: <BinnedPercentile>
+        """
+        return BinnedPercentile((self.lo, self.hi), self.bins,
+                                self.percentiles)
 
-        # if (a+b) == 0, set pixel(s) to 0.01
-        s_i[np.where((a + b) == 0)] = 0.01
+    def merge(self, other):
+        """
+        Add the counts of a histogram of the same bins, e.g. over other
+        tiles.
 
-        return s_i
+        :param other: <BinnedPercentile> Histogram of the same bins.
+        :return: <BinnedPercentile> This histogram.
+        """
+        if (other.lo, other.hi, other.bins) != (self.lo, self.hi, self.bins) \
+                or other.percentiles != self.percentiles or other.passes or \
+                self.passes:
+            raise ValueError("Cannot merge percentile histograms of "
+                             "different bins, or finished.")
 
-    # clean up files
-    def del_file(a):
-        try:
-            os.remove(a)
-        except (OSError, IndexError):
-            pass
+        self.n += other.n
+        self.n_nan += other.n_nan
+        self.n_under += other.n_under
+        self.n_over += other.n_over
+        self.hist += other.hist
+
+        return self
+
+    def _estimate(self, rank, cum):
+        """Estimate the value of a rank, None if it is out of range."""
+        import numpy as np
+
+        r = rank - self.n_under
+        if r < 0 or r >= cum[-1]:
+            return None
+
+        b = int(np.searchsorted(cum, r, side='right'))
+        r_in = r - int(cum[b] - self.hist[b])
+
+        return np.float64(self.lo + self.width *
+                          (b + (r_in + 0.5) / float(self.hist[b])))
+
+    def finish_pass(self):
+        """
+        End the pass over all tiles.
 
-    '''
-    file i/o
-    '''
-    # untar files
-    t_o = tarfile.open(input_gz, 'r:gz')
+        :return: <bool> True if all percentiles are resolved.
+        """
+        import numpy as np
 
-    try:
-        print("Extracting to {0}...".format(os.path.dirname(input_gz)))
-        t_o.extractall(path=os.path.dirname(input_gz))
+        self.passes += 1
 
-    except:
-        print("Problem extracting .tar.gz file {0}".format(input_gz))
-        sys.exit(1)
+        if self.n == 0 or self.n_nan:
+            return self.done()
 
-    # find all band files
-    dir_in = os.path.dirname(input_gz)
+        cum = np.cumsum(self.hist)
 
-    bands = glob.glob(dir_in + os.sep + "*band*.tif")
+        for q in self.percentiles:
+            vi, lo, hi = percentile_ranks(self.n, q)
+            a = self._estimate(lo, cum)
+            b = self._estimate(hi, cum)
 
-    # get base name of first band
-    fn = os.path.basename(bands[0])
-    print("File base name: {0}".format(fn))
+            if a is not None and b is not None:
+                self.values[q] = interpolate(a, b, vi, lo)
 
-    # if Collection 1 data, check first four digits for sensor
-    if fn[2] == '0':
+        return self.done()
 
-        lsat_coll = True
+    def done(self):
+        """Check if all percentiles are resolved."""
+        return self.passes > 0 and (self.n == 0 or self.n_nan > 0 or
+                                    len(self.values) ==
+                                    len(self.percentiles))
 
-        # remove sensor/solar angles from band list
-        bands = [i for i in bands if 'sensor' not in i and
-                 'solar' not in i]
+    def percentile(self, q, transform=None):
+        """
+        Get a resolved percentile.
 
-        if fn[2:4] == '08':
-            band_col = band_by_sensor(True, bands)
-        else:
-            band_col = band_by_sensor(False, bands)
+        :param q: <float> Percentile (0-100), one of those given.
+        :param transform: <function> Applied to the estimated percentile
+                          (default=None).
+        :return: <numpy.float64> Percentile; None if there were no values.
+        """
+        import numpy as np
 
-    else:
+        if self.n + self.n_nan == 0:
+            return None
 
-        lsat_coll = False
+        if self.n_nan:
+            return np.float64(np.nan)
 
-        if fn[2] == '8':
-            band_col = band_by_sensor(True, bands)
-        else:
-            band_col = band_by_sensor(False, bands)
+        if transform is not None:
+            return transform(self.values[q])
+
+        return self.values[q]
+
+
+def thermal(therm_dn):
+    """
+    Scale thermal band values to Celsius * 100.
+
+    :param therm_dn: <numpy.ndarray> Brightness temperature (Kelvin * 10).
+    :return: <numpy.ndarray>
+    """
+    import numpy as np
+
+    therm = np.asarray(therm_dn, dtype=np.float64) * 0.1
+    therm -= 273.15
+    therm *= 100
+
+    return therm
 
-    # read first file for geo params for output band
-    geo_out = gdal.Open(bands[0], gdal.GA_ReadOnly)
 
-    # read input files
-    print("Reading input files as arrays...")
-    # blue = read_bands(band_col['blue'])
+def tile_tests(blue, green, red, nir, swir1, swir2, therm_dn):
+    """
+    Run the cloud, snow and water tests (diag bits 0-6) on a tile. Each
+    condition is computed once into a reused boolean buffer (ufuncs with
+    out=, in-place &= and |=) and applied by boolean indexing.
 
-    # read in bands
-    blue = read_bands(band_col['blue'])
-    green = read_bands(band_col['green'])
-    red = read_bands(band_col['red'])
-    nir = read_bands(band_col['nir'])
-    swir1 = read_bands(band_col['swir1'])
-    swir2 = read_bands(band_col['swir2'])
+    :param blue...swir2: <numpy.ndarray> TOA reflectance of the tile.
+    :param therm_dn: <numpy.ndarray> Brightness temperature of the tile.
+    :return: <dict> Tile bands, valid (non-fill) mask, indices, whiteness,
+             diagnostic word (bits 0-6 set), water, saturation and cloud
+             masks, clear, clear land and clear water masks, and pixel
+             counts.
+    """
+    import numpy as np
 
-    # read thermal band (note it is scaled as [Celsius * 100])
-    therm = (np.asfarray(read_bands(band_col['therm'])) * 0.1 - 273.15) * 100
+    # thermal band is scaled as [Celsius * 100]
+    therm = thermal(therm_dn)
 
-    # Find pixels marekd as fill for all bands (output: mutual fill mask)
-    print("Determining fill mask based upon all input bands...")
+    # Find pixels marked as fill for all bands (output: mutual fill mask)
     fill = min_bound(blue, green, red, nir, swir1, swir2, therm)
+    valid = np.logical_not(fill)
 
     # calculate indices
-    print("Calculating spectral indices...")
     ndvi = calc_si(nir, red)
     ndsi = calc_si(green, swir1)
 
+    shape = np.shape(fill)
+
+    # scratch masks
+    m = np.empty(shape, dtype=bool)
+    tmp = np.empty(shape, dtype=bool)
+
+    counts = {}
+
+    # diagnostic word, each test sets its bit (see DIAG_TESTS)
+    word = np.zeros(shape, dtype="uint16")
+
     '''
     cloud test 0
     '''
-    print("Basic test (diag bit 0)...")
-
-    # make initial array of zeros, equal to other arrays
-    r0 = np.zeros(np.shape(fill), dtype="uint32")
-
-    # 1 == pixel potentially a cloud based upon said tests
-    r0[np.where((ndsi < 0.8) & (ndvi < 0.8) & (swir2 > 300)
-                & (fill == False))] = 1
+    # pixel potentially a cloud based upon said tests
+    np.less(ndsi, 0.8, out=m)
+    m &= np.less(ndvi, 0.8, out=tmp)
+    m &= np.greater(swir2, 300, out=tmp)
+    m &= valid
+    np.bitwise_or(word, D_BASIC, out=word, where=m)
 
     '''
     cloud test 1
     '''
-    print("Thermal test (diag bit 1)...")
-    r1 = np.zeros(np.shape(fill), dtype="uint32")
-    cld = np.zeros(np.shape(fill), dtype="uint32")
-
-    # 10 == pixel potentially a cloud based upon r0 and thermal test
-    r1[np.where((r0 == 1) & (therm < 2700) & (fill == False))] = 10
-
-    cld[np.where((r0 == 1) & (therm < 2700) & (fill == False))] = 1
+    # pixel potentially a cloud based upon test 0 and thermal test
+    cld = np.less(therm, 2700)
+    cld &= m
+    np.bitwise_or(word, D_THERMAL, out=word, where=cld)
 
     '''
     cloud test 5
     '''
-    print("Basic snow test (diag bit 5)...")
-    r5 = np.zeros(np.shape(fill), dtype="uint32")
-    snow = np.zeros(np.shape(fill), dtype="uint32")
-
-    snow[np.where((ndsi > 0.15) & (nir > 1100) & (green > 1000) &
-                  (fill == False))] = 1
-
-    # 100,000 = pixel is snow
-    r5[np.where((snow == 1) & (therm < 1000) & (fill == False))] = 100000
-
-    # clean up vars
-    snow = None
+    # pixel is snow
+    np.greater(ndsi, 0.15, out=m)
+    m &= np.greater(nir, 1100, out=tmp)
+    m &= np.greater(green, 1000, out=tmp)
+    m &= np.less(therm, 1000, out=tmp)
+    m &= valid
+    np.bitwise_or(word, D_SNOW, out=word, where=m)
 
     '''
     cloud test 6
     '''
-    print("Basic water test (diag bit 6)...")
-    r6 = np.zeros(np.shape(fill), dtype="uint32")
-
-    # 1,000,000 = pixel is water
-    r6[np.where(((ndvi < 0.01) & (nir < 1100) & (fill == False)) |
-                ((ndvi < 0.1) & (ndvi > 0.0) & (nir < 500)
-                 & (fill == False)))] = 1000000
-
-    print("No. of water pixels: {0}".format(np.sum(r6 == 1000000)))
+    # pixel is water
+    water = np.less(ndvi, 0.01)
+    water &= np.less(nir, 1100, out=tmp)
+    np.less(ndvi, 0.1, out=m)
+    m &= np.greater(ndvi, 0.0, out=tmp)
+    m &= np.less(nir, 500, out=tmp)
+    water |= m
+    water &= valid
+    np.bitwise_or(word, D_WATER, out=word, where=water)
+
+    counts['water'] = np.count_nonzero(water)
 
     '''
     cloud test 2
     '''
-    print("Whiteness test (diag bit 2)...")
-    r2 = np.zeros(np.shape(fill), dtype="uint32")
-    sat = np.zeros(np.shape(fill), dtype="uint32")
-
     # get visible mean
-    visi_mean = np.asfarray(blue + green + red) / 3.0
+    visi_mean = np.asarray(blue + green + red, dtype=np.float64)
+    visi_mean /= 3.0
 
     # do whiteness calculation
-    whiteness = np.asfarray(np.abs(blue - visi_mean) +
-                            np.abs(green - visi_mean) +
-                            np.abs(red - visi_mean)) / visi_mean
+    whiteness = np.subtract(blue, visi_mean)
+    np.abs(whiteness, out=whiteness)
+    f_tmp = np.subtract(green, visi_mean)
+    whiteness += np.abs(f_tmp, out=f_tmp)
+    np.subtract(red, visi_mean, out=f_tmp)
+    whiteness += np.abs(f_tmp, out=f_tmp)
+    whiteness /= visi_mean
+
+    # mark whiteness as 100 if visi_mean == 0.0 (0.0 in land probability)
+    visi_zero = np.equal(visi_mean, 0.0)
+    visi_zero &= valid
+    whiteness[visi_zero] = 100.0
 
-    # mark whiteness as 100 if visi_mean == 0.0
-    whiteness[np.where((visi_mean == 0.0) & (fill == False))] = 100.0
+    # clean up variables that aren't used later
+    visi_mean = None
+    f_tmp = None
 
     # set saturation flag
-    print("Setting saturation flag...")
-    sat[np.where((blue >= 19999) | (green >= 19999) | (red >= 19999))] = 1
-    print("# of saturated pixels: {0}".format(np.sum(sat == 1)))
+    sat = np.greater_equal(blue, 19999)
+    sat |= np.greater_equal(green, 19999, out=tmp)
+    sat |= np.greater_equal(red, 19999, out=tmp)
+    counts['saturated'] = np.count_nonzero(sat)
 
     # set any pixels where B|G|R is saturated to whiteness of 0.0
-    whiteness[np.where((sat == 1) & (fill == False))] = 0.0
+    np.logical_and(sat, valid, out=m)
+    whiteness[m] = 0.0
 
-    # 100 == pixel is cloud (r1 == 10) and if whiteness < 0.7
-    r2[np.where((cld == 1) & (whiteness < 0.7) & (fill == False))] = 100
+    # pixel is cloud (test 1) and if whiteness < 0.7
+    np.less(whiteness, 0.7, out=m)
+    m &= cld
+    m &= valid
+    np.bitwise_or(word, D_WHITENESS, out=word, where=m)
 
-    # set cloud bit (to be read/modified in later tests)
-    cld[np.where((cld == 1) & (whiteness < 0.7) & (fill == False))] = 1
-
-    print("# of cloud pixels marked as cloud before whiteness test: {0}".
-          format(np.sum(cld == 1)))
+    counts['cloud_whiteness'] = np.count_nonzero(cld)
 
     '''set all other potential cloud pixels failing whiteness test back to 0
     # ref: https://github.com/USGS-EROS/espa-cloud-masking/blob/master/cfmask/
         src/potential_cloud_shadow_snow_mask.c#L417'''
-    cld[np.where((cld == 1) & (whiteness >= 0.7) & (fill == False))] = 0
+    np.greater_equal(whiteness, 0.7, out=m)
+    m &= valid
+    cld &= np.logical_not(m, out=m)
 
-    # clean up variables that aren't used later
-    whiteness = None
-    visi_mean = None
-
-    print("# of pixels failing the whiteness test: {0}".format(np.sum(
-        (cld == 0) & (fill == False))))
-
-    print("# of pixels still marked as cloud: {0}".format(np.sum(cld == 1)))
+    counts['fail_whiteness'] = np.count_nonzero(
+        np.logical_and(valid, np.logical_not(cld, out=m), out=m))
+    counts['cloud'] = np.count_nonzero(cld)
 
     '''
     cloud tests 3&4
     '''
-    print("Haze optimized tests (diag bits 3&4)...")
-
-    r3 = np.zeros(np.shape(fill), dtype="uint32")
-    r4 = np.zeros(np.shape(fill), dtype="uint32")
-
     # hot1
-    h1 = np.asfarray(blue) - 0.5 * np.asfarray(red) - 800.0
-
-    # 1,000 == hot1 failed, pixel is a cloud
-    r3[np.where((cld == 1) & (fill == False) &
-                ((h1 > 0.0) | (sat == 1)))] = 1000
-    # cld[np.where((r3 == 1000) & (fill == False))] = 1
+    h = np.asarray(blue, dtype=np.float64)
+    h -= 0.5 * np.asarray(red, dtype=np.float64)
+    h -= 800.0
 
-    # remove cloud bit if hot1 passed
-    cld[np.where((r3 != 1000) & (fill == False))] = 0
+    # hot1 failed, pixel is a cloud; otherwise remove cloud bit
+    np.greater(h, 0.0, out=m)
+    m |= sat
+    cld &= m
+    np.bitwise_or(word, D_HOT1, out=word, where=cld)
 
     # hot2
-    cld_swir = (cld == 1) & (swir1 != 0.0)
-    h2 = np.asfarray(nir) / np.asfarray(swir1)
+    cld &= np.not_equal(swir1, 0.0, out=tmp)
+    np.divide(np.asarray(nir, dtype=np.float64),
+              np.asarray(swir1, dtype=np.float64), out=h)
 
-    # 10,000 == hot2 test failed, pixel is a cloud
-    r4[np.where((fill == False) & (cld_swir == True) & (h2 > 0.75))] = 10000
+    # hot2 test failed, pixel is a cloud
+    np.greater(h, 0.75, out=m)
+    m &= cld
+    np.bitwise_or(word, D_HOT2, out=word, where=m)
 
-    # remove cloud bit if hot2 passed
-    cld[np.where((cld_swir == True) & (h2 <= 0.75) & (fill == False))] = 0
-    # remove cloud bit if cld_swir == False
-    cld[np.where((cld_swir == False) & (fill == False))] = 0
+    # remove cloud bit if hot2 passed (or swir1 == 0.0)
+    cld &= np.logical_not(np.less_equal(h, 0.75, out=m), out=m)
 
     # clean up vars
-    h1 = None
-    h2 = None
-    cld_swir = None
+    h = None
 
     '''
     reserved location for cirrus test
@@ -409,23 +959,368 @@ def diag(input_gz, cloud_prob_threshold=22.5, t_buffer=400.0):
     '''
     set clear and land bits
     '''
-    print("Setting clear water and clear land bits...")
-    c_land = np.zeros(np.shape(fill), dtype="uint32")
-    c_water = np.zeros(np.shape(fill), dtype="uint32")
+    clear = np.logical_not(cld)
+    clear &= valid
+
+    c_water = np.logical_and(clear, water)
+    c_land = np.logical_and(clear, np.logical_not(water, out=m))
+
+    # number of clear and valid pixels
+    counts['clear'] = np.count_nonzero(clear)
+    counts['valid'] = np.count_nonzero(valid)
+
+    counts['land'] = np.count_nonzero(c_land)
+    counts['clear_water'] = np.count_nonzero(c_water)
+
+    # flag saturated pixels in thermal band
+    t_sat = therm >= (((19999 * 0.1) - 273.15) * 100)
+    counts['t_saturated'] = np.count_nonzero(t_sat)
+
+    return {'blue': blue, 'green': green, 'red': red, 'nir': nir,
+            'swir1': swir1, 'therm_dn': therm_dn, 'therm': therm,
+            'valid': valid, 'ndvi': ndvi, 'ndsi': ndsi,
+            'whiteness': whiteness, 'visi_zero': visi_zero, 'sat': sat,
+            'cld': cld, 'clear': clear, 'c_land': c_land,
+            'c_water': c_water, 't_sat': t_sat, 'word': word,
+            'water': water, 'counts': counts}
+
+
+def tile_probs(t, t_templ, t_temph, t_wtemp):
+    """
+    Calculate cloud probabilities over water and land for a tile, in place
+    where possible. Reuses (and changes) the tile's whiteness.
+
+    :param t: <dict> Tile from tile_tests.
+    :param t_templ: <float> Low land temperature threshold.
+    :param t_temph: <float> High land temperature threshold.
+    :param t_wtemp: <float> Water temperature threshold.
+    :return: <tuple> Land (final_prob) and water (wfinal_prob) cloud
+             probabilities.
+    """
+    import numpy as np
+
+    therm = t['therm']
+    valid = t['valid']
+    water = t['water']
+
+    m = np.empty(np.shape(valid), dtype=bool)
+
+    '''
+    calculate cloud probability over water
+    '''
+    wfinal_prob = np.asarray(t['swir1'], dtype=np.float64) / 1100.0
+
+    # clip brightness prob between 0.0 and 1.0
+    np.less(wfinal_prob, 0.0, out=m)
+    m &= valid
+    wfinal_prob[m] = 0.0
+    np.greater(wfinal_prob, 1.0, out=m)
+    m &= valid
+    wfinal_prob[m] = 1.0
+
+    prob = np.subtract(t_wtemp, therm)
+    prob /= 400.0
+    np.less(prob, 0.0, out=m)
+    m &= valid
+    prob[m] = 0.0
+
+    wfinal_prob *= prob
+    wfinal_prob *= 100.0
+
+    '''
+    calculate cloud probability over land
+    '''
+    # formula: vari_prob=1-max(max(NDSI,NDVI,0),whiteness), whiteness 0.0
+    # where visible mean is 0.0
+    whiteness = t['whiteness']
+    whiteness[t['visi_zero']] = 0.0
+
+    final_prob = np.maximum(t['ndvi'], t['ndsi'])
+    final_prob[final_prob < 0.0] = 0.0
+    np.maximum(final_prob, whiteness, out=final_prob)
+    np.subtract(1.0, final_prob, out=final_prob)
+
+    np.subtract(t_temph, therm, out=prob)
+    prob /= (t_temph - t_templ)
+    np.less(prob, 0.0, out=m)
+    m &= valid
+    prob[m] = 0.0
+
+    final_prob *= prob
+    final_prob *= 100.0
+
+    # set water final_prob and land wfinal_prob to 0.0
+    final_prob[water] = 0.0
+    np.logical_not(water, out=m)
+    m &= valid
+    wfinal_prob[m] = 0.0
+
+    return final_prob, wfinal_prob
+
+
+def tile_conf(t, final_prob, wfinal_prob, t_templ, t_buffer, clr_mask,
+              wclr_mask):
+    """
+    Assign confidence levels to a tile (diag bits 7-11). The mask of each
+    test is computed once and sets both the confidence and the diag bit.
+
+    :param t: <dict> Tile from tile_tests; its diagnostic word is completed.
+    :param final_prob: <numpy.ndarray> Land cloud probability of the tile.
+    :param wfinal_prob: <numpy.ndarray> Water cloud probability of the tile.
+    :param t_templ: <float> Low land temperature threshold.
+    :param t_buffer: <float> Temperature probability buffer.
+    :param clr_mask: <float> Land cloud threshold.
+    :param wclr_mask: <float> Water cloud threshold.
+    :return: <tuple> Diagnostic word (all bits) and confidence (c_conf)
+             rasters.
+    """
+    import numpy as np
+
+    valid = t['valid']
+    water = t['water']
+    word = t['word']
+
+    shape = np.shape(valid)
+    m = np.empty(shape, dtype=bool)
+    tmp = np.empty(shape, dtype=bool)
+
+    c_conf = np.zeros(shape, dtype="uint8")
+
+    # a
+    # Note: all pixels passing test a will not be tested in subsequent tests
+    np.less(t['therm'], t_templ + t_buffer - 3500.0, out=m)
+    m &= valid
+    c_conf[m] = 3
+    np.bitwise_or(word, D_CONF_A, out=word, where=m)
+
+    # cloud pixels left for tests b-e
+    cand = np.logical_not(m)
+    cand &= t['cld']
+    cand &= valid
+
+    land = np.logical_not(water)
+
+    # b: high conf over water
+    test_b = np.greater(wfinal_prob, wclr_mask)
+    test_b &= water
+    test_b &= cand
+    c_conf[test_b] = 3
+    np.bitwise_or(word, D_CONF_B, out=word, where=test_b)
+
+    # c: high conf over land
+    test_c = np.greater(final_prob, clr_mask)
+    test_c &= land
+    test_c &= cand
+    c_conf[test_c] = 3
+    np.bitwise_or(word, D_CONF_C, out=word, where=test_c)
+
+    # d: medium conf over water
+    np.greater(wfinal_prob, wclr_mask - 10.0, out=m)
+    m &= water
+    m &= cand
+    m &= np.logical_not(test_b, out=tmp)
+    c_conf[m] = 2
+    np.bitwise_or(word, D_CONF_D, out=word, where=m)
+
+    # e: medium conf over land
+    np.greater(final_prob, clr_mask - 10.0, out=m)
+    m &= land
+    m &= cand
+    m &= np.logical_not(test_c, out=tmp)
+    c_conf[m] = 2
+    np.bitwise_or(word, D_CONF_E, out=word, where=m)
+
+    # f
+    # low confidence == 0, set to 1
+    np.equal(c_conf, 0, out=m)
+    m &= valid
+    c_conf[m] = 1
+
+    return word, c_conf
+
+
+def diag_decimal(word):
+    """
+    Convert diagnostic words to the decimal-coded diag band, the sum of
+    the values of the tests passed (see DIAG_TESTS).
+
+    :param word: <numpy.ndarray> Diagnostic words.
+    :return: <numpy.ndarray> uint32 diag band.
+    """
+    import numpy as np
+
+    r_out = np.zeros(np.shape(word), dtype="uint32")
+
+    for bit, value, meaning in DIAG_TESTS:
+        r_out[(word & bit) != 0] += value
+
+    return r_out
+
+
+def write_diag_bits(fn_out):
+    """
+    Write the bit table of the bit-packed diag band as CSV.
+
+    :param fn_out: <str> Output file.
+    """
+    with open(fn_out, 'w') as f:
+        f.write("bit,mask,test\n")
+        for bit, value, meaning in DIAG_TESTS:
+            f.write('{0},{1},"{2}"\n'.format(bit.bit_length() - 1, bit,
+                                             meaning))
+
+
+###############################################################################
+def diag(input_gz, cloud_prob_threshold=22.5, t_buffer=400.0,
+         tile_rows=TILE_ROWS, diag_encoding='decimal', prob_bins=0,
+         dir_out=None):
+    """
+    Produce the diagnostic, confidence and cloud probability rasters of a
+    scene.
+
+    :param input_gz: <str> Path to input .tar.gz archive.
+    :param cloud_prob_threshold: <float> Cloud probability threshold.
+    :param t_buffer: <float> Temperature probability buffer.
+    :param tile_rows: <int> Rows read at a time; 0 reads the whole scene.
+    :param diag_encoding: <str> Diag band encoding (see DIAG_ENCODINGS).
+    :param prob_bins: <int> Fixed bins for the cloud probability
+                      percentiles; 0 selects them exactly.
+    :param dir_out: <str> Directory the archive is extracted to and outputs
+                    are written to; default is the archive's directory.
+    :return: <dict> Scene statistics: pixel counts, clear, water and land
+             percentages, thresholds and output paths.
+    """
+    # load libraries
+    import os
+    import sys
+    import tarfile
+    import glob
+    import time
+    import numpy as np
+    try:
+        from osgeo import gdal
+    except ImportError:
+        import gdal
+
+    if diag_encoding not in DIAG_ENCODINGS:
+        raise ValueError("Unknown diag encoding {0}; use one of {1}".format(
+            diag_encoding, DIAG_ENCODINGS))
+
+    t0 = time.time()
+    print("Start time: {0}".format(time.asctime()))
+
+    '''
+    file i/o
+    '''
+    # extract next to the archive, or to the output directory
+    if dir_out is None:
+        dir_in = os.path.dirname(input_gz)
+    else:
+        dir_in = dir_out
+        if not os.path.isdir(dir_in):
+            os.makedirs(dir_in)
+
+    # untar files
+    t_o = tarfile.open(input_gz, 'r:gz')
+
+    try:
+        print("Extracting to {0}...".format(dir_in))
+        t_o.extractall(path=dir_in)
+
+    except:
+        print("Problem extracting .tar.gz file {0}".format(input_gz))
+        sys.exit(1)
+
+    # find all band files
+    bands = glob.glob(dir_in + os.sep + "*band*.tif")
+
+    # get base name of first band
+    fn = os.path.basename(bands[0])
+    print("File base name: {0}".format(fn))
+
+    # if Collection 1 data, check first four digits for sensor
+    if fn[2] == '0':
+
+        lsat_coll = True
+
+        # remove sensor/solar angles from band list
+        bands = [i for i in bands if 'sensor' not in i and
+                 'solar' not in i]
+
+        if fn[2:4] == '08':
+            band_col = band_by_sensor(True, bands)
+        else:
+            band_col = band_by_sensor(False, bands)
+
+    else:
+
+        lsat_coll = False
+
+        if fn[2] == '8':
+            band_col = band_by_sensor(True, bands)
+        else:
+            band_col = band_by_sensor(False, bands)
+
+    # read first file for geo params for output band
+    geo_out = gdal.Open(bands[0], gdal.GA_ReadOnly)
+
+    # open input files, read tile by tile in each pass
+    rasts = [gdal.Open(band_col[b], gdal.GA_ReadOnly) for b in
+             ('blue', 'green', 'red', 'nir', 'swir1', 'swir2', 'therm')]
+
+    therm_type = rasts[6].GetRasterBand(1).ReadAsArray(0, 0, 1, 1).dtype
+
+    '''
+    pass 1: tests and scene statistics
+    '''
+    print("Pass 1: cloud, snow and water tests (diag bits 0-6), scene "
+          "statistics...")
+
+    counts = {}
+
+    # thermal values of clear land, clear water and all clear pixels, for
+    # the temperature percentiles
+    bt_sel = {'land': RankSelect(therm_type, [17.5, 82.5]),
+              'water': RankSelect(therm_type, [82.5]),
+              'clear': RankSelect(therm_type, [17.5, 82.5])}
+
+    def select_bt(t, names):
+        ok = np.logical_not(t['t_sat'])
+        for name in names:
+            if name == 'land':
+                sel = t['c_land'] & ok
+            elif name == 'water':
+                sel = t['c_water'] & ok
+            else:
+                sel = t['clear'] & ok
+            bt_sel[name].update(t['therm_dn'][sel])
+
+    for yoff, tile in read_tiles(rasts, tile_rows):
+        t = tile_tests(*tile)
 
-    c_water[np.where((r6 != 0) & (cld == 0) & (fill == False))] = 1
-    c_land[np.where((r6 == 0) & (cld == 0) & (fill == False))] = 1
+        for k, v in t['counts'].items():
+            counts[k] = counts.get(k, 0) + v
+
+        select_bt(t, bt_sel)
+
+    print("No. of water pixels: {0}".format(counts['water']))
+    print("# of saturated pixels: {0}".format(counts['saturated']))
+    print("# of cloud pixels marked as cloud before whiteness test: {0}".
+          format(counts['cloud_whiteness']))
+    print("# of pixels failing the whiteness test: {0}".format(
+        counts['fail_whiteness']))
+    print("# of pixels still marked as cloud: {0}".format(counts['cloud']))
 
     print("Counting clear bits, clear water bits, and clear lands bits...")
 
     # determine number of clear pixels
-    c_clear = np.sum((cld == 0) & (fill == False))
+    c_clear = counts['clear']
 
     # determine number of valid pixels
-    c_count = np.sum(fill == False)
+    c_count = counts['valid']
 
-    c_land_count = np.sum((c_land == 1) & (fill == False))
-    c_water_count = np.sum((c_water == 1) & (fill == False))
+    c_land_count = counts['land']
+    c_water_count = counts['clear_water']
 
     print("Total # of non-fill pixels: {0}".format(c_count))
     print("# clear pixels: {0}".format(c_clear))
@@ -456,143 +1351,131 @@ def diag(input_gz, cloud_prob_threshold=22.5, t_buffer=400.0):
     land thermal test
     '''
     print("Calculating temperature statistics...")
-
-    # flag saturated pixels in thermal band
-    t_sat = therm >= (((19999 * 0.1) - 273.15) * 100)
-    print("No of saturated thermal pixels: {0}".format(np.sum(t_sat == True)))
+    print("No of saturated thermal pixels: {0}".format(
+        counts['t_saturated']))
 
     # make sure enough land for test (>=10%), otherwise use all clear pixels
     if land_ptm >= 0.1:
-        land_bt = therm[np.where((c_land == 1) & (t_sat == False)
-                                 & (fill == False))]
-
-        land_bit = c_land == 1
-
+        land_name = 'land'
     else:
         print("Less than 10% cloud-free land. Using all clear pixels instead.")
-        land_bt = therm[
-            np.where((cld == 0) & (t_sat == False) & (fill == False))]
-
-        land_bit = cld == 0
-
-    if len(land_bt) == 0:
-        print("No cloud-free land pixels. Setting land_bt to 0.")
-        land_bt = 0
+        land_name = 'clear'
 
     # water thermal test
     # make sure enough water for test (>=10%), otherwise use all clear pixels
     if water_ptm >= 0.1:
-        water_bt = therm[np.where((c_water == 1) & (t_sat == False)
-                                  & (fill == False))]
-
-        water_bit = c_water == 1
-
+        water_name = 'water'
     else:
         print(
             "Less than 10% cloud-free water. Using all clear pixels instead.")
-        water_bt = therm[np.where((cld == 0) & (t_sat == False) &
-                                  (fill == False))]
-
-        water_bit = cld == 0
-
-    if len(water_bt) == 0:
-        print("No cloud-free water pixels. Setting water_bt to 0.")
-        water_bt = 0
+        water_name = 'clear'
+
+    # thermal values of more than 16 bits need further passes
+    names = set([land_name, water_name])
+    for name in names:
+        bt_sel[name].finish_pass()
+
+    while not all(bt_sel[name].done() for name in names):
+        print("Pass {0}: temperature percentiles...".format(
+            bt_sel[land_name].passes + 1))
+        for yoff, tile in read_tiles(rasts, tile_rows):
+            select_bt(tile_tests(*tile),
+                      [name for name in names if not bt_sel[name].done()])
+        for name in names:
+            if not bt_sel[name].done():
+                bt_sel[name].finish_pass()
 
     '''
     calculate temperature percentiles
     '''
     print("Calculating temperature percentiles...")
-    t_templ = np.percentile(land_bt, 17.5) - t_buffer
+    if bt_sel[land_name].n == 0:
+        print("No cloud-free land pixels. Setting land_bt to 0.")
+
+    if bt_sel[water_name].n == 0:
+        print("No cloud-free water pixels. Setting water_bt to 0.")
+
+    def bt_percentile(name, q):
+        p = bt_sel[name].percentile(q, thermal)
+        return np.percentile(0, q) if p is None else p
+
+    t_templ = bt_percentile(land_name, 17.5) - t_buffer
     print("t_templ: {0}".format(str(t_templ)))
 
-    t_temph = np.percentile(land_bt, 82.5) + t_buffer
+    t_temph = bt_percentile(land_name, 82.5) + t_buffer
     print("t_temph: {0}".format(str(t_temph)))
 
-    t_wtemp = np.percentile(water_bt, 82.5)
+    t_wtemp = bt_percentile(water_name, 82.5)
     print("t_wtemp: {0}".format(str(t_wtemp)))
 
     '''
-    calculate cloud probability over water
+    pass 2: cloud probabilities, for dynamic cloud thresholds
     '''
-    print("Calculating cloud probability over water...")
-
-    brightness_prob = np.asfarray(swir1) / 1100.0
-
-    # clip brightness prob between 0.0 and 1.0
-    brightness_prob[np.where((brightness_prob < 0.0) & (fill == False))] = 0.0
-    brightness_prob[np.where((brightness_prob > 1.0) & (fill == False))] = 1.0
-
-    wtemp_prob = (t_wtemp - np.asfarray(therm)) / 400.0
-    wtemp_prob[np.where((wtemp_prob < 0.0) & (fill == False))] = 0.0
-
-    brightness_prob = brightness_prob * wtemp_prob
-
-    wfinal_prob = brightness_prob * 100.0
-
-    # clean up
-    w_p = None
-    brightness_prob = None
-    wtemp_prob = None
-
-    '''
-    calculate cloud probability over land
-    '''
-    print("Calculating cloud probability over land...")
-    ndvi_land = np.ma.masked_where(r6 == 0, ndvi)
-    ndsi_land = np.ma.masked_where(r6 == 0, ndsi)
-
-    ndvi_land[ndvi_land < 0.0] = 0.0
-    ndsi_land[ndsi_land < 0.0] = 0.0
-
-    visi_mean2 = np.asfarray(blue + green + red) / 3.0
-
-    whiteness2 = np.asfarray(np.abs(blue - visi_mean2) +
-                             np.abs(green - visi_mean2) +
-                             np.abs(red - visi_mean2)) / visi_mean2
-
-    # zero out pixels where visi_mean2 == 0.0
-    whiteness2[np.where((visi_mean2 == 0.0) & (fill == False))] = 0.0
-
-    # zero out saturated pixels
-    whiteness2[np.where((sat == 1) & (fill == False))] = 0.0
-
-    whit_land = np.ma.masked_where(r6 == 0, whiteness2)
-
-    # find maximum pixel value in each stack of pixels
-    # formula: vari_prob=1-max(max(abs(NDSI),abs(NDVI)),whiteness)
-    vi_max = np.max(np.dstack((abs(ndvi_land), abs(ndsi_land))), axis=2)
-    vari_prob = 1.0 - np.max(np.dstack((vi_max, whit_land)), axis=2)
-
-    temp_prob = (t_temph - np.asfarray(therm)) / (t_temph - t_templ)
-    temp_prob[np.where((temp_prob < 0.0) & (fill == False))] = 0.0
-
-    vari_prob *= temp_prob
-
-    final_prob = vari_prob * 100.0
-
-    # set water final_prob and land wfinal_prob to 0.0
-    final_prob[np.where((r6 != 0) & (fill == False))] = 0.0
-    wfinal_prob[np.where((r6 == 0) & (fill == False))] = 0.0
-
-    # clean up
-    f_p = None
-    temp_prob = None
-    ndvi_land = None
-    ndsi_land = None
-    whit_land = None
-    ndvi = None
-    ndsi = None
-    visi_mean2 = None
-    whiteness2 = None
+    prob_sel = {'land': RankSelect(np.float64, [82.5]),
+                'water': RankSelect(np.float64, [82.5])}
+
+    # with prob_bins, the first pass also bins the probabilities; a
+    # percentile within PROB_RANGE is then taken from the bins, and one
+    # outside it is selected exactly
+    prob_bin = {}
+    if prob_bins > 0:
+        print("Binning cloud probabilities: {0} bins over {1} (error <= "
+              "{2})".format(prob_bins, PROB_RANGE,
+                            (PROB_RANGE[1] - PROB_RANGE[0]) / prob_bins))
+        for name in prob_sel:
+            prob_bin[name] = BinnedPercentile(PROB_RANGE, prob_bins, [82.5])
+
+    prob_passes = 0
+
+    while not all(sel.done() for sel in prob_sel.values()):
+        prob_passes += 1
+        print("Pass {0}: cloud probability over water and land...".format(
+            bt_sel[land_name].passes + prob_passes))
+
+        for yoff, tile in read_tiles(rasts, tile_rows):
+            t = tile_tests(*tile)
+            final_prob, wfinal_prob = tile_probs(t, t_templ, t_temph,
+                                                 t_wtemp)
+
+            # clear land (or all clear) and clear water (or all clear)
+            # pixels
+            land_bit = t['c_land'] if land_name == 'land' else t['clear']
+            water_bit = t['c_water'] if water_name == 'water' else \
+                t['clear']
+
+            for name, prob, bit in (('land', final_prob, land_bit),
+                                    ('water', wfinal_prob, water_bit)):
+                if prob_sel[name].done():
+                    continue
+
+                values = prob[bit]
+                prob_sel[name].update(values)
+                if name in prob_bin:
+                    prob_bin[name].update(values)
+
+        for name, sel in list(prob_sel.items()):
+            if not sel.done():
+                sel.finish_pass()
+
+            if name in prob_bin:
+                binned = prob_bin.pop(name)
+                if binned.finish_pass():
+                    if not sel.done():
+                        prob_sel[name] = binned
+                else:
+                    print("Cloud probability percentile ({0}) outside "
+                          "binned range; selecting it exactly.".format(name))
 
     '''
     calculate dynamic land cloud threshold
     '''
     print("Calculating dynamic land cloud threshold...")
 
-    clr_mask = np.percentile(final_prob[((land_bit == True) &
-                                         (fill == False))], 82.5)
+    def prob_percentile(sel, q):
+        p = sel.percentile(q)
+        return np.percentile(np.zeros(0), q) if p is None else p
+
+    clr_mask = prob_percentile(prob_sel['land'], 82.5)
 
     clr_mask += cloud_prob_threshold
 
@@ -601,88 +1484,15 @@ def diag(input_gz, cloud_prob_threshold=22.5, t_buffer=400.0):
     # calculate dynamic water cloud threshold
     print("Calculating dynamic water cloud threshold...")
 
-    wclr_mask = np.percentile(wfinal_prob[((water_bit == True) &
-                                           (fill == False))], 82.5)
+    wclr_mask = prob_percentile(prob_sel['water'], 82.5)
 
     wclr_mask += cloud_prob_threshold
 
     print("wclr_mask: {0}".format(wclr_mask))
 
     '''
-    assign confidence levels
-    '''
-    print("Assigning confidence levels...")
-    c_conf = np.zeros(np.shape(fill), dtype="uint32")
-
-    # a
-    print("Confidence test a (diag bit 7)...")
-    r7 = np.zeros(np.shape(fill), dtype="uint32")
-
-    # Note: all pixels passing test a will not be tested in subsequent tests
-    c_conf[np.where((np.asfarray(therm) < (t_templ + t_buffer - 3500.0)) &
-                    (fill == False))] = 3
-
-    # 10,000,000 == test a passed (high conf.)
-    r7[np.where((np.asfarray(therm) < (t_templ + t_buffer - 3500.0)) &
-                (fill == False))] = 10000000
-
-    # b
-    print("Confidence test b (diag bit 8)...")
-    r8 = np.zeros(np.shape(fill), dtype="uint32")
-    c_conf[np.where((r6 != 0) & (wfinal_prob > wclr_mask)
-                    & (cld == 1) & (fill == False) & (r7 == 0))] = 3
-
-    # 100,000,000 == test b passed (high conf over water)
-    r8[np.where((r6 != 0) & (wfinal_prob > wclr_mask)
-                & (cld == 1) & (fill == False) & (r7 == 0))] = 100000000
-
-    # c
-    print("Confidence test c (diag bit 9)...")
-    r9 = np.zeros(np.shape(fill), dtype="uint32")
-    c_conf[np.where((r6 == 0) & (final_prob > clr_mask)
-                    & (cld == 1) & (fill == False) & (r7 == 0))] = 3
-
-    # 1,000,000,000 == test c passed (high conf over land)
-    r9[np.where((r6 == 0) & (final_prob > clr_mask)
-                & (cld == 1) & (fill == False) & (r7 == 0))] = 1000000000
-
-    # d
-    print("Confidence test d (diag bit 10)...")
-    r10 = np.zeros(np.shape(fill), dtype="uint32")
-    c_conf[np.where((r6 != 0) & (wfinal_prob > wclr_mask - 10.0)
-                    & (cld == 1) & (fill == False) & (r7 == 0)
-                    & (r8 == 0))] = 2
-
-    # 2 == test d passed (medium conf over water)
-    r10[np.where((r6 != 0) & (wfinal_prob > wclr_mask - 10.0)
-                 & (cld == 1) & (fill == False) & (r7 == 0)
-                 & (r8 == 0))] = 2
-
-    # e
-    print("Confidence test e (diag bit 11)...")
-    r11 = np.zeros(np.shape(fill), dtype="uint32")
-    c_conf[np.where((r6 == 0) & (final_prob > clr_mask - 10.0)
-                    & (cld == 1) & (fill == False) & (r7 == 0)
-                    & (r9 == 0))] = 2
-
-    # 20 == test e passed (high conf over land)
-    r11[np.where((r6 == 0) & (final_prob > clr_mask - 10.0)
-                 & (cld == 1) & (fill == False) & (r7 == 0)
-                 & (r9 == 0))] = 20
-
-    # f
-    # low confidence == 0, set to 1
-    c_conf[np.where((c_conf == 0) & (fill == False))] = 1
-
-    '''
-    sum all tests
+    pass 3: assign confidence levels, write outputs
     '''
-    print("Summing test diagnostics...")
-    r_out = r0 + r1 + r2 + r3 + r4 + r5 + r6 + r7 + r8 + r9 + r10 + r11
-
-    # write band of summed tests
-    print("Writing out data...")
-
     # make output file name
     fpath, fname = os.path.split(bands[0])
 
@@ -694,139 +1504,74 @@ def diag(input_gz, cloud_prob_threshold=22.5, t_buffer=400.0):
         # if pre-collection data, grab specific characters
         l_id = fname[0:21]
 
-    fn_out = fpath + os.sep + l_id + "_cfmask_diag.tif"
-    fn_out_c = fpath + os.sep + l_id + "_cfmask_conf_diag.tif"
-    fp_out = fpath + os.sep + l_id + "_prob.tif"
-    fwp_out = fpath + os.sep + l_id + "_wprob.tif"
-    '''
-    # fill_out = fpath + os.sep + l_id + "_fill.tif"
-    # visi_out = fpath + os.sep + l_id + "_visi_mean.tif"
-    # whit_out = fpath + os.sep + l_id + "_whiteness_test.tif"
-    # cld_out = fpath + os.sep + l_id + "_cld.tif"
-    # ndvi_out = fpath + os.sep + l_id + "_ndvi.tif"
-    # ndvi_l = fpath + os.sep + l_id + "_ndvi_land.tif"
-    '''
+    fn_out, fn_out_c, fp_out, fwp_out = [fpath + os.sep + l_id + suffix for
+                                         suffix in OUTPUT_SUFFIXES]
+    fb_out = fpath + os.sep + l_id + "_cfmask_diag_bits.csv"
 
     # destroy bands if they already exist
     del_file(fn_out)
+    del_file(fb_out)
     del_file(fn_out_c)
     del_file(fp_out)
     del_file(fwp_out)
-    '''
-    del_file(fill_out)
-    del_file(cld_out)
-    del_file(whit_out)
-    del_file(ndvi_out)
-    del_file(ndvi_l)
-    del_file(red_out)
-    '''
 
     # get band dimensions & geotransform
     ncol = geo_out.RasterXSize
     nrow = geo_out.RasterYSize
 
     # create empty raster
+    if diag_encoding == 'bits':
+        diag_type = gdal.GDT_UInt16
+    else:
+        diag_type = gdal.GDT_UInt32
+
     diag_ds = gdal.GetDriverByName('GTiff').Create(fn_out, ncol, nrow, 1,
-                                                   gdal.GDT_UInt32)
+                                                   diag_type)
     conf_ds = gdal.GetDriverByName('GTiff').Create(fn_out_c, ncol, nrow, 1,
                                                    gdal.GDT_Byte)
     fp_ds = gdal.GetDriverByName('GTiff').Create(fp_out, ncol, nrow, 1,
                                                  gdal.GDT_Float32)
     fwp_ds = gdal.GetDriverByName('GTiff').Create(fwp_out, ncol, nrow, 1,
                                                   gdal.GDT_Float32)
-    '''
-    fill_ds = gdal.GetDriverByName('GTiff').Create(fill_out, ncol, nrow, 1,
-                                                  gdal.GDT_Byte)
-    cld_ds = gdal.GetDriverByName('GTiff').Create(cld_out, ncol, nrow, 1,
-                                                     gdal.GDT_Byte)
-    whit_ds = gdal.GetDriverByName('GTiff').Create(whit_out, ncol, nrow, 1,
-                                                     gdal.GDT_Float32)
-    gc_ds = gdal.GetDriverByName('GTiff').Create(g_out, ncol, nrow, 1,
-                                                     gdal.GDT_Float32)
-    ndvi_ds = gdal.GetDriverByName('GTiff').Create(ndvi_out, ncol, nrow, 1,
-                                                     gdal.GDT_Float32)
-    ndvi_l_ds = gdal.GetDriverByName('GTiff').Create(ndvi_l, ncol, nrow, 1,
-                                                     gdal.GDT_Float32)
-    '''
 
     # set grid spatial reference
-    diag_ds.SetGeoTransform(geo_out.GetGeoTransform())
-    conf_ds.SetGeoTransform(geo_out.GetGeoTransform())
-    fp_ds.SetGeoTransform(geo_out.GetGeoTransform())
-    fwp_ds.SetGeoTransform(geo_out.GetGeoTransform())
-    '''
-    fill_ds.SetGeoTransform(geo_out.GetGeoTransform())
-    cld_ds.SetGeoTransform(geo_out.GetGeoTransform())
-    whit_ds.SetGeoTransform(geo_out.GetGeoTransform())
-    gc_ds.SetGeoTransform(geo_out.GetGeoTransform())
-    ndvi_ds.SetGeoTransform(geo_out.GetGeoTransform())
-    ndvi_l_ds.SetGeoTransform(geo_out.GetGeoTransform())
-    '''
-
-    diag_ds.SetProjection(geo_out.GetProjection())
-    conf_ds.SetProjection(geo_out.GetProjection())
-    fp_ds.SetProjection(geo_out.GetProjection())
-    fwp_ds.SetProjection(geo_out.GetProjection())
-    '''
-    fill_ds.SetProjection(geo_out.GetProjection())
-    cld_ds.SetProjection(geo_out.GetProjection())
-    whit_ds.SetProjection(geo_out.GetProjection())
-    gc_ds.SetProjection(geo_out.GetProjection())
-    ndvi_ds.SetProjection(geo_out.GetProjection())
-    ndvi_l_ds.SetProjection(geo_out.GetProjection())
-    '''
-
-    # get band
-    print("Writing diagnostic raster to {0}".format(fn_out))
-    diag_ds.GetRasterBand(1).WriteArray(r_out)
+    for ds in (diag_ds, conf_ds, fp_ds, fwp_ds):
+        ds.SetGeoTransform(geo_out.GetGeoTransform())
+        ds.SetProjection(geo_out.GetProjection())
+
+    print("Pass {0}: confidence tests (diag bits 7-11), writing data...".
+          format(bt_sel[land_name].passes + prob_passes + 1))
+    print("Writing diagnostic raster ({0}) to {1}".format(diag_encoding,
+                                                          fn_out))
+    if diag_encoding == 'bits':
+        print("Writing diagnostic bit table to {0}".format(fb_out))
+        write_diag_bits(fb_out)
 
     print("Writing confidence raster to {0}".format(fn_out_c))
-    conf_ds.GetRasterBand(1).WriteArray(c_conf)
+    print("Writing land cloud probability raster to {0}".format(fp_out))
+    print("Writing water cloud probability raster to {0}".format(fwp_out))
 
-    '''
-    if fill_ds:
-        convert fill to values (if writing out)
-        fill_outrast = np.zeros(np.shape(fill))
-        fill_outrast[fill == False] = 1
+    for yoff, tile in read_tiles(rasts, tile_rows):
+        t = tile_tests(*tile)
+        final_prob, wfinal_prob = tile_probs(t, t_templ, t_temph, t_wtemp)
+        word, c_conf = tile_conf(t, final_prob, wfinal_prob, t_templ,
+                                 t_buffer, clr_mask, wclr_mask)
 
-    print("Writing fill raster to {0}".format(fill_out))
-    fill_ds.GetRasterBand(1).WriteArray(fill_outrast)
-    '''
+        if diag_encoding == 'decimal':
+            word = diag_decimal(word)
 
-    print("Writing visi_mean raster to {0}".format(fp_out))
-    fp_ds.GetRasterBand(1).WriteArray(final_prob)
-
-    print("Writing visi_mean raster to {0}".format(fwp_out))
-    fwp_ds.GetRasterBand(1).WriteArray(wfinal_prob)
-
-    '''
-    print("Writing visi_mean raster to {0}".format(cld_out))
-    cld_ds.GetRasterBand(1).WriteArray(cld)
-
-    print("Writing visi_mean raster to {0}".format(whit_out))
-    whit_ds.GetRasterBand(1).WriteArray(whiteness)
-
-    print("Writing visi_mean raster to {0}".format(g_out))
-    gc_ds.GetRasterBand(1).WriteArray(g_c)
-
-    ndvi_ds.GetRasterBand(1).WriteArray(ndvi)
-    ndvi_l_ds.GetRasterBand(1).WriteArray(ndvi_land)
-    '''
+        diag_ds.GetRasterBand(1).WriteArray(word, 0, yoff)
+        conf_ds.GetRasterBand(1).WriteArray(c_conf, 0, yoff)
+        fp_ds.GetRasterBand(1).WriteArray(final_prob, 0, yoff)
+        fwp_ds.GetRasterBand(1).WriteArray(wfinal_prob, 0, yoff)
 
     # close rasters
     diag_ds = None
     conf_ds = None
-    visi_ds = None
-    whit_ds = None
-    bc_ds = None
-    gc_ds = None
-    rc_ds = None
     fp_ds = None
     fwp_ds = None
-    cld_ds = None
-    fill_ds = None
-    ndvi_ds = None
-    ndvi_l_ds = None
+    rasts = None
+    geo_out = None
 
     # clean up files
     print("Cleaning up input bands...\n\n")
@@ -847,6 +1592,16 @@ def diag(input_gz, cloud_prob_threshold=22.5, t_buffer=400.0):
     print("End time: {0}".format(time.asctime()))
     print("Total time: {0} minutes.".format(round(total / 60, 3)))
 
+    return {'scene_id': l_id, 'valid': int(c_count), 'clear': int(c_clear),
+            'clear_land': int(c_land_count),
+            'clear_water': int(c_water_count),
+            'clear_pct': clear_ptm * 100.0, 'water_pct': water_ptm * 100.0,
+            'land_pct': land_ptm * 100.0, 't_templ': float(t_templ),
+            't_temph': float(t_temph), 't_wtemp': float(t_wtemp),
+            'clr_mask': float(clr_mask), 'wclr_mask': float(wclr_mask),
+            'seconds': total,
+            'outputs': [fn_out, fn_out_c, fp_out, fwp_out]}
+
 
 if __name__ == "__main__":
     import argparse
@@ -869,6 +1624,32 @@ if __name__ == "__main__":
                                             '(default=400.0)', required=False,
                                             default=400.0)
 
+    req_named.add_argument('-tile_rows', action='store', dest='tile_rows',
+                           type=int, help='Rows read at a time; 0 reads the '
+                                          'whole scene (default={0})'.
+                                          format(TILE_ROWS), required=False,
+                                          default=TILE_ROWS)
+
+    req_named.add_argument('-o', action='store', dest='dir_out', type=str,
+                           help='Directory to extract to and write outputs '
+                                'to (default=archive\'s directory)',
+                           required=False, default=None)
+
+    req_named.add_argument('-diag_encoding', action='store',
+                           dest='diag_encoding', choices=DIAG_ENCODINGS,
+                           help='Diag band encoding: decimal-coded uint32 '
+                                'or one bit per test in uint16 (default='
+                                'decimal)', required=False,
+                           default='decimal')
+
+    req_named.add_argument('-prob_bins', action='store', dest='prob_bins',
+                           type=int, help='Take the cloud probability '
+                                          'percentiles from this many fixed '
+                                          'bins over {0}, in one pass; 0 '
+                                          'selects them exactly (default=0)'.
+                                          format(PROB_RANGE), required=False,
+                           default=0)
+
     arguments = parser.parse_args()
 
     diag(**vars(arguments))
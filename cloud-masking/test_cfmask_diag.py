@@ -0,0 +1,374 @@
+"""
+test_cfmask_diag.py
+
+
+Purpose: check the scene percentiles of cfmask_diag against numpy:
+         RankSelect must match numpy.percentile exactly (integer and float
+         values, NaN and inf, tiles counted by forked selectors, buckets
+         gathered or refined over several passes), and BinnedPercentile
+         must be within one bin width of it. Also check that diag writes the
+         same diag, confidence and probability rasters of a synthetic scene
+         whatever its tile size, and that both diag encodings agree (GDAL is
+         replaced by an in-memory stand-in).
+
+
+Example usage:  python -m pytest test_cfmask_diag.py
+                python -m unittest test_cfmask_diag
+
+
+Created:  16 October 2026
+Version:  1.0
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import cfmask_diag
+from bench_cfmask_diag import synthetic_tile
+from cfmask_diag import RankSelect, BinnedPercentile
+
+PERCENTILES = [0, 1, 17.5, 50, 82.5, 99, 100]
+
+
+def select(tiles, dtype, percentiles=PERCENTILES, forks=1, max_passes=10):
+    """
+    Select percentiles of tiles over as many passes as needed, counting the
+    tiles of each pass in forked selectors merged back.
+
+    :param tiles: <list> Arrays of values, one per tile.
+    :param dtype: <numpy.dtype> Data type of the values.
+    :param percentiles: <list> Percentiles wanted (0-100).
+    :param forks: <int> Selectors the tiles of a pass are split among.
+    :param max_passes: <int> Passes allowed before failing.
+    :return: <RankSelect> Resolved selector.
+    """
+    sel = RankSelect(dtype, percentiles)
+
+    while not sel.done():
+        if sel.passes >= max_passes:
+            raise AssertionError("Percentiles not resolved in {0} passes".
+                                 format(max_passes))
+
+        parts = [sel.fork() for i in range(forks)]
+        for i, tile in enumerate(tiles):
+            parts[i % forks].update(tile)
+        for part in parts:
+            sel.merge(part)
+
+        sel.finish_pass()
+
+    return sel
+
+
+def same(a, b):
+    """
+    Check two percentiles are equal, or both NaN.
+
+    :param a: <numpy.float64>
+    :param b: <numpy.float64>
+    :return: <bool>
+    """
+    return (np.isnan(a) and np.isnan(b)) or a == b
+
+
+def fake_gdal(inputs, outputs):
+    """
+    Build an in-memory stand-in for the GDAL calls of cfmask_diag.diag.
+
+    :param inputs: <dict> Band arrays by file name, opened by gdal.Open.
+    :param outputs: <dict> Filled with the arrays of created rasters by file
+                    name.
+    :return: <module> gdal module.
+    """
+    gdal = types.ModuleType('gdal')
+    gdal.GA_ReadOnly = 0
+    gdal.GDT_Byte = np.uint8
+    gdal.GDT_UInt16 = np.uint16
+    gdal.GDT_UInt32 = np.uint32
+    gdal.GDT_Float32 = np.float32
+
+    class Band(object):
+        def __init__(self, data):
+            self.data = data
+
+        def ReadAsArray(self, xoff, yoff, xsize, ysize):
+            return self.data[yoff:yoff + ysize, xoff:xoff + xsize].copy()
+
+        def WriteArray(self, a, xoff, yoff):
+            rows, cols = np.shape(a)
+            self.data[yoff:yoff + rows, xoff:xoff + cols] = a
+
+    class Dataset(object):
+        def __init__(self, data):
+            self.data = data
+            self.RasterYSize, self.RasterXSize = data.shape
+
+        def GetRasterBand(self, i):
+            return Band(self.data)
+
+        def GetGeoTransform(self):
+            return (0.0, 30.0, 0.0, 0.0, 0.0, -30.0)
+
+        def GetProjection(self):
+            return ''
+
+        def SetGeoTransform(self, gt):
+            pass
+
+        def SetProjection(self, proj):
+            pass
+
+    class Driver(object):
+        def Create(self, fn, ncol, nrow, bands, dtype):
+            outputs[os.path.basename(fn)] = np.zeros((nrow, ncol), dtype)
+            return Dataset(outputs[os.path.basename(fn)])
+
+    gdal.Open = lambda fn, mode: Dataset(inputs[os.path.basename(fn)])
+    gdal.GetDriverByName = lambda name: Driver()
+
+    return gdal
+
+
+class RankSelectTest(unittest.TestCase):
+    def setUp(self):
+        self.gather_max = cfmask_diag.GATHER_MAX
+        self.rng = np.random.RandomState(0)
+
+    def tearDown(self):
+        cfmask_diag.GATHER_MAX = self.gather_max
+
+    def check(self, values, dtype, forks=1, tiles=5, percentiles=PERCENTILES):
+        sel = select(np.array_split(values, tiles), dtype, percentiles,
+                     forks)
+
+        # selected values are interpolated in float64, whatever their type
+        exact = values.astype(np.float64)
+        for q in percentiles:
+            want = np.percentile(exact, q)
+            got = sel.percentile(q)
+            self.assertTrue(same(got, want),
+                            "{0}: {1} != {2}".format(q, got, want))
+
+        return sel
+
+    def test_int16_one_pass(self):
+        values = self.rng.randint(-2000, 6000, 10007).astype(np.int16)
+        sel = self.check(values, np.int16)
+        self.assertEqual(sel.passes, 1)
+
+    def test_uint8(self):
+        values = self.rng.randint(0, 256, 999).astype(np.uint8)
+        self.check(values, np.uint8, forks=3)
+
+    def test_int32(self):
+        values = self.rng.randint(-1 << 30, 1 << 30, 5000).astype(np.int32)
+        self.check(values, np.int32)
+
+    def test_float_gathered(self):
+        for dtype in (np.float32, np.float64):
+            values = (self.rng.randn(20000) * 300).astype(dtype)
+            self.check(values, dtype, forks=2)
+
+    def test_float_refined(self):
+        # buckets too large to gather are refined over more passes
+        cfmask_diag.GATHER_MAX = 8
+        values = self.rng.randn(20000) * 1e-3
+        sel = self.check(values, np.float64, forks=3)
+        self.assertGreater(sel.passes, 2)
+
+    def test_repeated_values(self):
+        cfmask_diag.GATHER_MAX = 8
+        values = np.repeat([-1.5, 0.0, 2.25, 7.0], [300, 1000, 5, 2000])
+        self.rng.shuffle(values)
+        self.check(values, np.float64)
+
+    def test_signed_zero(self):
+        values = np.array([-0.0, 0.0, -0.0, 1.0, -1.0, 0.0])
+        self.check(values, np.float64, tiles=2)
+
+    def test_inf(self):
+        values = self.rng.randn(1000)
+        values[[3, 50, 700]] = [np.inf, -np.inf, np.inf]
+
+        # percentiles between an infinite and a finite value are NaN
+        with np.errstate(invalid='ignore'):
+            self.check(values, np.float64, forks=2)
+
+    def test_nan(self):
+        values = self.rng.randn(1000)
+        values[10] = np.nan
+        sel = self.check(values, np.float64, forks=2)
+        self.assertTrue(np.isnan(sel.percentile(50)))
+
+    def test_empty(self):
+        sel = select([np.zeros(0, dtype=np.int16)], np.int16)
+        self.assertIsNone(sel.percentile(50))
+
+    def test_transform(self):
+        values = self.rng.randint(0, 4000, 1001).astype(np.int16)
+        sel = select([values], np.int16)
+        for q in PERCENTILES:
+            self.assertAlmostEqual(sel.percentile(q, np.sqrt),
+                                   np.percentile(np.sqrt(values), q))
+
+    def test_merge_mismatch(self):
+        sel = RankSelect(np.int16, PERCENTILES)
+        with self.assertRaises(ValueError):
+            sel.merge(RankSelect(np.int16, [50]))
+
+
+class BinnedPercentileTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def binned(self, tiles, value_range, bins, forks=1):
+        hist = BinnedPercentile(value_range, bins, PERCENTILES)
+        parts = [hist.fork() for i in range(forks)]
+        for i, tile in enumerate(tiles):
+            parts[i % forks].update(tile)
+        for part in parts:
+            hist.merge(part)
+        hist.finish_pass()
+
+        return hist
+
+    def test_error_within_bin(self):
+        for values in (self.rng.rand(20000) * 1000,
+                       self.rng.exponential(50, 20000).clip(0, 1000),
+                       np.repeat([10.0, 500.0, 999.9], [10, 5000, 3])):
+            for bins in (10, 100, 1000):
+                hist = self.binned(np.array_split(values, 4), (0, 1000),
+                                   bins, forks=2)
+                self.assertTrue(hist.done())
+                width = 1000.0 / bins
+                for q in PERCENTILES:
+                    err = abs(hist.percentile(q) - np.percentile(values, q))
+                    self.assertLessEqual(err, width, (bins, q))
+
+    def test_merge_same_as_single(self):
+        values = self.rng.rand(5000) * 1000
+        one = self.binned([values], (0, 1000), 100)
+        split = self.binned(np.array_split(values, 7), (0, 1000), 100, 3)
+        for q in PERCENTILES:
+            self.assertEqual(one.percentile(q), split.percentile(q))
+
+    def test_out_of_range_not_resolved(self):
+        values = np.concatenate([self.rng.rand(1000) * 1000, [1500.0]])
+        hist = self.binned([values], (0, 1000), 100)
+        self.assertFalse(hist.done())
+        self.assertNotIn(100, hist.values)
+        self.assertIn(50, hist.values)
+
+    def test_nan(self):
+        values = self.rng.rand(100) * 1000
+        values[5] = np.nan
+        hist = self.binned([values], (0, 1000), 100)
+        self.assertTrue(hist.done())
+        self.assertTrue(np.isnan(hist.percentile(50)))
+
+    def test_merge_mismatch(self):
+        hist = BinnedPercentile((0, 1000), 100, PERCENTILES)
+        with self.assertRaises(ValueError):
+            hist.merge(BinnedPercentile((0, 1000), 50, PERCENTILES))
+
+
+class DiagTest(unittest.TestCase):
+    SCENE_ID = 'LC80150332017001LGN00'
+    BANDS = ('band2', 'band3', 'band4', 'band5', 'band6', 'band7', 'band10')
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def archive(self, seed, rows=150, cols=90):
+        """
+        Write an archive of empty band files for a synthetic scene.
+
+        :param seed: <int> Random seed of the scene.
+        :param rows: <int> Rows of the scene.
+        :param cols: <int> Columns of the scene.
+        :return: <tuple> Archive path and band arrays by file name.
+        """
+        names = ['{0}_toa_{1}.tif'.format(self.SCENE_ID, b)
+                 for b in self.BANDS]
+        input_gz = os.path.join(self.dir, 'scene{0}.tar.gz'.format(seed))
+
+        with tarfile.open(input_gz, 'w:gz') as t_o:
+            for name in names:
+                fn = os.path.join(self.dir, name)
+                open(fn, 'w').close()
+                t_o.add(fn, arcname=name)
+                os.remove(fn)
+
+        return input_gz, dict(zip(names, synthetic_tile(rows, cols, seed)))
+
+    def run_diag(self, input_gz, inputs, tile_rows, diag_encoding):
+        """
+        Run diag on an archive with the in-memory GDAL.
+
+        :param input_gz: <str> Path to the archive.
+        :param inputs: <dict> Band arrays by file name.
+        :param tile_rows: <int> Rows read at a time; 0 reads the whole scene.
+        :param diag_encoding: <str> Diag band encoding.
+        :return: <tuple> Scene statistics and the diag, confidence, land and
+                 water cloud probability rasters.
+        """
+        outputs = {}
+        gdal = fake_gdal(inputs, outputs)
+        osgeo = types.ModuleType('osgeo')
+        osgeo.gdal = gdal
+
+        dir_out = os.path.join(self.dir, '{0}_{1}'.format(tile_rows,
+                                                          diag_encoding))
+        with mock.patch.dict(sys.modules, {'osgeo': osgeo,
+                                           'osgeo.gdal': gdal}), \
+                contextlib.redirect_stdout(io.StringIO()):
+            stats = cfmask_diag.diag(input_gz, tile_rows=tile_rows,
+                                     diag_encoding=diag_encoding,
+                                     dir_out=dir_out)
+
+        for k in ('seconds', 'outputs'):
+            stats.pop(k)
+
+        return stats, [outputs[self.SCENE_ID + suffix] for suffix in
+                       cfmask_diag.OUTPUT_SUFFIXES]
+
+    def test_tile_rows_and_encodings(self):
+        for seed in (0, 1, 2):
+            input_gz, inputs = self.archive(seed)
+            stats, want = self.run_diag(input_gz, inputs, 0, 'decimal')
+
+            # the scene has cloud, clear and confidence test pixels
+            self.assertTrue(0 < stats['clear'] < stats['valid'])
+            self.assertTrue(np.any(want[1] > 1))
+
+            for tile_rows in (0, 1, 37, 64, cfmask_diag.TILE_ROWS):
+                for diag_encoding in cfmask_diag.DIAG_ENCODINGS:
+                    got_stats, got = self.run_diag(input_gz, inputs,
+                                                   tile_rows, diag_encoding)
+                    case = (seed, tile_rows, diag_encoding)
+
+                    self.assertEqual(got_stats, stats, case)
+
+                    if diag_encoding == 'bits':
+                        self.assertEqual(got[0].dtype, np.uint16)
+                        got[0] = cfmask_diag.diag_decimal(got[0])
+
+                    for a, b in zip(got, want):
+                        self.assertEqual(a.dtype, b.dtype, case)
+                        np.testing.assert_array_equal(a, b, str(case))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,321 @@
+"""band_cache.py
+
+Purpose: on-disk cache of decoded master bands, stored as memory-mappable
+         .npy files, so repeated runs against the same master read bands
+         straight from the page cache instead of decompressing them again.
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import tempfile
+import threading
+import numpy as np
+import tracing
+
+# index file, kept in the cache directory
+INDEX_NAME = "band_cache.sqlite"
+
+# bump when the layout of cached bands changes
+BAND_CACHE_VERSION = 1
+
+# default size cap of all cached bands
+MAX_MB = 10240
+
+# rows per hashed block of a cached band
+BLOCK_ROWS = 256
+
+
+class CachedBand:
+    """Read-only stand-in for an osgeo.gdal.Band whose pixels come from a
+    memory-mapped .npy file. Supports what the window readers use
+    (RasterIO.get_windows, read_window, read_window_raw, get_nodata).
+
+    Each block of rows is checked against its stored hash the first time it
+    is read; windows touching a block that fails the check are read from the
+    GDAL band instead, and the entry is dropped from the cache.
+    """
+    def __init__(self, arr, band, hashes, cache=None, key=None):
+        """
+        Args:
+            arr <numpy.memmap>: cached band pixels
+            band <osgeo.gdal.Band>: band the pixels were read from
+            hashes <list>: sha1 of each BLOCK_ROWS block of rows
+            cache <BandCache>: cache holding the band (default=None)
+            key <str>: key of the band in cache (default=None)
+        """
+        self.arr = arr
+        self.band = band
+        self.hashes = hashes
+        self.cache = cache
+        self.key = key
+
+        # None: not checked yet
+        self.valid = [None] * len(hashes)
+
+        self.DataType = band.DataType
+        self.XSize = band.XSize
+        self.YSize = band.YSize
+
+    def GetBlockSize(self):
+        return self.band.GetBlockSize()
+
+    def GetNoDataValue(self):
+        return self.band.GetNoDataValue()
+
+    def _check(self, yoff, ysize):
+        """Check the blocks of rows yoff to yoff + ysize, return False if any
+        of them does not match its hash."""
+        ok = True
+
+        last = (yoff + ysize - 1) // BLOCK_ROWS
+
+        for b in range(yoff // BLOCK_ROWS, last + 1):
+            if self.valid[b] is None:
+                block = self.arr[b * BLOCK_ROWS:(b + 1) * BLOCK_ROWS]
+                self.valid[b] = hashlib.sha1(
+                    np.ascontiguousarray(block).data).hexdigest() == \
+                    self.hashes[b]
+
+                if not self.valid[b]:
+                    logging.warning("Cached band {0} is corrupt at rows {1} "
+                                    "to {2}; reading the master band "
+                                    "instead.".format(self.key,
+                                                      b * BLOCK_ROWS,
+                                                      (b + 1) * BLOCK_ROWS))
+                    if self.cache is not None:
+                        self.cache.drop(self.key)
+
+            ok = ok and self.valid[b]
+
+        return ok
+
+    def ReadAsArray(self, xoff=0, yoff=0, xsize=None, ysize=None):
+        xsize = self.XSize if xsize is None else xsize
+        ysize = self.YSize if ysize is None else ysize
+
+        if not self._check(yoff, ysize):
+            return self.band.ReadAsArray(xoff, yoff, xsize, ysize)
+
+        return np.asarray(self.arr[yoff:yoff + ysize, xoff:xoff + xsize])
+
+    def ReadRaster(self, xoff=0, yoff=0, xsize=None, ysize=None):
+        xsize = self.XSize if xsize is None else xsize
+        ysize = self.YSize if ysize is None else ysize
+
+        if not self._check(yoff, ysize):
+            return self.band.ReadRaster(xoff, yoff, xsize, ysize)
+
+        return self.arr[yoff:yoff + ysize, xoff:xoff + xsize].tobytes()
+
+
+class BandCache:
+    """Directory of decoded master bands (.npy, memory-mapped on use) with a
+    SQLite index. Bands are keyed by the content hash of their file and the
+    band's name within it, so moved or renamed copies of a master file
+    share entries, and a changed file never matches. The least recently used
+    bands are evicted beyond a size cap.
+    """
+    def __init__(self, path, max_mb=MAX_MB):
+        """
+        Args:
+            path <str>: cache directory, created if missing
+            max_mb <float>: size cap of all cached bands in MB
+                (default=MAX_MB)
+        """
+        from cache import create_files_table
+
+        self.path = path
+        self.max_bytes = int(max_mb * (1 << 20))
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        # several worker processes (and runs) may share the directory, and
+        # bands may be compared on several threads; self.lock guards the
+        # index connection, and a lock per key keeps threads from decoding
+        # the same band twice
+        self.lock = threading.RLock()
+        self.key_locks = {}
+        self.conn = sqlite3.connect(path + os.sep + INDEX_NAME, timeout=60,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        create_files_table(self.conn)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS bands "
+                          "(key TEXT PRIMARY KEY, meta TEXT, "
+                          "bytes INTEGER, used REAL)")
+        self.conn.commit()
+
+    def close(self):
+        """Close the cache index."""
+        self.conn.close()
+
+    def key(self, path, name):
+        """Build the cache key of a band.
+
+        Args:
+            path <str>: path to raster file, possibly inside an archive
+            name <str>: name of the band within the file (e.g. SDS name and
+                band number)
+        """
+        from cache import file_digest
+
+        parts = [BAND_CACHE_VERSION,
+                 file_digest(self.conn, path, lock=self.lock), name]
+
+        return hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        """Path of the .npy file of a key."""
+        return self.path + os.sep + key + ".npy"
+
+    def band(self, path, name, band):
+        """Get a band from the cache, caching it first if needed. Bands
+        whose data type has no numpy equivalent are returned as they are.
+
+        Args:
+            path <str>: path to raster file, possibly inside an archive
+            name <str>: name of the band within the file
+            band <osgeo.gdal.Band>: the band, read on a cache miss
+
+        Returns:
+            <CachedBand|osgeo.gdal.Band>: band to read windows from
+        """
+        from image_io import GDAL_NUMPY_TYPES
+
+        if band.DataType not in GDAL_NUMPY_TYPES:
+            return band
+
+        with tracing.span("band_cache"):
+            key = self.key(path, name)
+
+            with self.lock:
+                key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+            with key_lock:
+                return self._get(key, path, name, band)
+
+    def _get(self, key, path, name, band):
+        """Get a band from the cache by key, caching it first if needed."""
+        with self.lock:
+            row = self.conn.execute("SELECT meta FROM bands WHERE key = ?",
+                                    (key,)).fetchone()
+
+            if row is not None:
+                self.conn.execute("UPDATE bands SET used = ? WHERE key = ?",
+                                  (time.time(), key))
+                self.conn.commit()
+
+        if row is not None and os.path.isfile(self._file(key)):
+            meta = json.loads(row[0])
+
+            try:
+                arr = np.load(self._file(key), mmap_mode="r")
+            except (IOError, ValueError) as e:
+                logging.warning("Cannot read cached band {0}: {1}".
+                                format(key, e))
+                arr = None
+
+            if arr is not None and arr.shape == (band.YSize, band.XSize):
+                logging.info("Reading {0} band {1} from band cache.".
+                             format(path, name))
+                return CachedBand(arr, band, meta["hashes"], self, key)
+
+            self.drop(key)
+
+        return self._put(key, path, name, band)
+
+    def _put(self, key, path, name, band):
+        """Decode a band into the cache and return it memory-mapped. Only
+        the index updates hold self.lock; the band is decoded into a
+        temporary file renamed into place when complete."""
+        from image_io import RasterIO, GDAL_NUMPY_TYPES
+
+        dtype = np.dtype(GDAL_NUMPY_TYPES[band.DataType])
+        n_bytes = band.XSize * band.YSize * dtype.itemsize
+
+        if n_bytes > self.max_bytes:
+            logging.info("Band {0} of {1} is larger than the band cache.".
+                         format(name, path))
+            return band
+
+        logging.info("Caching {0} band {1}...".format(path, name))
+
+        fd, tmp = tempfile.mkstemp(suffix=".npy.tmp", dir=self.path)
+        os.close(fd)
+
+        arr = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype,
+                                        shape=(band.YSize, band.XSize))
+
+        for win in RasterIO.get_windows(band):
+            arr[win[1]:win[1] + win[3], win[0]:win[0] + win[2]] = \
+                RasterIO.read_window(band, win)
+
+        hashes = [hashlib.sha1(np.ascontiguousarray(
+            arr[y:y + BLOCK_ROWS]).data).hexdigest()
+            for y in range(0, band.YSize, BLOCK_ROWS)]
+
+        arr.flush()
+        del arr
+
+        # another process may have cached the same band meanwhile
+        os.rename(tmp, self._file(key))
+
+        meta = {"path": path, "name": name, "dtype": dtype.str,
+                "shape": [band.YSize, band.XSize], "hashes": hashes}
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO bands "
+                              "VALUES (?, ?, ?, ?)",
+                              (key, json.dumps(meta), n_bytes, time.time()))
+            self.conn.commit()
+
+        self.evict(keep=key)
+
+        arr = np.load(self._file(key), mmap_mode="r")
+
+        return CachedBand(arr, band, hashes, self, key)
+
+    def drop(self, key):
+        """Remove a band from the cache.
+
+        Args:
+            key <str>: key from BandCache.key
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM bands WHERE key = ?", (key,))
+            self.conn.commit()
+
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        """Drop the least recently used bands until the cache fits its size
+        cap, and file hashes unused for cache.MAX_AGE_DAYS.
+
+        Args:
+            keep <str>: key never dropped, e.g. the band just cached
+                (default=None)
+        """
+        from cache import evict_files, MAX_AGE_DAYS
+
+        with self.lock:
+            rows = self.conn.execute("SELECT key, bytes FROM bands "
+                                     "ORDER BY used DESC").fetchall()
+            evict_files(self.conn, time.time() - MAX_AGE_DAYS * 86400.0)
+
+        total = 0
+        n_evicted = 0
+        for key, n_bytes in rows:
+            total += n_bytes
+            if total > self.max_bytes and key != keep:
+                self.drop(key)
+                total -= n_bytes
+                n_evicted += 1
+
+        if n_evicted:
+            logging.info("Evicted {0} least recently used bands from {1}.".
+                         format(n_evicted, self.path))
@@ -0,0 +1,238 @@
+"""cache.py
+
+Purpose: persistent cache of image pair results, so a rerun against the same
+         master directory skips pairs whose files have not changed.
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+
+# default cache file, kept in the output directory
+CACHE_NAME = "qa_cache.sqlite"
+
+# bump when a change to the QA code makes old results invalid
+CACHE_VERSION = 1
+
+# eviction limits
+MAX_ENTRIES = 50000
+MAX_AGE_DAYS = 30
+
+# bytes read at a time when hashing file contents
+HASH_CHUNK = 1 << 20
+
+
+def create_files_table(conn):
+    """Create the "files" table of content hashes in a cache database, or
+    add the "used" column to one made before it existed.
+
+    Args:
+        conn <sqlite3.Connection>: cache database
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS files "
+                 "(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+                 "digest TEXT, used REAL)")
+
+    columns = [c[1] for c in conn.execute("PRAGMA table_info(files)")]
+    if "used" not in columns:
+        conn.execute("ALTER TABLE files ADD COLUMN used REAL")
+
+    conn.commit()
+
+
+def evict_files(conn, cutoff):
+    """Drop content hashes of files not looked up since a time, e.g. of
+    scratch files or archives that no longer exist.
+
+    Args:
+        conn <sqlite3.Connection>: cache database
+        cutoff <float>: time (seconds since the epoch)
+
+    Returns:
+        <int>: number of hashes dropped
+    """
+    n = conn.execute("DELETE FROM files WHERE used IS NULL OR used < ?",
+                     (cutoff,)).rowcount
+    conn.commit()
+
+    return n
+
+
+def file_digest(conn, path, stat=None, lock=None):
+    """Get content hash of a file, hashing it only if its size or
+    modification time changed since it was last seen. Hashes are kept in the
+    "files" table of an open cache database.
+
+    Args:
+        conn <sqlite3.Connection>: cache database
+        path <str>: path to file, possibly inside an archive
+        stat <tuple>: (size, mtime) of the file from Read.stat, if already
+            known (default=None)
+        lock <threading.Lock>: held while using conn, if it is shared
+            between threads; not held while hashing (default=None)
+    """
+    import threading
+    from file_io import Read
+
+    if lock is None:
+        lock = threading.Lock()
+
+    size, mtime = stat or Read.stat(path)
+
+    with lock:
+        row = conn.execute("SELECT size, mtime, digest FROM files "
+                           "WHERE path = ?", (path,)).fetchone()
+
+        if row and row[0] == size and row[1] == mtime:
+            conn.execute("UPDATE files SET used = ? WHERE path = ?",
+                         (time.time(), path))
+            conn.commit()
+            return row[2]
+
+    logging.info("Hashing {0}...".format(path))
+
+    sha = hashlib.sha1()
+    for chunk in Read.iter_chunks(path, HASH_CHUNK):
+        sha.update(chunk)
+
+    digest = sha.hexdigest()
+
+    with lock:
+        conn.execute("INSERT OR REPLACE INTO files "
+                     "(path, size, mtime, digest, used) "
+                     "VALUES (?, ?, ?, ?, ?)",
+                     (path, size, mtime, digest, time.time()))
+        conn.commit()
+
+    return digest
+
+
+class ResultCache:
+    """SQLite store of pair results, keyed by the path, size, modification
+    time and content hash of both files (plus the comparison settings).
+
+    File content hashes are themselves cached by (path, size, mtime), so
+    unchanged files are neither hashed nor read again.
+    """
+    def __init__(self, path, max_entries=MAX_ENTRIES,
+                 max_age_days=MAX_AGE_DAYS):
+        """
+        Args:
+            path <str>: path to cache file
+            max_entries <int>: results kept by evict() (default=MAX_ENTRIES)
+            max_age_days <float>: results unused for longer are dropped by
+                evict() (default=MAX_AGE_DAYS)
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+
+        # several worker processes may share the file
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        create_files_table(self.conn)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results "
+                          "(key TEXT PRIMARY KEY, result TEXT, "
+                          "used REAL)")
+        self.conn.commit()
+
+    def close(self):
+        """Close the cache file."""
+        self.conn.close()
+
+    def digest(self, path, stat=None):
+        """Get content hash of a file, hashing it only if its size or
+        modification time changed since it was last seen.
+
+        Args:
+            path <str>: path to file, possibly inside an archive
+            stat <tuple>: (size, mtime) of the file, if already known
+                (default=None)
+        """
+        return file_digest(self.conn, path, stat)
+
+    def key(self, test, mast, **settings):
+        """Build the cache key of a test/master file pair.
+
+        Args:
+            test <str>: path to test file
+            mast <str>: path to master file
+            **settings: comparison options that change the result
+        """
+        from file_io import Read
+
+        parts = [CACHE_VERSION, sorted(settings.items())]
+        for path in (test, mast):
+            size, mtime = Read.stat(path)
+            parts.append([path, size, mtime,
+                          self.digest(path, (size, mtime))])
+
+        return hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Get a stored pair result. Results whose plots, difference records
+        or heatmaps no longer exist are treated as missing.
+
+        Args:
+            key <str>: key from ResultCache.key
+        """
+        row = self.conn.execute("SELECT result FROM results WHERE key = ?",
+                                (key,)).fetchone()
+        if row is None:
+            return None
+
+        result = json.loads(row[0])
+
+        plots = [p for b in result["bands"]
+                 for p in b["plots"] + [b.get("diff_file")] +
+                 (b.get("heatmap") or []) if p]
+        if not all(os.path.isfile(p) for p in plots):
+            return None
+
+        self.conn.execute("UPDATE results SET used = ? WHERE key = ?",
+                          (time.time(), key))
+        self.conn.commit()
+
+        # stats rows are stored as lists by json
+        for b in result["bands"]:
+            if b["row"]:
+                b["row"] = tuple(b["row"])
+
+        logging.warning("Reusing cached result for Test {0} | Master {1}: "
+                        "{2}".format(result["test"], result["mast"],
+                                     result["verdict"]))
+
+        return result
+
+    def put(self, key, result):
+        """Store a pair result.
+
+        Args:
+            key <str>: key from ResultCache.key
+            result <dict>: pair result from GeoImage.check_pair
+        """
+        self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                          (key, json.dumps(result), time.time()))
+        self.conn.commit()
+
+    def evict(self):
+        """Drop results unused for max_age_days, then the least recently used
+        results beyond max_entries, and file hashes unused for
+        max_age_days."""
+        cutoff = time.time() - self.max_age_days * 86400.0
+        n_old = self.conn.execute("DELETE FROM results WHERE used < ?",
+                                  (cutoff,)).rowcount
+
+        n_lru = self.conn.execute(
+            "DELETE FROM results WHERE key NOT IN (SELECT key FROM results "
+            "ORDER BY used DESC LIMIT ?)", (self.max_entries,)).rowcount
+
+        self.conn.commit()
+
+        n_files = evict_files(self.conn, cutoff)
+
+        logging.info("Evicted {0} old and {1} least recently used cached "
+                     "results and {2} file hashes from {3}.".format(
+                         n_old, n_lru, n_files, self.path))
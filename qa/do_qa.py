@@ -11,22 +11,33 @@ if __name__ == "__main__":
 
     req_named = parser.add_argument_group('Required named arguments')
 
+    # not needed to --merge shard results
     req_named.add_argument('-m', action='store', dest='dir_mast', type=str,
-                           help='Master directory', required=True)
+                           help='Master directory', required=False)
 
     req_named.add_argument('-t', action='store', dest='dir_test', type=str,
-                           help='Test directory', required=True)
+                           nargs='+', help='Test directory, or several test '
+                                           'directories to compare against '
+                                           'the same master', required=False)
 
     req_named.add_argument('-o', action='store', dest='dir_out', type=str,
                            help='Output directory', required=True)
 
-    parser.add_argument('-x', action='store_true', dest='xml_schema',
+    parser.add_argument('-x', action='store', dest='xml_schema', type=str,
                         help='Path to XML schema', required=False)
 
     parser.add_argument('--no-archive', action='store_false', dest='archive',
                         help='Look for individual files, instead of g-zipped'
                              ' archives', required=False)
 
+    parser.add_argument('--no-extract', action='store_false', dest='extract',
+                        help='Read files inside archives in place instead of '
+                             'extracting them to disk', required=False)
+
+    parser.add_argument('--no-cache', action='store_false', dest='cache',
+                        help='Do not reuse or store results of unchanged '
+                             'image pairs', required=False)
+
     parser.add_argument('--verbose', action='store_true', dest='verbose',
                         help='Enable verbose logging', required=False)
 
@@ -34,6 +45,92 @@ if __name__ == "__main__":
                         dest='incl_nd', help='Do not mask NoData values',
                         required=False)
 
+    parser.add_argument('--block-size', action='store', dest='block_size',
+                        type=int, help='Compare rasters in N x N pixel '
+                                       'windows (default: native GDAL blocks)',
+                        required=False, default=None)
+
+    parser.add_argument('--workers', action='store', dest='workers', type=int,
+                        help='Number of processes comparing scene directory '
+                             'pairs (default=1)', required=False, default=1)
+
+    parser.add_argument('--gdal-cache', action='store', dest='gdal_cache',
+                        type=int, help='Total GDAL block cache in MB, split '
+                                       'evenly across workers',
+                        required=False, default=None)
+
+    parser.add_argument('--parquet', action='store_true', dest='parquet',
+                        help='Also write results to results.parquet (needs '
+                             'pyarrow)', required=False)
+
+    parser.add_argument('--trace', action='store_true', dest='trace',
+                        help='Write time, bytes read and peak memory per '
+                             'stage and image pair to trace_summary.json and '
+                             'trace.json (Chrome trace)', required=False)
+
+    parser.add_argument('--xml-tolerance', action='store',
+                        dest='xml_tolerance', type=float, default=0,
+                        help='Relative tolerance of numeric XML values '
+                             '(default: 0)', required=False)
+
+    parser.add_argument('--band-threads', action='store',
+                        dest='band_threads', type=int,
+                        help='Compare N bands (or HDF/NetCDF SDS) of a '
+                             'multiband image at a time (default: 2)',
+                        required=False, default=None)
+
+    parser.add_argument('--band-cache', action='store', dest='band_cache',
+                        type=str, help='Keep decoded master bands in this '
+                                       'directory and memory-map them on '
+                                       'later runs', required=False,
+                        default=None)
+
+    parser.add_argument('--band-cache-mb', action='store',
+                        dest='band_cache_mb', type=float,
+                        help='Size cap of the band cache in MB (default: '
+                             '10240)', required=False, default=None)
+
+    parser.add_argument('--tolerance-mode', action='store',
+                        dest='tolerance_mode', type=str, default='exact',
+                        choices=['exact', 'abs', 'rel', 'ulp'],
+                        help='How image differences are judged: any '
+                             'difference (exact), or above an absolute, '
+                             'relative or ULP tolerance (default=exact)',
+                        required=False)
+
+    parser.add_argument('--tolerance', action='store', dest='tolerance',
+                        type=float, default=0,
+                        help='Tolerance for --tolerance-mode (default=0)',
+                        required=False)
+
+    parser.add_argument('--verdict-only', action='store_true',
+                        dest='verdict_only',
+                        help='Stop comparing an image pair at its first '
+                             'difference; no stats or plots', required=False)
+
+    parser.add_argument('--plan', action='store', dest='plan', type=str,
+                        help='Only write a manifest of the file pairs to '
+                             'compare (with band counts and sizes) to this '
+                             'file', required=False, default=None)
+
+    parser.add_argument('--shard', action='store', dest='shard', type=str,
+                        help='i/N: compare only shard i of N of the file '
+                             'pairs, balanced by size; results go to '
+                             'OUT/shard_i_of_N', required=False, default=None)
+
+    parser.add_argument('--manifest', action='store', dest='manifest',
+                        type=str, help='Manifest (from --plan) to shard '
+                                       'instead of planning again',
+                        required=False, default=None)
+
+    parser.add_argument('--merge', action='store_true', dest='merge',
+                        help='Only merge the results of all shards in the '
+                             'output directory', required=False)
+
     arguments = parser.parse_args()
 
+    if not arguments.merge and not (arguments.dir_mast and
+                                    arguments.dir_test):
+        parser.error("-m and -t are required unless merging shard results")
+
     qa_data(**vars(arguments))
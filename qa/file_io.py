@@ -4,6 +4,116 @@ import os
 import logging
 import tarfile
 import time
+import threading
+import tracing
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+# GDAL virtual file system prefixes for reading inside archives
+VSI_TAR = "/vsitar/"
+VSI_GZIP = "/vsigzip/"
+
+# archive suffixes recognized as tar files
+TAR_EXTS = (".tar.gz", ".tgz", ".tar")
+
+# files compared line-by-line
+TEXT_EXTS = (".txt", ".xml", ".gtf", ".hdr", ".stats")
+
+# files GDAL/readers here cannot open from a virtual file system; these are
+# extracted to a scratch directory when reading archives directly
+NO_STREAM_EXTS = (".jpg", ".hdf", ".nc")
+
+# cache of tar member headers (TarInfo by name, in archive order), by
+# archive path
+_tar_index = {}
+
+# threads rendering plots (see ImWrite.render), started on first use
+RENDER_THREADS = 2
+_render_pool = None
+_render_lock = threading.Lock()
+
+
+def is_archive(path):
+    """Check if a path is a .tar.gz/.tgz/.tar or single-file .gz archive.
+
+    Args:
+        path <str>: path to file
+    """
+    return path.endswith(TAR_EXTS) or path.endswith(".gz")
+
+
+def file_ext(path):
+    """Get extension of a file. Files inside a single-file .gz archive get
+    the extension of the file they contain.
+
+    Args:
+        path <str>: path to file
+    """
+    if path.startswith(VSI_GZIP):
+        path = path[:-len(".gz")]
+
+    return os.path.splitext(path)[1]
+
+
+def file_kind(ext):
+    """Get how files with an extension are compared: "text", "jpeg",
+    "image" (geo-based raster) or None (no extension, not compared).
+
+    Args:
+        ext <str>: file extension
+    """
+    if len(ext) == 0:
+        return None
+    if ext.lower() in TEXT_EXTS:
+        return "text"
+    if ext.lower() == ".jpg":
+        return "jpeg"
+    return "image"
+
+
+def split_vsi(path):
+    """Split a /vsitar/ or /vsigzip/ path into (archive, member). Member is
+    None for /vsigzip/ paths and plain files; archive is None for plain files.
+
+    Args:
+        path <str>: path to file, possibly inside an archive
+    """
+    if path.startswith(VSI_GZIP):
+        return path[len(VSI_GZIP):], None
+
+    if path.startswith(VSI_TAR):
+        inner = path[len(VSI_TAR):]
+        for ext in TAR_EXTS:
+            idx = inner.find(ext + "/")
+            if idx >= 0:
+                return inner[:idx + len(ext)], inner[idx + len(ext) + 1:]
+
+    return None, None
+
+
+def tar_members(archive):
+    """Get headers of the files inside a tar archive, reading its index once
+    per archive.
+
+    Args:
+        archive <str>: path to .tar.gz/.tgz/.tar archive
+
+    Returns:
+        <collections.OrderedDict>: tarfile.TarInfo by member name
+    """
+    from collections import OrderedDict
+
+    archive = os.path.abspath(archive)
+
+    if archive not in _tar_index:
+        with tarfile.open(archive, 'r:*') as tar:
+            _tar_index[archive] = OrderedDict(
+                (m.name, m) for m in tar.getmembers() if m.isfile())
+
+    return _tar_index[archive]
 
 
 class Extract:
@@ -47,30 +157,128 @@ class Extract:
                 sys.exit(1)
 
             try:
-                tar_mast.extractall(path=os.path.dirname(i[1]))
-                tar_test.extractall(path=os.path.dirname(j))
+                with tracing.span("extract", archive=j):
+                    tracing.add_bytes(os.path.getsize(i[1]) +
+                                      os.path.getsize(j))
+                    tar_mast.extractall(path=os.path.dirname(i[1]))
+                    tar_test.extractall(path=os.path.dirname(j))
 
             except:
                 logging.critical("Problem extract contents from .tar.gz. file:"
                                  "{0} and {1}.".format(i[1], j))
 
+    @staticmethod
+    def unzip_archives(paths):
+        """Extract files from archives next to each archive, e.g. the
+        archives of a further test directory whose master archives were
+        already extracted by unzip_gz_files.
+
+        Args:
+            paths <list>: paths to .gz archives
+        """
+        for path in sorted(paths):
+            try:
+                tar = tarfile.open(path, 'r:gz')
+                logging.info("{0} is {1} MB...\n".
+                             format(path, os.path.getsize(path) >> 20))
+
+                if os.path.getsize(path) == 0:
+                    logging.critical("Archive {0} is of zero size!".
+                                     format(path))
+                    sys.exit(1)
+
+            except (tarfile.TarError, IOError, OSError):
+                logging.critical("Problem with .tar.gz file: {0}.".
+                                 format(path))
+                sys.exit(1)
+
+            try:
+                with tracing.span("extract", archive=path):
+                    tracing.add_bytes(os.path.getsize(path))
+                    tar.extractall(path=os.path.dirname(path))
+
+            except (tarfile.TarError, IOError, OSError):
+                logging.critical("Problem extract contents from .tar.gz. file:"
+                                 "{0}.".format(path))
+
+    @staticmethod
+    def extract_members(paths, dir_scratch):
+        """Extract files inside archives (as returned by Find.find_files) to
+        a scratch directory, for readers that cannot use GDAL's virtual file
+        systems. Paths that are not inside an archive are returned as-is.
+        Use separate scratch directories for test and master files.
+
+        Args:
+            paths <list>: paths to files, possibly inside archives
+            dir_scratch <str>: directory to extract files into
+        """
+        out_paths = []
+
+        for path in paths:
+            archive, member = split_vsi(path)
+
+            if archive is None:
+                out_paths.append(path)
+                continue
+
+            if not os.path.exists(dir_scratch):
+                os.makedirs(dir_scratch)
+
+            f_out = os.path.join(dir_scratch, os.path.basename(member or
+                                                               archive[:-3]))
+
+            logging.info("Extracting {0} to {1}".format(path, f_out))
+
+            with tracing.span("extract", archive=path):
+                with open(f_out, "wb") as f:
+                    f.write(Read.open_file(path).read())
+
+            out_paths.append(f_out)
+
+        return out_paths
+
 
 class Find:
+    @staticmethod
+    def list_archive(archive):
+        """List files inside an archive as GDAL virtual file system paths,
+        using only the tar index (nothing is extracted).
+
+        Args:
+            archive <str>: path to .tar.gz/.tgz/.tar or .gz archive
+        """
+        archive = os.path.abspath(archive)
+
+        if not archive.endswith(TAR_EXTS):
+            return [VSI_GZIP + archive]
+
+        return [VSI_TAR + archive + "/" + m for m in tar_members(archive)]
+
     @staticmethod
     def find_files(target_dir, ext):
-        """Recursively find files by extension
+        """Recursively find files by extension. If target_dir is an archive,
+        find files inside it (as /vsitar/ or /vsigzip/ paths).
 
         Args:
-            target_dir <str>: path to target directory
+            target_dir <str>: path to target directory or archive
             ext <str>: target file extension
         """
         import fnmatch
 
         out_files = []
 
-        for root, dirnames, filenames in os.walk(target_dir):
-            for filename in fnmatch.filter(filenames, '*' + ext):
-                out_files.append(os.path.join(root, filename))
+        if os.path.isfile(target_dir) and is_archive(target_dir):
+            for path in Find.list_archive(target_dir):
+                name = os.path.basename(path)
+                if path.startswith(VSI_GZIP):
+                    name = name[:-len(".gz")]
+                if fnmatch.fnmatch(name, '*' + ext):
+                    out_files.append(path)
+
+        else:
+            for root, dirnames, filenames in os.walk(target_dir):
+                for filename in fnmatch.filter(filenames, '*' + ext):
+                    out_files.append(os.path.join(root, filename))
 
         if len(out_files) == 0:
             logging.critical("No files found in dir {0}".format(target_dir))
@@ -87,12 +295,13 @@ class Find:
 
         exts = []
         for i in args:
-            exts += [os.path.splitext(j)[1] for j in i if '.gz' not in j]
+            exts += [file_ext(j) for j in i if j.startswith(VSI_GZIP) or
+                     not j.endswith(".gz")]
 
         logging.info("All extensions: {0}".format(exts))
-        logging.info("Unique extensions: {0}".format(list(set(exts))))
+        logging.info("Unique extensions: {0}".format(sorted(set(exts))))
 
-        return list(set(exts))
+        return sorted(set(exts))
 
     @staticmethod
     def count(fn_test, test, fn_mast, mast, ext):
@@ -179,7 +388,167 @@ class Find:
         return d_range
 
 
+class FileIndex:
+    """Files of a directory tree (or archive), listed in a single pass and
+    looked up by extension, relative path or directory."""
+    def __init__(self, root, files, dirs, archive=False):
+        """
+        Args:
+            root <str>: path to directory or archive that was indexed
+            files <list>: paths to all files
+            dirs <dict>: paths to subdirectories, by directory
+            archive <bool>: files are inside an archive (default=False)
+        """
+        self.root = root
+        self.files = sorted(files)
+        self.dirs = dirs
+        self.archive = archive
+
+        self.by_ext = {}
+        self.by_dir = {}
+        for f in self.files:
+            self.by_ext.setdefault(file_ext(f), []).append(f)
+            self.by_dir.setdefault(os.path.dirname(f), []).append(f)
+
+        if archive:
+            self.rel = dict((split_vsi(f)[1] or os.path.basename(f), f)
+                            for f in self.files)
+        else:
+            self.rel = dict((os.path.relpath(f, root), f)
+                            for f in self.files)
+
+    @staticmethod
+    def build(target):
+        """Index a directory tree with os.scandir, or an archive from its tar
+        index.
+
+        Args:
+            target <str>: path to directory or archive
+        """
+        if os.path.isfile(target) and is_archive(target):
+            with tracing.span("index", root=target):
+                return FileIndex(target, Find.list_archive(target),
+                                 {target: []}, archive=True)
+
+        files = []
+        dirs = {}
+        stack = [target]
+
+        with tracing.span("index", root=target):
+            while stack:
+                d = stack.pop()
+                dirs[d] = []
+
+                for entry in scandir(d):
+                    if entry.is_dir():
+                        dirs[d].append(entry.path)
+
+                        # like os.walk, list linked dirs but do not descend
+                        if not entry.is_symlink():
+                            stack.append(entry.path)
+                    else:
+                        files.append(entry.path)
+
+        logging.info("Indexed {0} files in {1} directories under {2}".
+                     format(len(files), len(dirs), target))
+
+        return FileIndex(target, files, dirs)
+
+    def leaf_dirs(self):
+        """Get the deepest directories (those without subdirectories)."""
+        return sorted([d for d, subs in self.dirs.items() if not subs])
+
+    def subset(self, target_dir):
+        """Get index of the files directly inside one directory.
+
+        Args:
+            target_dir <str>: path to directory
+        """
+        if self.archive:
+            return self
+
+        return FileIndex(target_dir, self.by_dir.get(target_dir, []),
+                         {target_dir: []})
+
+    def find(self, ext):
+        """Find files by extension, same as Find.find_files.
+
+        Args:
+            ext <str>: target file extension, may contain wildcards
+        """
+        import fnmatch
+
+        if any(c in ext for c in "*?["):
+            out_files = [f for f in self.files if fnmatch.fnmatch(
+                os.path.basename(f[:-len(".gz")] if f.startswith(VSI_GZIP)
+                                 else f), '*' + ext)]
+        else:
+            out_files = list(self.by_ext.get(ext, []))
+
+        if len(out_files) == 0:
+            logging.critical("No files found in dir {0}".format(self.root))
+
+        return out_files
+
+
+def _render_task(fn, args, kwargs):
+    """Run a plot function on a render thread, as a traced stage."""
+    with tracing.span("plot", plot=fn.__name__):
+        return fn(*args, **kwargs)
+
+
 class ImWrite:
+    @staticmethod
+    def render(fn, *args, **kwargs):
+        """Queue a plot function on the render threads, so figure work
+        overlaps with reading the next band. Collect with ImWrite.wait.
+
+        Threads rather than processes: QA workers are daemonic pool processes,
+        which cannot have children. Plots use the object-oriented Agg API,
+        which (unlike pyplot) is safe to use from several threads.
+
+        Args:
+            fn <function>: ImWrite plot function
+            *args: positional arguments of fn
+            **kwargs: keyword arguments of fn
+
+        Returns:
+            <multiprocessing.pool.AsyncResult>: pending plot path
+        """
+        global _render_pool
+
+        # bands may be compared on several threads
+        with _render_lock:
+            if _render_pool is None:
+                from multiprocessing.pool import ThreadPool
+                _render_pool = ThreadPool(RENDER_THREADS)
+
+        return _render_pool.apply_async(_render_task, (fn, args, kwargs))
+
+    @staticmethod
+    def wait(pending):
+        """Wait for queued plots and get the paths of those written.
+
+        Args:
+            pending <list>: AsyncResults from ImWrite.render
+
+        Returns:
+            <list>: paths to plots
+        """
+        plots = []
+
+        for res in pending:
+            try:
+                im_out = res.get()
+            except Exception as e:
+                logging.warning("Plot could not be rendered: {0}".format(e))
+                continue
+
+            if im_out:
+                plots.append(im_out)
+
+        return plots
+
     @staticmethod
     def plot_diff_image(test, mast, diff_raster, fn_out, fn_type, dir_out,
                         do_abs=False):
@@ -188,12 +557,14 @@ class ImWrite:
         Args:
             test <str>: name of test file
             mast <str>: name of mast file
-            diff_raster <numpy.ndarray>: numpy array of values
+            diff_raster <numpy.ndarray>: numpy array of values, usually a
+                reduced preview (see qa_images.Preview)
             fn_out <str>: basename for file
             fn_type <str>: defines title of plot - "diff" or "pct_diff"
             dir_out <str>: directory where output data are being stored
         """
-        import matplotlib.pyplot as plt
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
         import numpy as np
 
         # mask pixels that did not differ
@@ -202,52 +573,61 @@ class ImWrite:
         # make output file
         im_out = dir_out + os.sep + fn_out + "_" + fn_type + ".png"
 
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+
         # plot diff figure
         if do_abs:
-            plt.imshow(np.abs(diff_raster), cmap='gist_gray')
-            plt.colorbar(label="Abs. Difference")
+            im = ax.imshow(np.abs(diff_raster), cmap='gist_gray')
+            fig.colorbar(im, ax=ax, label="Abs. Difference")
         else:
-            plt.imshow(diff_raster, cmap='PuOr')
-            plt.colorbar(label="Difference")
+            im = ax.imshow(diff_raster, cmap='PuOr')
+            fig.colorbar(im, ax=ax, label="Difference")
 
         # annotate plot with file names
-        plt.annotate(str(mast) + "\n" +
-                     str(test) + "\n",
-                     fontsize=5,
-                     xy=(0.01, 0.94),
-                     xycoords='axes fraction')
+        ax.annotate(str(mast) + "\n" +
+                    str(test) + "\n",
+                    fontsize=5,
+                    xy=(0.01, 0.94),
+                    xycoords='axes fraction')
 
-        plt.title(fn_out, y=1.05)
-        plt.savefig(im_out, dpi=250)
-        plt.close()
+        ax.set_title(fn_out, y=1.05)
+        fig.savefig(im_out, dpi=250)
 
         logging.warning("{0} raster written to {1}.".format(fn_type, im_out))
 
+        return im_out
+
     @staticmethod
     def plot_hist(test, mast, diff_raster, fn_out, fn_type, dir_out,
-                  bins=False):
-        """Take difference array and plot as histogram.
+                  bins=False, n_pix=None):
+        """Plot histogram of difference values.
 
         Args:
             test <str>: name of test file
             mast <str>: name of master file
-            diff_raster <numpy.ndarray>: numpy array of values
+            diff_raster <stats.StatsAccumulator>: accumulated differences,
+                whose pre-binned counts are plotted; or a numpy array of
+                values (zero-valued pixels are ignored)
             fn_out <str>: basename for file
             fn_type <str>: defines title of plot - "diff" or "pct_diff"
             dir_out <str>: directory where output data are being stored
             bins <int>: number of bins for histogram (default=255)
+            n_pix <int>: total pixels in raster, if diff_raster only holds
+                the differing values (default=None)
         """
-        import matplotlib.pyplot as plt
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
         import numpy as np
+        import stats
 
-        def bin_size(rast):
+        def bin_size(dt):
             """Determine bin size based upon data type.
 
             Args:
-                rast <numpy.ndarray>: numpy array of values
+                dt <numpy.dtype>: data type of values
             """
-            dt = rast.dtype
-
             if '64' or '32' in dt.name:
                 return 2000
             elif '16' in dt.name:
@@ -257,59 +637,72 @@ class ImWrite:
             else:
                 return 50
 
-        # mask pixels that did not differ
-        diff_raster = np.ma.masked_where(diff_raster == 0, diff_raster)
+        if isinstance(diff_raster, stats.StatsAccumulator):
+            acc = diff_raster
+            dt = np.dtype(np.float64)
+        else:
+            # mask pixels that did not differ
+            acc = stats.StatsAccumulator()
+            acc.update(np.ma.masked_where(diff_raster == 0, diff_raster))
+            dt = diff_raster.dtype
+            if n_pix is None:
+                n_pix = np.prod(np.shape(diff_raster))
 
         # make output file
         im_out = dir_out + os.sep + fn_out + "_" + fn_type + "_hist.png"
 
-        # get array of values that are actually different
-        diff_valid = diff_raster.compressed()
+        # distinct values that actually differ, and their counts
+        values, counts = acc.histogram()
 
         # determine bin size
         if not bins:
-            bins = bin_size(diff_raster)
+            bins = bin_size(dt)
+
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
 
         # do histogram
         try:
-            plt.hist(diff_valid, bins)
-        except AttributeError:
+            ax.hist(values, bins, weights=counts)
+        except (AttributeError, ValueError):
             logging.warning("Difference values from diff_valid variable could"
                             " not be plotted.")
-            return
+            return None
 
         # do basic stats
-        diff_mean = np.mean(diff_raster)
-        diff_sd = np.std(diff_raster)
-        diff_abs_mean = np.mean(np.abs(diff_raster))
-        diff_pix = len(diff_valid)
-        diff_pct = (np.float(diff_pix) / np.product(np.shape(diff_raster))) \
-                   * 100.0
+        diff_mean = acc.mean
+        diff_sd = acc.std
+        diff_abs_mean = acc.abs_mean
+        diff_pix = acc.count
+        if n_pix is None:
+            n_pix = diff_pix
+        diff_pct = (float(diff_pix) / n_pix) * 100.0
 
         # annotate plot with file names
-        plt.annotate(str(mast) + "\n" +
-                     str(test) + "\n",
-                     fontsize=5,
-                     xy=(0.01, 0.94),
-                     xycoords='axes fraction')
+        ax.annotate(str(mast) + "\n" +
+                    str(test) + "\n",
+                    fontsize=5,
+                    xy=(0.01, 0.94),
+                    xycoords='axes fraction')
 
         # annotate plot with basic stats
-        plt.annotate("mean diff: " + str(round(diff_mean, 3)) + "\n" +
-                     "std. dev.: " + str(round(diff_sd, 3)) + "\n" +
-                     "abs. mean diff: " + str(round(diff_abs_mean, 3)) + "\n" +
-                     "# diff pixels: " + str(diff_pix) + "\n" +
-                     "% diff: " + str(round(diff_pct, 3)) + "\n" +
-                     "# bins: " + str(bins) + "\n",
-                     xy=(0.68, 0.72),
-                     xycoords='axes fraction')
+        ax.annotate("mean diff: " + str(round(diff_mean, 3)) + "\n" +
+                    "std. dev.: " + str(round(diff_sd, 3)) + "\n" +
+                    "abs. mean diff: " + str(round(diff_abs_mean, 3)) + "\n" +
+                    "# diff pixels: " + str(diff_pix) + "\n" +
+                    "% diff: " + str(round(diff_pct, 3)) + "\n" +
+                    "# bins: " + str(bins) + "\n",
+                    xy=(0.68, 0.72),
+                    xycoords='axes fraction')
 
         # write figure out to PNG
-        plt.savefig(im_out, bbox_inches="tight", dpi=350)
-
-        plt.close()
+        fig.savefig(im_out, bbox_inches="tight", dpi=350)
 
         logging.warning("Difference histogram written to {0}.".format(im_out))
 
+        return im_out
+
 
 class Cleanup:
     @staticmethod
@@ -341,8 +734,10 @@ class Cleanup:
                 test_fnames <str>: test file
                 mast_fnames <str>: master file
             """
-            fn_diffs = sorted(list(set(rm_fn(test_fnames))
-                                   .difference(set(rm_fn(mast_fnames)))))
+            test_fn = rm_fn(test_fnames)
+            mast_fn = set(rm_fn(mast_fnames))
+
+            fn_diffs = sorted(set(test_fn).difference(mast_fn))
 
             if len(fn_diffs) > 0:
                 logging.warning("Files to be removed: {0}".format(fn_diffs))
@@ -350,15 +745,8 @@ class Cleanup:
             if len(fn_diffs) == 0:
                 return test_fnames
 
-            # get only file name
-            test_fn = rm_fn(test_fnames)
-
-            rm = []
-            for ii in test_fn:
-                if ii in fn_diffs:
-                    rm.append(False)
-                else:
-                    rm.append(True)
+            # set lookups keep this linear in the number of files
+            rm = [ii in mast_fn for ii in test_fn]
 
             logging.debug("remove boolean: {0}".format(rm))
             logging.debug("test_fn: {0}".format(test_fn))
@@ -430,6 +818,117 @@ class Cleanup:
 
 
 class Read:
+    @staticmethod
+    def open_file(path):
+        """Open a file for binary reading. Files inside archives are read
+        into an in-memory buffer.
+
+        Args:
+            path <str>: path to file, possibly inside an archive
+        """
+        import gzip
+        import io
+
+        archive, member = split_vsi(path)
+
+        if archive is None:
+            return open(path, "rb")
+
+        if member is None:
+            with gzip.open(archive, "rb") as f:
+                data = f.read()
+        else:
+            # the indexed header lets tarfile seek straight to the member
+            with tarfile.open(archive, "r:*") as tar:
+                data = tar.extractfile(tar_members(archive)[member]).read()
+
+        tracing.add_bytes(len(data))
+
+        return io.BytesIO(data)
+
+    @staticmethod
+    def iter_chunks(path, chunk_size):
+        """Read a file, possibly inside an archive, chunk by chunk without
+        holding all of it in memory.
+
+        Args:
+            path <str>: path to file
+            chunk_size <int>: bytes read at a time
+        """
+        import gzip
+
+        archive, member = split_vsi(path)
+
+        if archive is None:
+            f = open(path, "rb")
+        elif member is None:
+            f = gzip.open(archive, "rb")
+        else:
+            tar = tarfile.open(archive, "r:*")
+            f = tar.extractfile(tar_members(archive)[member])
+
+        try:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                if archive is not None:
+                    tracing.add_bytes(len(chunk))
+                yield chunk
+        finally:
+            f.close()
+            if member is not None:
+                tar.close()
+
+    @staticmethod
+    def read_lines(path):
+        """Read lines of a text file, possibly inside an archive.
+
+        Args:
+            path <str>: path to file
+        """
+        f = Read.open_file(path)
+        lines = [line.decode("utf-8", "replace") for line in f.readlines()]
+        f.close()
+
+        return lines
+
+    @staticmethod
+    def stat(path):
+        """Get (size in bytes, modification time) of a file, possibly inside
+        an archive, without reading it.
+
+        Args:
+            path <str>: path to file
+        """
+        archive, member = split_vsi(path)
+
+        if archive is None:
+            st = os.stat(path)
+            return st.st_size, st.st_mtime
+
+        if member is None:
+            st = os.stat(archive)
+            return st.st_size, st.st_mtime
+
+        info = tar_members(archive)[member]
+
+        return info.size, info.mtime
+
+    @staticmethod
+    def getsize(path):
+        """Get size of a file in bytes, possibly inside an archive.
+
+        Args:
+            path <str>: path to file
+        """
+        archive, member = split_vsi(path)
+
+        if archive is None:
+            return os.path.getsize(path)
+
+        if member is None:
+            return len(Read.open_file(path).getvalue())
+
+        return tar_members(archive)[member].size
+
     @staticmethod
     def open_xml(xml_in):
         """
@@ -4,12 +4,25 @@ Purpose: contains functions to read image data and extract metadata.
 """
 import numpy as np
 import logging
+import tracing
 
 try:
     from osgeo import gdal
 except ImportError:
     import gdal
 
+# minimum number of pixels read at once when iterating native blocks
+WINDOW_PIXELS = 1 << 20
+
+# numpy types of GDAL data types
+GDAL_NUMPY_TYPES = {gdal.GDT_Byte: np.uint8,
+                    gdal.GDT_UInt16: np.uint16,
+                    gdal.GDT_Int16: np.int16,
+                    gdal.GDT_UInt32: np.uint32,
+                    gdal.GDT_Int32: np.int32,
+                    gdal.GDT_Float32: np.float32,
+                    gdal.GDT_Float64: np.float64}
+
 
 class RasterIO:
     @staticmethod
@@ -71,6 +84,129 @@ class RasterIO:
 
         return (rast_arr,r_nd)
 
+    @staticmethod
+    def get_nodata(band):
+        """Get NoData value of a band, None if it is not set.
+
+        Args:
+            band <osgeo.gdal.Band>: open raster band
+        """
+        try:
+            r_nd = band.GetNoDataValue()
+        except AttributeError:
+            logging.warning("Variable {0} does not have NoData value.".
+                            format(band))
+            r_nd = None
+
+        if r_nd is None:
+            logging.info("NoData value could not be determined.")
+        else:
+            logging.info("NoData value: {0}".format(r_nd))
+
+        return r_nd
+
+    @staticmethod
+    def get_windows(band, win_size=None):
+        """Get (xoff, yoff, xsize, ysize) windows covering a band. By default,
+        windows span the full width of the band and a whole number of the
+        band's native block rows, so each block is decoded only once.
+
+        Args:
+            band <osgeo.gdal.Band>: open raster band
+            win_size <int>: use win_size x win_size windows instead of native
+                blocks (default=None)
+        """
+        ncols = band.XSize
+        nrows = band.YSize
+
+        if win_size:
+            x_step = int(win_size)
+            y_step = int(win_size)
+
+        else:
+            by = band.GetBlockSize()[1]
+            x_step = ncols
+            y_step = by * max(1, WINDOW_PIXELS // (ncols * by))
+
+        windows = []
+        for yoff in range(0, nrows, y_step):
+            for xoff in range(0, ncols, x_step):
+                windows.append((xoff, yoff, min(x_step, ncols - xoff),
+                                min(y_step, nrows - yoff)))
+
+        return windows
+
+    @staticmethod
+    def read_window(band, win):
+        """Read one window of a band as an array.
+
+        Args:
+            band <osgeo.gdal.Band>: open raster band
+            win <tuple>: (xoff, yoff, xsize, ysize) of window
+        """
+        with tracing.span("read"):
+            arr = band.ReadAsArray(*win)
+            if arr is not None:
+                tracing.add_bytes(arr.nbytes)
+
+        return arr
+
+    @staticmethod
+    def read_window_raw(band, win):
+        """Read one window of a band as raw bytes, in the band's own data
+        type (no array is allocated).
+
+        Args:
+            band <osgeo.gdal.Band>: open raster band
+            win <tuple>: (xoff, yoff, xsize, ysize) of window
+        """
+        with tracing.span("read"):
+            raw = band.ReadRaster(*win)
+            if raw is not None:
+                tracing.add_bytes(len(raw))
+
+        return raw
+
+    @staticmethod
+    def raw_to_array(raw, band, win):
+        """View raw bytes from read_window_raw as an array. Returns None if
+        the band's data type has no numpy equivalent.
+
+        Args:
+            raw <bytes>: raw window data
+            band <osgeo.gdal.Band>: raster band raw was read from
+            win <tuple>: (xoff, yoff, xsize, ysize) of window
+        """
+        dtype = GDAL_NUMPY_TYPES.get(band.DataType)
+
+        if dtype is None:
+            return None
+
+        return np.frombuffer(raw, dtype=dtype).reshape(win[3], win[2])
+
+    @staticmethod
+    def gdal_type(dtype):
+        """GDAL data type to write an array of a numpy data type. Types
+        GDAL may lack are widened (int8 to Int16, int64 to Int64 or
+        Float64).
+
+        Args:
+            dtype <numpy.dtype>: numpy data type
+        """
+        dtype = np.dtype(dtype)
+
+        for gdt, np_type in GDAL_NUMPY_TYPES.items():
+            if np.dtype(np_type) == dtype:
+                return gdt
+
+        if dtype.kind == "i" and dtype.itemsize == 1:
+            return gdal.GDT_Int16
+
+        if dtype.kind == "i" and hasattr(gdal, "GDT_Int64"):
+            return gdal.GDT_Int64
+
+        return gdal.GDT_Float64
+
     '''
     @staticmethod
     def read_bip_as_array(rast, band_number):
@@ -89,6 +225,107 @@ class RasterIO:
         return rast_arr
     '''
 
+
+class RasterDataset:
+    """An open raster whose subdatasets and bands are opened once and kept
+    open, with the NoData value of each band.
+
+    Band ii is band ii + 1 of the raster, subdataset ii of an HDF/NetCDF
+    file (sds=True), or the only band of a single band raster. Subdatasets
+    are separate GDAL datasets, so their bands can be read from different
+    threads. Bands of one multiband dataset share its block cache and must
+    not be; with separate=True each band gets a dataset handle of its own.
+    """
+    def __init__(self, path, ds=None, separate=False):
+        """
+        Args:
+            path <str>: path to raster file
+            ds <osgeo.gdal.Dataset>: raster already opened from path
+                (default=None)
+            separate <bool>: open a dataset handle per band of a multiband
+                raster (default=False)
+        """
+        self.path = path
+        self.ds = ds if ds is not None else RasterIO.open_raster(path)
+        self.separate = separate
+
+        self._sds = None
+        self._bands = {}
+        self._nodata = {}
+
+        # datasets the bands belong to; GDAL bands do not keep them open
+        self._handles = {}
+
+    @property
+    def sds(self):
+        """(name, description) of each subdataset."""
+        if self._sds is None:
+            self._sds = RasterIO.get_sds(self.ds)
+        return self._sds
+
+    def band(self, ii, sds=False):
+        """Get band ii, opening it on first use.
+
+        Args:
+            ii <int>: band (or subdataset) number, from 0
+            sds <bool>: band ii is the first band of subdataset ii
+                (default=False)
+        """
+        if ii not in self._bands:
+            if sds:
+                ds = RasterIO.open_raster(self.sds[ii][0])
+                self._handles[ii] = ds
+                self._bands[ii] = ds.GetRasterBand(1)
+
+            elif self.separate and self.ds.RasterCount > 1:
+                ds = RasterIO.open_raster(self.path)
+                self._handles[ii] = ds
+                self._bands[ii] = ds.GetRasterBand(ii + 1)
+
+            else:
+                self._bands[ii] = self.ds.GetRasterBand(ii + 1)
+
+        return self._bands[ii]
+
+    def name(self, ii, sds=False):
+        """Name of band ii within the file (e.g. for cache keys).
+
+        Args:
+            ii <int>: band (or subdataset) number, from 0
+            sds <bool>: band ii is the first band of subdataset ii
+                (default=False)
+        """
+        if sds:
+            return "sds_{0}:{1}".format(ii, self.sds[ii][0].split(":")[-1])
+
+        return "band_" + str(ii + 1)
+
+    def nodata(self, ii, sds=False):
+        """NoData value of band ii, None if it is not set.
+
+        Args:
+            ii <int>: band (or subdataset) number, from 0
+            sds <bool>: band ii is the first band of subdataset ii
+                (default=False)
+        """
+        if ii not in self._nodata:
+            self._nodata[ii] = RasterIO.get_nodata(self.band(ii, sds))
+        return self._nodata[ii]
+
+    def geo(self, ii, sds=False):
+        """(projection, geotransform) of the dataset holding band ii.
+
+        Args:
+            ii <int>: band (or subdataset) number, from 0
+            sds <bool>: band ii is the first band of subdataset ii
+                (default=False)
+        """
+        self.band(ii, sds)
+        ds = self._handles.get(ii, self.ds)
+
+        return ds.GetProjectionRef(), ds.GetGeoTransform()
+
+
 class RasterCmp:
     @staticmethod
     def compare_proj_ref(test, mast):
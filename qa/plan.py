@@ -0,0 +1,289 @@
+"""plan.py
+
+Purpose: plan QA runs as a manifest of file pair jobs, split the manifest
+         into shards balanced by size (one per machine), and merge the
+         results of the shards.
+"""
+import os
+import json
+import logging
+
+MANIFEST_VERSION = 1
+
+# per-shard output directories, inside the QA output directory
+SHARD_DIR = "shard_{0}_of_{1}"
+
+
+def parse_shard(shard):
+    """Parse a shard given as "i/N" (1 <= i <= N).
+
+    Args:
+        shard <str>: shard number and count
+    """
+    try:
+        i, n = [int(v) for v in shard.split("/")]
+    except ValueError:
+        raise ValueError("Shard must be given as i/N, not {0}".format(shard))
+
+    if not 1 <= i <= n:
+        raise ValueError("Shard {0} is not between 1 and {1}".format(i, n))
+
+    return i, n
+
+
+def shard_dir(dir_out, i, n):
+    """Get output directory of shard i of n.
+
+    Args:
+        dir_out <str>: QA output directory
+        i <int>: shard number
+        n <int>: number of shards
+    """
+    return dir_out + os.sep + SHARD_DIR.format(i, n)
+
+
+def pair_entries(test_dir, mast_dir):
+    """List the file pair jobs of one test/master leaf directory (or archive)
+    pair, paired the same way qa_pair pairs them.
+
+    Args:
+        test_dir <str|FileIndex>: test leaf directory or archive, or its
+            index
+        mast_dir <str|FileIndex>: master leaf directory or archive, or its
+            index
+    """
+    from file_io import Find, FileIndex, Cleanup, Read, NO_STREAM_EXTS, \
+        file_kind
+    from image_io import RasterIO
+
+    test_idx = test_dir if isinstance(test_dir, FileIndex) else \
+        FileIndex.build(test_dir)
+    mast_idx = mast_dir if isinstance(mast_dir, FileIndex) else \
+        FileIndex.build(mast_dir)
+
+    entries = []
+
+    for ext in Find.get_ext(test_idx.files, mast_idx.files):
+        kind = file_kind(ext)
+        if kind is None:
+            continue
+
+        test_f = test_idx.find(ext)
+        mast_f = mast_idx.find(ext)
+
+        if ext == ".img":
+            test_f = Cleanup.rm_files(test_f, "_hdf.img")
+            mast_f = Cleanup.rm_files(mast_f, "_hdf.img")
+
+        test_f, mast_f = Cleanup.remove_nonmatching_files(test_f, mast_f)
+
+        for t, m in zip(test_f, mast_f):
+            size = Read.stat(t)[0] + Read.stat(m)[0]
+
+            # band counts of rasters that can be opened where they are;
+            # others (e.g. HDF inside an archive) are one entry
+            n_bands = None
+            if kind == "image" and not (test_idx.archive and
+                                        ext.lower() in NO_STREAM_EXTS):
+                ds_test = RasterIO.open_raster(t)
+                ds_mast = RasterIO.open_raster(m)
+                if ds_test is not None and ds_mast is not None:
+                    n_bands = Find.count(t, ds_test, m, ds_mast, ext)
+
+            bands = range(n_bands) if n_bands else [None]
+
+            for band in bands:
+                entries.append({"test_dir": test_idx.root,
+                                "mast_dir": mast_idx.root,
+                                "test": t,
+                                "mast": m,
+                                "ext": ext,
+                                "kind": kind,
+                                "band": band,
+                                "bytes": size // len(bands)})
+
+    return entries
+
+
+def build_plan(test_dirs, mast_dirs):
+    """Build the manifest of all file pair jobs, in the order a single run
+    processes them.
+
+    Args:
+        test_dirs <list>: test leaf directories or archives (or indexes)
+        mast_dirs <list>: matching master leaf directories or archives
+    """
+    entries = []
+    for test_dir, mast_dir in zip(test_dirs, mast_dirs):
+        entries += pair_entries(test_dir, mast_dir)
+
+    return {"version": MANIFEST_VERSION, "entries": entries}
+
+
+def write_manifest(manifest, path):
+    """Write a manifest as JSON.
+
+    Args:
+        manifest <dict>: manifest from build_plan
+        path <str>: output file
+    """
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    logging.warning("Wrote {0} jobs ({1} MB) to manifest {2}.".format(
+        len(manifest["entries"]),
+        sum(e["bytes"] for e in manifest["entries"]) >> 20, path))
+
+
+def read_manifest(path):
+    """Read a manifest written by write_manifest.
+
+    Args:
+        path <str>: manifest file
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError("Manifest {0} has version {1}, expected {2}".format(
+            path, manifest.get("version"), MANIFEST_VERSION))
+
+    return manifest
+
+
+def assign_shards(manifest, n):
+    """Assign file pairs to n shards, balanced by estimated bytes: largest
+    pairs first, each to the shard with the fewest bytes so far. All bands
+    of a file pair go to the same shard, since verdicts, plots and cached
+    results are per pair. The result only depends on the manifest.
+
+    Args:
+        manifest <dict>: manifest from build_plan
+        n <int>: number of shards
+
+    Returns:
+        <dict>: shard number (1..n) of each test file
+    """
+    sizes = {}
+    order = []
+    for e in manifest["entries"]:
+        if e["test"] not in sizes:
+            sizes[e["test"]] = 0
+            order.append(e["test"])
+        sizes[e["test"]] += e["bytes"]
+
+    load = [0] * n
+    shard_of = {}
+
+    for pos, test in sorted(enumerate(order),
+                            key=lambda p: (-sizes[p[1]], p[0])):
+        i = load.index(min(load))
+        load[i] += sizes[test]
+        shard_of[test] = i + 1
+
+    for i in range(n):
+        logging.info("Shard {0}/{1}: {2} MB".format(i + 1, n, load[i] >> 20))
+
+    return shard_of
+
+
+def shard_jobs(manifest, i, n):
+    """Get the leaf directory pairs of shard i of n, and the test files of
+    each to compare.
+
+    Args:
+        manifest <dict>: manifest from build_plan
+        i <int>: shard number (1..n)
+        n <int>: number of shards
+
+    Returns:
+        <list>: (test_dir, mast_dir, test files) tuples, in manifest order
+    """
+    shard_of = assign_shards(manifest, n)
+
+    jobs = []
+    for e in manifest["entries"]:
+        if shard_of[e["test"]] != i:
+            continue
+
+        if not jobs or jobs[-1][:2] != (e["test_dir"], e["mast_dir"]):
+            jobs.append((e["test_dir"], e["mast_dir"], set()))
+        jobs[-1][2].add(e["test"])
+
+    return jobs
+
+
+def merge_shards(dir_out):
+    """Merge the results of all shards in dir_out into one results.jsonl and
+    stats.csv in dir_out. The shard directories must all come from one split
+    (the same N): each file pair is then in one shard only, whose
+    results.jsonl is appended in run order, so its last result of the pair
+    is kept. Shards of different splits are not merged, since nothing tells
+    which of their results of a pair is the latest.
+
+    Args:
+        dir_out <str>: QA output directory holding the shard directories
+    """
+    import glob
+    import re
+    import stats
+    from results import RESULTS_NAME
+
+    dirs = sorted(glob.glob(dir_out + os.sep + SHARD_DIR.format("*", "*")))
+    if not dirs:
+        logging.critical("No shard directories found in {0}".format(dir_out))
+        return None
+
+    counts = set()
+    found = set()
+    for d in dirs:
+        m = re.search(r"shard_(\d+)_of_(\d+)$", d)
+        if m and os.path.isfile(d + os.sep + RESULTS_NAME):
+            found.add(int(m.group(1)))
+            counts.add(int(m.group(2)))
+
+    if len(counts) > 1:
+        logging.critical("Shards of several splits ({0}) found in {1}; "
+                         "remove all but one split before merging.".format(
+                             ", ".join("N={0}".format(n)
+                                       for n in sorted(counts)), dir_out))
+        return None
+
+    # warn about shards that did not write results
+    for n in counts:
+        missing = sorted(set(range(1, n + 1)) - found)
+        if missing:
+            logging.warning("No results from shard(s) {0} of {1}".format(
+                missing, n))
+
+    records = {}
+    for d in dirs:
+        fn = d + os.sep + RESULTS_NAME
+        if not os.path.isfile(fn):
+            continue
+
+        with open(fn) as f:
+            for line in f:
+                if line.strip():
+                    r = json.loads(line)
+                    records[(r["test"], r["mast"])] = r
+
+    merged = [records[k] for k in sorted(records)]
+
+    with open(dir_out + os.sep + RESULTS_NAME, "w") as f:
+        for r in merged:
+            f.write(json.dumps(r, sort_keys=True) + "\n")
+
+    fn_stats = dir_out + os.sep + "stats.csv"
+    if os.path.isfile(fn_stats):
+        os.remove(fn_stats)
+
+    stats.write_stats(dir_out, [tuple(b["stats"][k]
+                                      for k in stats.STATS_HEADER)
+                                for r in merged for b in r["bands"]
+                                if b["stats"]])
+
+    logging.warning("Merged {0} pair results from {1} shard directories "
+                    "into {2}.".format(len(merged), len(dirs), dir_out))
+
+    return merged
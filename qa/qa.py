@@ -6,7 +6,7 @@ Purpose: Perform QA on georeferenced images and associated metadata. Designed
          (EROS) Science Processing Architecture
          (ESPA; https://espa.cr.usgs.gov/.)
          Extract and clean up data automatically (if necessary.)
-         Report results in logfile, CSV and plots.
+         Report results in logfile, CSV, JSON Lines and plots.
 
 Author:   Steve Foga
 Contact:  steven.foga.ctr@usgs.gov
@@ -24,19 +24,362 @@ Changelog:
                  Updated TODOs
     15 Mar 2017: Added optional XML schema validation; fixed typos
     21 Mar 2017: Added flag to include/exclude nodata from calculations
+    16 Oct 2026: Stream rasters through diff/stats/plots window-by-window;
+                 optional process pool over leaf directory pairs; read
+                 archives in place without extracting them; cache results
+                 of unchanged image pairs; write per-pair results to
+                 results.jsonl (and optionally Parquet); compare several
+                 test directories against one master read
 
 """
 
 # TODO (med): Enable SDS sorting with NetCDF, HDF files.
 # TODO (low): Implement checking file names with XML.
+import logging
+import tracing
+
+
+def qa_pair(test_dir, mast_dir, dir_out, xml_schema=False, incl_nd=False,
+            block_size=None, cache_path=None, policy=None, files=None,
+            band_cache_path=None, band_cache_mb=None, band_threads=None,
+            xml_tolerance=0):
+    """Run QA on the files of one test/master leaf directory pair, or of one
+    test/master archive pair (read in place, without extraction).
+
+    Several test leaf directories (e.g. of different builds) can be compared
+    against the same master leaf directory at once; each master image is
+    then read once for all of them.
+
+    Args:
+        test_dir <str|FileIndex|list>: test leaf directory or archive, or
+            its index; or a list of them
+        mast_dir <str|FileIndex>: master leaf directory or archive, or its
+            index
+        dir_out <str|list>: path to QA output directory; a list of one per
+            test leaf directory if test_dir is a list
+        xml_schema <str>: test any XML files against XML schema.
+            (default=False)
+        incl_nd <bool>: include nodata in comparisons (default=False)
+        block_size <int>: compare rasters in block_size x block_size windows,
+            native GDAL blocks if None (default=None)
+        cache_path <str>: path to result cache, no caching if None
+            (default=None)
+        policy <qa_images.Policy>: how image differences are judged, exact
+            if None (default=None)
+        files <set>: compare only these test files (and their master
+            files), all if None; single test leaf directory only
+            (default=None)
+        band_cache_path <str>: directory of decoded master bands, not used
+            if None (default=None)
+        band_cache_mb <float>: size cap of the band cache in MB,
+            band_cache.MAX_MB if None (default=None)
+        band_threads <int>: bands of a multiband image compared at a time,
+            qa_images.BAND_THREADS if None (default=None)
+        xml_tolerance <float>: relative tolerance of numeric XML values
+            (default=0)
+
+    Returns:
+        <list>: image pair results (see GeoImage.check_images_multi) and XML
+            pair results (see MetadataQA.check_xml_files), in processing
+            order; "candidate" is the position of the test leaf directory in
+            test_dir
+    """
+    import logging
+    import os
+    import shutil
+    import tempfile
+    from file_io import Extract, Find, FileIndex, Cleanup, NO_STREAM_EXTS, \
+        file_kind
+    from qa_images import GeoImage
+    from qa_metadata import MetadataQA
+    from cache import ResultCache
+    from band_cache import BandCache, MAX_MB
+
+    if isinstance(test_dir, (list, tuple)):
+        test_dirs = list(test_dir)
+        dir_outs = list(dir_out)
+    else:
+        test_dirs = [test_dir]
+        dir_outs = [dir_out]
+
+    results = []
+    dir_scratch = None
+    cache = ResultCache(cache_path) if cache_path else None
+
+    band_cache = None
+    if band_cache_path:
+        band_cache = BandCache(band_cache_path, band_cache_mb or MAX_MB)
+
+    # index files once; all lookups below use the index
+    test_idxs = [d if isinstance(d, FileIndex) else FileIndex.build(d)
+                 for d in test_dirs]
+    mast_idx = mast_dir if isinstance(mast_dir, FileIndex) else \
+        FileIndex.build(mast_dir)
+
+    # Find unique file extensions
+    exts = Find.get_ext(*([idx.files for idx in test_idxs] +
+                          [mast_idx.files]))
+
+    for j in exts:
+        logging.info("Finding {0} files...".format(j))
+        test_fs = [idx.find(j) for idx in test_idxs]
+        mast_f = mast_idx.find(j)
+
+        # only the files of this shard
+        if files is not None:
+            test_fs[0] = [f for f in test_fs[0] if f in files]
+            names = set(os.path.basename(f) for f in test_fs[0])
+            mast_f = [f for f in mast_f if os.path.basename(f) in names]
+
+            if not test_fs[0]:
+                continue
+
+        for idx, test_f in zip(test_idxs, test_fs):
+            logging.info("Performing QA on {0} files located in {1}".
+                         format(j, idx.root))
+            logging.info("Test files: {0}".format(test_f))
+        logging.info("Mast files: {0}".format(mast_f))
+
+        # remove any _hdf.img files found with .img files
+        if j == ".img":
+            test_fs = [Cleanup.rm_files(test_f, "_hdf.img")
+                       for test_f in test_fs]
+            mast_f = Cleanup.rm_files(mast_f, "_hdf.img")
+
+        # extract files that cannot be read inside an archive; the master
+        # files only once
+        if j.lower() in NO_STREAM_EXTS and test_idxs[0].archive:
+            if dir_scratch is None:
+                dir_scratch = tempfile.mkdtemp(prefix="scratch_",
+                                               dir=dir_outs[0])
+            for c in range(len(test_fs)):
+                name = "test" if len(test_fs) == 1 else "test_" + str(c)
+                test_fs[c] = Extract.extract_members(test_fs[c], dir_scratch +
+                                                     os.sep + name)
+            mast_f = Extract.extract_members(mast_f, dir_scratch +
+                                             os.sep + "mast")
+
+        # if a text-based file
+        if file_kind(j) == "text":
+            with tracing.span("metadata", ext=j):
+                for c, test_f in enumerate(test_fs):
+                    # xml files are also validated, if a schema is given
+                    xml_results = MetadataQA.check_text_files(
+                        test_f, mast_f, j, tolerance=xml_tolerance,
+                        schema=xml_schema or None)
+
+                    for result in xml_results or []:
+                        result["candidate"] = c
+                        results.append(result)
+
+        # if non-geo image
+        elif file_kind(j) == "jpeg":
+            with tracing.span("metadata", ext=j):
+                for test_f, d_out in zip(test_fs, dir_outs):
+                    MetadataQA.check_jpeg_files(test_f, mast_f, d_out)
+
+        # if no extension
+        elif file_kind(j) is None:
+            continue
+
+        # else, it's probably a geo-based image
+        else:
+            results += GeoImage.check_images_multi(test_fs, mast_f, dir_outs,
+                                                   j, include_nd=incl_nd,
+                                                   win_size=block_size,
+                                                   cache=cache, policy=policy,
+                                                   band_cache=band_cache,
+                                                   band_threads=band_threads)
+
+    if dir_scratch is not None:
+        shutil.rmtree(dir_scratch, ignore_errors=True)
+
+    if cache is not None:
+        cache.close()
+
+    if band_cache is not None:
+        band_cache.close()
+
+    return results
+
+
+class _BufferHandler(logging.Handler):
+    """Keep log records in memory so a worker can hand them to the parent."""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        # format now; args and tracebacks may not be picklable
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+_worker_log = None
+
+
+def _init_worker(cache_bytes, log_level, trace=False):
+    """Pool initializer: set this worker's GDAL cache and buffer its logging.
+
+    Args:
+        cache_bytes <int>: GDAL block cache size of this worker
+        log_level <int>: logging level
+        trace <bool>: record spans (default=False)
+    """
+    global _worker_log
+
+    try:
+        from osgeo import gdal
+    except ImportError:
+        import gdal
+
+    gdal.SetCacheMax(cache_bytes)
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+
+    _worker_log = _BufferHandler()
+    root.addHandler(_worker_log)
+    root.setLevel(log_level)
+
+    tracing.enable(trace)
+
+
+def _run_pair(args):
+    """Pool task: run qa_pair, return its log records, pair results and
+    trace spans.
+
+    Args:
+        args <tuple>: positional arguments of qa_pair
+    """
+    _worker_log.records = []
+    results = qa_pair(*args)
+
+    return _worker_log.records, results, tracing.drain()
+
+
+def find_pairs(dir_mast, dir_test, dir_out, archive=True, extract=True):
+    """Find the test/master leaf directory pairs (or archive pairs) to
+    compare, extracting archives first if needed.
+
+    Args:
+        dir_mast <str>: path to master directory
+        dir_test <str|list>: path to test directory, or to several test
+            directories compared against the same master
+        dir_out <str>: path to QA output directory
+        archive <bool>: cleanup, extract from archives, else assume dirs
+            (default=True)
+        extract <bool>: extract archives to disk, else pair the archives
+            themselves (default=True)
+
+    Returns:
+        <tuple>: lists of test and master dirs (FileIndex) or archives; if
+            dir_test is a list, the test dirs are a list per test directory
+    """
+    import sys
+    import os
+    from file_io import Extract, Find, FileIndex, Cleanup
+
+    multi = isinstance(dir_test, (list, tuple))
+    dir_tests = list(dir_test) if multi else [dir_test]
+
+    if archive and not extract:
+        # each archive pair is compared in place
+        test_dirs = [sorted(Find.find_files(d, ".gz")) for d in dir_tests]
+        mast_dirs = sorted(Find.find_files(dir_mast, ".gz"))
+
+        if any(len(t) != len(mast_dirs) for t in test_dirs):
+            logging.critical("Number of archives in Master differs from "
+                             "Test.")
+            sys.exit(1)
+
+        return test_dirs if multi else test_dirs[0], mast_dirs
+
+    if archive:
+        # do initial cleanup of input directories
+        Cleanup.cleanup_files(dir_mast)
+        for d in dir_tests:
+            Cleanup.cleanup_files(d)
+
+        # create output directory if it doesn't exist
+        if not os.path.exists(dir_out):
+            os.makedirs(dir_out)
+
+        # read in .tar.gz files
+        test_files = [Find.find_files(d, ".gz") for d in dir_tests]
+        mast_files = Find.find_files(dir_mast, ".gz")
+
+        # Extract files from archives, the master's only once
+        Extract.unzip_gz_files(test_files[0], mast_files)
+        for files in test_files[1:]:
+            Extract.unzip_archives(files)
+
+    # index each tree once, then find only the deepest dirs
+    mast_index = FileIndex.build(dir_mast)
+    mast_dirs = [mast_index.subset(d) for d in mast_index.leaf_dirs()]
+
+    test_dirs = []
+    for d in dir_tests:
+        test_index = FileIndex.build(d)
+        test_dirs.append([test_index.subset(leaf)
+                          for leaf in test_index.leaf_dirs()])
+
+        if len(test_dirs[-1]) != len(mast_dirs):
+            logging.critical("Directory structure of Master differs from "
+                             "Test {0}.".format(d))
+            sys.exit(1)
+
+    return test_dirs if multi else test_dirs[0], mast_dirs
+
+
+def candidate_dirs(dir_out, dir_tests):
+    """Get the output directory of each test directory compared against the
+    same master: dir_out itself for a single test directory, else a
+    subdirectory named after the test directory.
+
+    Args:
+        dir_out <str>: path to QA output directory
+        dir_tests <list>: paths to test directories
+    """
+    import os
+
+    if len(dir_tests) == 1:
+        return [dir_out]
+
+    names = [os.path.basename(os.path.normpath(d)) or "test"
+             for d in dir_tests]
+
+    # number test directories with the same name
+    dirs = []
+    for c, name in enumerate(names):
+        if names.count(name) > 1:
+            name += "_" + str(c + 1)
+        dirs.append(dir_out + os.sep + name)
+
+    return dirs
+
 
 def qa_data(dir_mast, dir_test, dir_out, archive=True, xml_schema=False,
-            verbose=False, incl_nd=False):
+            verbose=False, incl_nd=False, block_size=None, workers=1,
+            gdal_cache=None, extract=True, cache=True, parquet=False,
+            trace=False, tolerance_mode="exact", tolerance=0,
+            verdict_only=False, plan=None, shard=None, manifest=None,
+            merge=False, band_cache=None, band_cache_mb=None,
+            band_threads=None, xml_tolerance=0):
     """Function to check files and call appropriate QA module(s)
 
     Args:
         dir_mast <str>: path to master directory
-        dir_test <str>: path to test directory
+        dir_test <str|list>: path to test directory, or to several test
+            directories (e.g. candidate builds) compared against the same
+            master; each master image is read once for all of them, and the
+            results of each go to a subdirectory of dir_out named after it
         dir_out <str>: path to QA output directory
         archive <bool>: cleanup, extract from archives, else assume dirs
             (default=True)
@@ -44,21 +387,69 @@ def qa_data(dir_mast, dir_test, dir_out, archive=True, xml_schema=False,
             (default=False)
         verbose <bool>: enable/disable verbose logging (default=False)
         incl_nd <bool>: include nodata in comparisons (default=False)
+        block_size <int>: compare rasters in block_size x block_size windows,
+            native GDAL blocks if None (default=None)
+        workers <int>: number of processes comparing leaf directory pairs
+            (default=1)
+        gdal_cache <int>: total GDAL block cache in MB, split evenly across
+            workers; GDAL's default if None (default=None)
+        extract <bool>: extract archives to disk; if False, read files in
+            place through GDAL's /vsitar/ and /vsigzip/ file systems and
+            extract only formats that cannot be read that way (default=True)
+        cache <bool>: reuse results of image pairs whose files did not
+            change since the last run with the same dir_out (default=True)
+        parquet <bool>: also write image pair results to results.parquet,
+            needs pyarrow (default=False)
+        trace <bool>: write time, bytes read and peak memory per stage and
+            per image pair to trace_summary.json and trace.json (Chrome
+            trace format) (default=False)
+        tolerance_mode <str>: "exact", "abs", "rel" or "ulp"; image pixels
+            only count as different if they exceed the tolerance
+            (default="exact")
+        tolerance <float>: absolute, relative or ULP tolerance (default=0)
+        verdict_only <bool>: stop reading an image pair at its first
+            violation; no stats or plots (default=False)
+        plan <str>: only write the manifest of file pair jobs to this file
+            (default=None)
+        shard <str>: "i/N", run only shard i of N of the manifest, writing
+            to dir_out/shard_i_of_N (default=None)
+        manifest <str>: manifest to shard; planned now if None
+            (default=None)
+        merge <bool>: only merge the results of the shards in dir_out
+            (default=False)
+        band_cache <str>: keep decoded master bands in this directory and
+            memory-map them on later runs (default=None)
+        band_cache_mb <float>: size cap of the band cache in MB; least
+            recently used bands are evicted beyond it (default=None,
+            band_cache.MAX_MB)
+        band_threads <int>: bands (or HDF/NetCDF subdatasets) of a
+            multiband image compared at a time, on threads of each worker
+            (default=None, qa_images.BAND_THREADS)
+        xml_tolerance <float>: XML files are compared element by element;
+            numeric values are equal within this relative tolerance
+            (default=0)
     """
     import sys
     import os
-    from file_io import Extract, Find, Cleanup
-    from qa_images import GeoImage
-    from qa_metadata import MetadataQA
-    import logging
+    from file_io import Cleanup
+    from cache import ResultCache, CACHE_NAME
+    from results import ResultsSink
+    from qa_images import Policy
+    import plan as qa_plan
     import time
 
     # start timing code
     t0 = time.time()
+    tracing.enable(trace)
+
+    # each shard writes to its own directory
+    if shard:
+        shard_i, shard_n = qa_plan.parse_shard(shard)
+        dir_out = qa_plan.shard_dir(dir_out, shard_i, shard_n)
 
     # create output dir if it doesn't exist
     if not os.path.exists(dir_out):
-        os.mkdir(dir_out)
+        os.makedirs(dir_out)
 
     # initiate logger
     if verbose:
@@ -76,81 +467,143 @@ def qa_data(dir_mast, dir_test, dir_out, archive=True, xml_schema=False,
                             level=logging.WARNING,
                             format='%(asctime)s - %(levelname)s - %(message)s')
 
-    if archive:
-        # do initial cleanup of input directories
-        Cleanup.cleanup_files(dir_mast)
-        Cleanup.cleanup_files(dir_test)
+    if merge:
+        if qa_plan.merge_shards(dir_out) is None:
+            sys.exit(1)
+        return
 
-        # create output directory if it doesn't exist
-        if not os.path.exists(dir_out):
-            os.makedirs(dir_out)
+    dir_tests = list(dir_test) if isinstance(dir_test, (list, tuple)) \
+        else [dir_test]
 
-        # read in .tar.gz files
-        test_files = Find.find_files(dir_test, ".gz")
-        mast_files = Find.find_files(dir_mast, ".gz")
+    if (plan or shard) and len(dir_tests) > 1:
+        logging.critical("Planning and sharding need a single test "
+                         "directory.")
+        sys.exit(1)
+
+    # several machines must not extract into the same input directories
+    if (plan or shard) and archive and extract:
+        logging.critical("Planning and sharding need --no-extract or "
+                         "--no-archive.")
+        sys.exit(1)
 
-        # Extract files from archive
-        Extract.unzip_gz_files(test_files, mast_files)
+    if shard and manifest:
+        man = qa_plan.read_manifest(manifest)
 
-    # find only the deepest dirs
-    test_dirs = sorted([r for r, d, f in os.walk(dir_test) if not d])
-    mast_dirs = sorted([r for r, d, f in os.walk(dir_mast) if not d])
+    else:
+        test_dirs, mast_dirs = find_pairs(dir_mast, dir_tests, dir_out,
+                                          archive, extract)
 
-    if len(test_dirs) != len(mast_dirs):
-        logging.critical("Directory structure of Master differs from Test.")
-        sys.exit(1)
+        if plan:
+            qa_plan.write_manifest(qa_plan.build_plan(test_dirs[0],
+                                                      mast_dirs), plan)
+            return
 
-    for i in range(0, len(test_dirs)):
-        # Find extracted files
-        all_test = sorted(Find.find_files(test_dirs[i], ".*"))
-        all_mast = sorted(Find.find_files(mast_dirs[i], ".*"))
+        if shard:
+            man = qa_plan.build_plan(test_dirs[0], mast_dirs)
 
-        # Find unique file extensions
-        exts = Find.get_ext(all_test, all_mast)
+    # results of each test directory go to its own output directory
+    dir_outs = candidate_dirs(dir_out, dir_tests)
+    for d in dir_outs:
+        if not os.path.exists(d):
+            os.makedirs(d)
 
-        for j in exts:
-            logging.info("Finding {0} files...".format(j))
-            test_f = Find.find_files(test_dirs[i], j)
-            mast_f = Find.find_files(mast_dirs[i], j)
+    if shard:
+        pairs = qa_plan.shard_jobs(man, shard_i, shard_n)
+    elif len(dir_tests) == 1:
+        pairs = [(test_dirs[0][i], mast_dirs[i], None)
+                 for i in range(0, len(mast_dirs))]
+    else:
+        # all test directories in one job per master leaf directory
+        pairs = [([t[i] for t in test_dirs], mast_dirs[i], None)
+                 for i in range(0, len(mast_dirs))]
 
-            logging.info("Performing QA on {0} files located in {1}".
-                         format(j, dir_test))
-            logging.info("Test files: {0}".format(test_f))
-            logging.info("Mast files: {0}".format(mast_f))
-
-            # remove any _hdf.img files found with .img files
-            if j == ".img":
-                test_f = Cleanup.rm_files(test_f, "_hdf.img")
-                mast_f = Cleanup.rm_files(mast_f, "_hdf.img")
-
-            # if a text-based file
-            if (j.lower() == ".txt" or j.lower() == ".xml"
-                or j.lower() == ".gtf" or j.lower() == ".hdr"
-                or j.lower() == ".stats"):
-                MetadataQA.check_text_files(test_f, mast_f, j)
-
-                # if text-based file is xml
-                if j.lower() == ".xml" and xml_schema:
-                    MetadataQA.check_xml_schema(test_f, xml_schema)
-                    MetadataQA.check_xml_schema(mast_f, xml_schema)
-
-            # if non-geo image
-            elif j.lower() == ".jpg":
-                MetadataQA.check_jpeg_files(test_f, mast_f, dir_out)
-
-            # if no extension
-            elif len(j) == 0:
-                continue
+    if cache:
+        cache_path = dir_out + os.sep + CACHE_NAME
+    else:
+        cache_path = None
 
-            # else, it's probably a geo-based image
-            else:
-                GeoImage.check_images(test_f, mast_f, dir_out, j,
-                                      include_nd=incl_nd)
+    policy = Policy(tolerance_mode, tolerance, verdict_only=verdict_only)
 
-    if archive:
+    job_out = dir_outs if len(dir_tests) > 1 else dir_out
+    jobs = [(test_dir, mast_dir, job_out, xml_schema, incl_nd, block_size,
+             cache_path, policy, files, band_cache, band_cache_mb,
+             band_threads, xml_tolerance)
+            for test_dir, mast_dir, files in pairs]
+
+    # results.jsonl, stats.csv (and results.parquet) of each test directory
+    # are written by one thread
+    sinks = [ResultsSink(d, parquet=parquet) for d in dir_outs]
+
+    if workers > 1:
+        import multiprocessing
+
+        try:
+            from osgeo import gdal
+        except ImportError:
+            import gdal
+
+        # each worker gets its own share of the GDAL block cache
+        if gdal_cache:
+            cache_bytes = (int(gdal_cache) << 20) // workers
+        else:
+            cache_bytes = gdal.GetCacheMax() // workers
+
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                    initargs=(cache_bytes,
+                                              logging.getLogger().level,
+                                              trace))
+
+        # imap keeps job order, so logs and results do not depend on the
+        # number of workers
+        try:
+            for records, results, events in pool.imap(_run_pair, jobs):
+                for record in records:
+                    logging.getLogger(record.name).handle(record)
+
+                tracing.extend(events)
+
+                for result in results:
+                    sinks[result["candidate"]].put(result)
+
+        finally:
+            pool.close()
+            pool.join()
+            for sink in sinks:
+                sink.close()
+
+    else:
+        if gdal_cache:
+            try:
+                from osgeo import gdal
+            except ImportError:
+                import gdal
+
+            gdal.SetCacheMax(int(gdal_cache) << 20)
+
+        try:
+            for job in jobs:
+                for result in qa_pair(*job):
+                    sinks[result["candidate"]].put(result)
+
+        finally:
+            for sink in sinks:
+                sink.close()
+
+    if cache_path:
+        result_cache = ResultCache(cache_path)
+        result_cache.evict()
+        result_cache.close()
+
+    if archive and extract:
         # Clean up files
-        Cleanup.cleanup_files(dir_mast)
-        Cleanup.cleanup_files(dir_test)
+        with tracing.span("cleanup"):
+            Cleanup.cleanup_files(dir_mast)
+            for d in dir_tests:
+                Cleanup.cleanup_files(d)
+
+    if trace:
+        logging.warning("Stage timings written to {0}.".format(
+            tracing.write(dir_out)))
 
     # end timing
     t1 = time.time()
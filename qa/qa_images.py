@@ -1,79 +1,868 @@
 # qa_images.py
 import logging
 import numpy as np
+import tracing
+from collections import namedtuple
 
+# longest side (in pixels) of the preview used for difference plots
+PREVIEW_SIZE = 2000
 
-def do_diff(test, mast, nodata=False):
+# how preview cells summarize their pixels, "maxabs" or "mean"
+PREVIEW_REDUCE = "maxabs"
+
+# bands (or subdatasets) of a multiband image compared at a time
+BAND_THREADS = 2
+
+# bands with at most this fraction of pixels beyond tolerance get a sparse
+# record of those pixels (.npz), others a dense GeoTIFF (see DiffRecord)
+SPARSE_FRACTION = 0.01
+
+# cells along each side of the difference heatmap
+HEATMAP_CELLS = 64
+
+# one window of a test/master band pair and their difference; "nodata" is a
+# boolean bitmap of pixels that are nodata in either band (None if unmasked)
+Window = namedtuple("Window", ["xoff", "yoff", "test", "mast", "diff",
+                               "nodata"])
+
+# signed integer types tried, smallest first, to hold integer differences
+DIFF_INT_TYPES = (np.int8, np.int16, np.int32, np.int64)
+
+
+def diff_dtype(t_dtype, m_dtype):
+    """Get the smallest data type that holds test - mast without overflow,
+    e.g. int16 for uint8 inputs or int32 for int16 inputs. Floating point
+    inputs keep their (common) precision.
+
+    Args:
+        t_dtype <numpy.dtype>: data type of test array
+        m_dtype <numpy.dtype>: data type of master array
+    """
+    t_dtype = np.dtype(t_dtype)
+    m_dtype = np.dtype(m_dtype)
+
+    if t_dtype.kind not in "biu" or m_dtype.kind not in "biu":
+        return np.result_type(t_dtype, m_dtype, np.float32)
+
+    def limits(dt):
+        if dt.kind == "b":
+            return 0, 1
+        info = np.iinfo(dt)
+        return int(info.min), int(info.max)
+
+    t_min, t_max = limits(t_dtype)
+    m_min, m_max = limits(m_dtype)
+    lo = t_min - m_max
+    hi = t_max - m_min
+
+    for dt in DIFF_INT_TYPES:
+        info = np.iinfo(dt)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dt)
+
+    # e.g. uint64; no integer type is wide enough
+    return np.dtype(np.float64)
+
+
+def do_diff(test, mast, nodata=None, out=None, nd_mask=None):
     """Do image diff, break if the grids are not the same size.
 
+    The difference is computed in the smallest data type that can hold it
+    (see diff_dtype), not in float64. Pixels that are nodata in either
+    raster are set to 0, i.e. they never count as different.
+
     Args:
         test <numpy.ndarray>: array of test raster
         mast <numpy.ndarray>: array of master raster
-    """
-    if nodata:
-        test = np.ma.masked_where(test == nodata, test)
-        mast = np.ma.masked_where(mast == nodata, mast)
-
-        logging.info("Making nodata value {0} from diff calc.".format(nodata))
+        nodata <int>: mask this value in both rasters (default=None)
+        out <numpy.ndarray>: buffer of the diff data type and array shape to
+            write the diff to, a new array if None (default=None)
+        nd_mask <numpy.ndarray>: boolean buffer of the array shape to write
+            the nodata bitmap to, a new array if None (default=None)
 
+    Returns:
+        <numpy.ndarray>: difference, or False if the arrays cannot be
+            differenced
+    """
     try:
         ## TODO: Figure out why some bands cannot be compared correctly.
-        diff = test.astype(np.float) - mast.astype(np.float)
+        dt = diff_dtype(test.dtype, mast.dtype)
+        if out is None:
+            out = np.empty(np.shape(test), dtype=dt)
 
-        return diff
+        np.subtract(test, mast, out=out, dtype=dt)
 
     except (ValueError, AttributeError, TypeError) as e:
         logging.warning("Error: {0}".format(e))
 
         return False
 
+    if nodata is not None:
+        nd_mask = nodata_mask(test, mast, nodata, out=nd_mask)
+        out[nd_mask] = 0
+
+        logging.info("Making nodata value {0} from diff calc.".format(nodata))
+
+    return out
 
-def call_stats(test, mast, rast_arr, fn_out, dir_out, rast_num=0):
-    """Call stats function(s) if data are valid
+
+def nodata_mask(test, mast, nodata, out=None):
+    """Get boolean bitmap of pixels that are nodata in either raster.
 
     Args:
-        test <str>: name of test file
-        mast <str>: name of master file
-        rast_arr <numpy.ndarray>: array of target raster
-        fn_out <str>: file path of image
-        dir_out <str>: path to output directory
-        rast_num <int>: individual number of image (default=0)
-        nodata <int>: no data value (default=-9999)
+        test <numpy.ndarray>: array of test raster
+        mast <numpy.ndarray>: array of master raster
+        nodata <int>: nodata value
+        out <numpy.ndarray>: boolean buffer of the array shape, a new array
+            if None (default=None)
+    """
+    if out is None:
+        out = np.empty(np.shape(test), dtype=bool)
+
+    np.equal(test, nodata, out=out)
+    out |= mast == nodata
+
+    return out
+
+
+def _diff_window(win, t_arr, m_arr, nodata, bufs, buf_shape):
+    """Diff one window into reusable buffers.
+
+    Args:
+        win <tuple>: (xoff, yoff, xsize, ysize) of window
+        t_arr <numpy.ndarray>: test window
+        m_arr <numpy.ndarray>: master window
+        nodata <int>: mask this value in both rasters
+        bufs <list>: [diff, nodata] buffers of this band, (re)allocated as
+            needed
+        buf_shape <tuple>: shape of buffers, the largest window
+    """
+    out = None
+    nd_mask = None
+
+    # arrays that cannot be differenced are left to do_diff to report
+    if np.shape(t_arr) == np.shape(m_arr) == (win[3], win[2]):
+        dt = diff_dtype(t_arr.dtype, m_arr.dtype)
+        if bufs[0] is None or bufs[0].dtype != dt:
+            bufs[0] = np.empty(buf_shape, dtype=dt)
+        if nodata is not None and bufs[1] is None:
+            bufs[1] = np.empty(buf_shape, dtype=bool)
+
+        view = (slice(0, win[3]), slice(0, win[2]))
+        out = bufs[0][view]
+        if nodata is not None:
+            nd_mask = bufs[1][view]
+
+    with tracing.span("diff"):
+        diff = do_diff(t_arr, m_arr, nodata=nodata, out=out, nd_mask=nd_mask)
+
+    return Window(win[0], win[1], t_arr, m_arr, diff, nd_mask)
+
+
+def iter_diff_multi(t_bands, m_band, nodata=None, win_size=None,
+                    active=None):
+    """Read a master band window-by-window and diff each window against the
+    same window of several test bands, so the master is read once however
+    many test candidates there are.
+
+    Windows are first read as raw bytes; a test window that is byte-for-byte
+    identical to the master window is skipped without building any arrays.
+    Windows where every candidate is identical are not yielded at all.
+
+    The diff and nodata arrays of a window are views of buffers reused for
+    every window of the band, so they are only valid until the next window
+    is read.
+
+    Args:
+        t_bands <list>: test raster bands (osgeo.gdal.Band)
+        m_band <osgeo.gdal.Band>: master raster band
+        nodata <list>: mask this value in both rasters, per test band; None
+            for no masking (default=None)
+        win_size <int>: window size, native blocks if None (default=None)
+        active <list>: one bool per test band; set one to False to stop
+            reading that band (default=None, all read to the end)
+
+    Yields:
+        <list>: Window per test band, None where identical or inactive
+    """
+    from image_io import RasterIO, GDAL_NUMPY_TYPES
+
+    n = len(t_bands)
+    if not isinstance(nodata, (list, tuple)):
+        nodata = [nodata] * n
+    if active is None:
+        active = [True] * n
+
+    # raw buffers are only comparable if both bands have the same data type
+    raw = [t_band.DataType == m_band.DataType and
+           t_band.DataType in GDAL_NUMPY_TYPES for t_band in t_bands]
+
+    windows = RasterIO.get_windows(m_band, win_size)
+    n_same = [0] * n
+
+    # buffers large enough for any window, allocated once the diff data type
+    # is known
+    buf_shape = (max(w[3] for w in windows), max(w[2] for w in windows))
+    bufs = [[None, None] for _ in t_bands]
+
+    for win in windows:
+        if not any(active):
+            break
+
+        m_raw = None
+        m_arr = None
+        if any(raw[c] and active[c] for c in range(n)):
+            m_raw = RasterIO.read_window_raw(m_band, win)
+
+        out = [None] * n
+
+        for c in range(n):
+            if not active[c]:
+                continue
+
+            if raw[c]:
+                t_raw = RasterIO.read_window_raw(t_bands[c], win)
+
+                if t_raw == m_raw:
+                    n_same[c] += 1
+                    continue
+
+                t_arr = RasterIO.raw_to_array(t_raw, t_bands[c], win)
+
+            else:
+                t_arr = RasterIO.read_window(t_bands[c], win)
+
+            if m_arr is None:
+                if m_raw is not None:
+                    m_arr = RasterIO.raw_to_array(m_raw, m_band, win)
+                else:
+                    m_arr = RasterIO.read_window(m_band, win)
+
+            out[c] = _diff_window(win, t_arr, m_arr, nodata[c], bufs[c],
+                                  buf_shape)
+
+        if any(w is not None for w in out):
+            yield out
+
+    for c in range(n):
+        logging.info("{0} of {1} windows identical, not diffed.".
+                     format(n_same[c], len(windows)))
+
+
+def iter_diff(t_band, m_band, nodata=None, win_size=None):
+    """Read test and master bands window-by-window and yield their diff, so
+    only one window of each band is held in memory at a time. Identical
+    windows are skipped (see iter_diff_multi).
+
+    Args:
+        t_band <osgeo.gdal.Band>: test raster band
+        m_band <osgeo.gdal.Band>: master raster band
+        nodata <int>: mask this value in both rasters (default=None)
+        win_size <int>: window size, native blocks if None (default=None)
+    """
+    for wins in iter_diff_multi([t_band], m_band, nodata=[nodata],
+                                win_size=win_size):
+        yield wins[0]
+
+
+def _ordered_bits(arr):
+    """Map floats to integers that sort in the same order, so the difference
+    of two mapped values is their distance in units in the last place.
+
+    Args:
+        arr <numpy.ndarray>: float32 or float64 array
+    """
+    int_type = np.int32 if arr.dtype.itemsize == 4 else np.int64
+    bits = np.ascontiguousarray(arr).view(int_type).astype(np.int64)
+
+    # negative floats sort in reverse as integers
+    return np.where(bits < 0, np.iinfo(int_type).min - bits, bits)
+
+
+class Policy:
+    """How differences between test and master pixels are judged, and how
+    much work is done once a band is known to differ.
+
+    Modes (a pixel violates the policy if):
+        exact: it differs at all
+        abs: |test - mast| > tolerance
+        rel: |test - mast| > tolerance * |mast|
+        ulp: test and mast are more than tolerance units in the last place
+            apart (for integer data, the same as abs)
+
+    A pixel that is NaN in test or master never violates the policy in any
+    mode, as NaN is skipped by the stats.
+
+    With verdict_only, a band stops being read at the first window holding a
+    violation, and a pair stops at its first differing band; no stats or
+    plots are made. Otherwise all windows are read and stats and plots cover
+    every differing pixel of bands with violations.
+    """
+    MODES = ("exact", "abs", "rel", "ulp")
+
+    def __init__(self, mode="exact", tolerance=0, verdict_only=False):
+        """
+        Args:
+            mode <str>: one of Policy.MODES (default="exact")
+            tolerance <float>: allowed difference, ignored by exact
+                (default=0)
+            verdict_only <bool>: stop at first violation (default=False)
+        """
+        if mode not in Policy.MODES:
+            raise ValueError("Unknown tolerance mode {0}".format(mode))
+
+        self.mode = mode
+        self.tolerance = 0 if mode == "exact" else tolerance
+        self.verdict_only = verdict_only
+
+    def settings(self):
+        """Options that change results, for cache keys."""
+        return {"tolerance_mode": self.mode, "tolerance": self.tolerance,
+                "verdict_only": self.verdict_only}
+
+    def violations(self, win):
+        """Get boolean array of pixels of a window that violate the policy.
+        Nodata and NaN pixels never do.
+
+        Args:
+            win <Window>: window from iter_diff
+        """
+        diff = win.diff
+
+        if self.mode == "ulp" and diff.dtype.kind == "f":
+            dt = np.result_type(win.test, win.mast)
+            dist = np.abs(_ordered_bits(win.test.astype(dt, copy=False)) -
+                          _ordered_bits(win.mast.astype(dt, copy=False)))
+            out = dist > self.tolerance
+
+            # NaN bit patterns have a distance like any other value; the
+            # comparisons of the other modes are False for NaN instead
+            out &= ~(np.isnan(win.test) | np.isnan(win.mast))
+            if win.nodata is not None:
+                out &= ~win.nodata
+            return out
+
+        if self.mode == "rel":
+            return np.abs(diff) > self.tolerance * np.abs(win.mast)
+
+        # exact, abs, and ulp of integer data
+        return np.abs(diff) > self.tolerance
+
+
+def _cell_starts(off, n, step):
+    """Offsets within a window where a new preview cell starts.
+
+    Args:
+        off <int>: offset of window in full raster
+        n <int>: length of window
+        step <int>: preview cell size
     """
-    import os
-    import stats
-    from file_io import ImWrite
+    starts = np.arange(-off % step, n, step)
+    if len(starts) == 0 or starts[0] != 0:
+        starts = np.concatenate(([0], starts))
+    return starts
+
+
+def _reduce_cells(diff, xoff, yoff, y_step, x_step):
+    """Prepare a window of differences for reducing into the cells of a
+    coarse grid (see Preview and Heatmap). Windows need not be aligned to
+    cells.
+
+    Args:
+        diff <numpy.ndarray>: difference array of window (zero, NaN and
+            masked pixels did not differ)
+        xoff <int>: column offset of window
+        yoff <int>: row offset of window
+        y_step <int>: rows of a cell
+        x_step <int>: columns of a cell
+
+    Returns:
+        <tuple>: the differences with masked and NaN pixels set to 0,
+            reduce(ufunc, arr, dtype=None) applying a ufunc over each cell
+            of a window-shaped array, and the slices of the grid covered by
+            the window
+    """
+    diff = np.ma.filled(diff, 0)
+    if diff.dtype.kind == "f" and np.isnan(diff).any():
+        diff = np.where(np.isnan(diff), 0, diff)
+
+    rows = _cell_starts(yoff, diff.shape[0], y_step)
+    cols = _cell_starts(xoff, diff.shape[1], x_step)
+
+    def reduce(ufunc, arr, dtype=None):
+        return ufunc.reduceat(ufunc.reduceat(arr, rows, axis=0, dtype=dtype),
+                              cols, axis=1, dtype=dtype)
+
+    r0 = yoff // y_step
+    c0 = xoff // x_step
+    cells = (slice(r0, r0 + len(rows)), slice(c0, c0 + len(cols)))
+
+    return diff, reduce, cells
+
+
+class Preview:
+    """Block-reduced copy of a difference raster, built window-by-window, that
+    is small enough to plot regardless of scene size. Each preview cell
+    summarizes an N x N block of pixels, so isolated differences are not lost
+    the way they are when subsampling."""
+    def __init__(self, shape, size=PREVIEW_SIZE, how=PREVIEW_REDUCE):
+        """
+        Args:
+            shape <tuple>: (rows, cols) of the full raster
+            size <int>: longest side of preview (default=PREVIEW_SIZE)
+            how <str>: cell reduction, "maxabs" keeps the difference of
+                largest magnitude (with its sign), "mean" the mean of the
+                differing pixels (default=PREVIEW_REDUCE)
+        """
+        if how not in ("maxabs", "mean"):
+            raise ValueError("Unknown preview reduction {0}".format(how))
+
+        self.how = how
+        self.step = max(1, int(np.ceil(max(shape) / float(size))))
+        cells = (-(-shape[0] // self.step), -(-shape[1] // self.step))
+
+        # maxabs: signed peak per cell; mean: sum and count per cell
+        self.value = np.zeros(cells, dtype=np.float64)
+        self.count = np.zeros(cells, dtype=np.int32) if how == "mean" \
+            else None
+
+    def update(self, xoff, yoff, diff):
+        """Reduce the pixels of one window into the preview cells they fall
+        in. Windows need not be aligned to cells.
+
+        Args:
+            xoff <int>: column offset of window
+            yoff <int>: row offset of window
+            diff <numpy.ndarray>: difference array of window (zero, NaN and
+                masked pixels did not differ)
+        """
+        diff, reduce, cells = _reduce_cells(diff, xoff, yoff, self.step,
+                                            self.step)
+
+        if self.how == "mean":
+            self.value[cells] += reduce(np.add, diff, np.float64)
+            self.count[cells] += reduce(np.add, diff != 0, np.int32)
+            return
+
+        hi = reduce(np.maximum, diff)
+        lo = reduce(np.minimum, diff)
+        peak = np.where(hi >= -lo, hi, lo)
+
+        cur = self.value[cells]
+        self.value[cells] = np.where(np.abs(peak) > np.abs(cur), peak, cur)
+
+    @property
+    def array(self):
+        """Preview as a masked array; cells without differences are
+        masked."""
+        if self.how == "mean":
+            return np.ma.masked_where(
+                self.count == 0, self.value / np.maximum(self.count, 1))
+
+        return np.ma.masked_where(self.value == 0, self.value)
+
+
+class Heatmap:
+    """Coarse grid over a band pair counting its differing pixels and their
+    largest absolute difference per cell, built window-by-window in the same
+    pass as the stats. Shows where differences cluster (scene edges, clouds,
+    one detector) without opening the full-size plots."""
+    def __init__(self, shape, cells=HEATMAP_CELLS):
+        """
+        Args:
+            shape <tuple>: (rows, cols) of the full raster
+            cells <int>: cells along each side, fewer for small rasters
+                (default=HEATMAP_CELLS)
+        """
+        self.shape = shape
+        self.y_step = max(1, -(-int(shape[0]) // cells))
+        self.x_step = max(1, -(-int(shape[1]) // cells))
+        grid = (-(-int(shape[0]) // self.y_step),
+                -(-int(shape[1]) // self.x_step))
+
+        self.count = np.zeros(grid, dtype=np.int64)
+        self.max_abs = np.zeros(grid, dtype=np.float64)
+
+    def update(self, xoff, yoff, diff):
+        """Add the pixels of one window to the cells they fall in.
+
+        Args:
+            xoff <int>: column offset of window
+            yoff <int>: row offset of window
+            diff <numpy.ndarray>: difference array of window (zero, NaN and
+                masked pixels did not differ)
+        """
+        diff, reduce, cells = _reduce_cells(diff, xoff, yoff, self.y_step,
+                                            self.x_step)
+
+        self.count[cells] += reduce(np.add, diff != 0, np.int64)
+
+        # no abs() of the window, which could overflow its integer type
+        peak = np.maximum(reduce(np.maximum, diff).astype(np.float64),
+                          -reduce(np.minimum, diff).astype(np.float64))
+        self.max_abs[cells] = np.maximum(self.max_abs[cells], peak)
+
+    def write(self, fn_base, geo=None, info=None):
+        """Write the grid as a two-band GeoTIFF (count, max abs difference)
+        and as JSON.
+
+        Args:
+            fn_base <str>: output path without extension
+            geo <tuple>: (projection, geotransform) of the full raster
+                (default=None)
+            info <dict>: extra JSON fields, e.g. file names (default=None)
+
+        Returns:
+            <list>: paths of the GeoTIFF and the JSON file
+        """
+        import json
+
+        try:
+            from osgeo import gdal
+        except ImportError:
+            import gdal
+
+        gt = None
+        if geo is not None:
+            # same origin, pixels scaled to cells
+            g = geo[1]
+            gt = (g[0], g[1] * self.x_step, g[2] * self.y_step,
+                  g[3], g[4] * self.x_step, g[5] * self.y_step)
+
+        with tracing.span("heatmap"):
+            ds = gdal.GetDriverByName("GTiff").Create(
+                fn_base + ".tif", self.count.shape[1], self.count.shape[0],
+                2, gdal.GDT_Float64)
+            if geo is not None:
+                ds.SetProjection(geo[0])
+                ds.SetGeoTransform(gt)
+            ds.GetRasterBand(1).WriteArray(self.count.astype(np.float64))
+            ds.GetRasterBand(2).WriteArray(self.max_abs)
+            ds.FlushCache()
+            ds = None
+
+            out = dict(info or {})
+            out.update({"shape": [int(v) for v in self.shape],
+                        "cell_size": [self.y_step, self.x_step],
+                        "geotransform": list(gt) if gt else None,
+                        "count": self.count.tolist(),
+                        "max_abs": self.max_abs.tolist()})
+
+            with open(fn_base + ".json", "w") as f:
+                json.dump(out, f)
+
+        return [fn_base + ".tif", fn_base + ".json"]
+
+
+class DiffRecord:
+    """Record of where a band pair differs, written from the windows as they
+    are read.
+
+    While the pixels beyond tolerance are at most SPARSE_FRACTION of the
+    band, they are kept as (row, col, test, master, diff) and saved as a
+    compressed .npz, so its size scales with the number of differences.
+    Beyond that, the record switches to a tiled GeoTIFF of the differences
+    (0 where within tolerance), written window by window.
+    """
+    def __init__(self, shape, fn_base, geo=None, fraction=SPARSE_FRACTION):
+        """
+        Args:
+            shape <tuple>: (rows, cols) of the full raster
+            fn_base <str>: output path without extension
+            geo <tuple>: (projection, geotransform) of the dense GeoTIFF
+                (default=None)
+            fraction <float>: largest fraction of differing pixels recorded
+                sparsely (default=SPARSE_FRACTION)
+        """
+        self.shape = shape
+        self.fn_base = fn_base
+        self.geo = geo
+        self.limit = int(fraction * int(shape[0]) * int(shape[1]))
+
+        self.count = 0
+        self.chunks = []
+        self.ds = None
+
+    def update(self, win, mask):
+        """Add the pixels of a window beyond tolerance.
+
+        Args:
+            win <Window>: window from iter_diff
+            mask <numpy.ndarray>: pixels beyond tolerance (Policy.violations)
+        """
+        n = int(np.count_nonzero(mask))
+        if n == 0:
+            return
 
-    if type(rast_arr) is np.ndarray or \
-            type(rast_arr) is np.ma.core.MaskedArray:
-        if np.any(rast_arr != 0):
+        self.count += n
+
+        if self.ds is None and self.count <= self.limit:
+            # fancy indexing copies out of the reused window buffers
+            rows, cols = np.nonzero(mask)
+            self.chunks.append((win.xoff, win.yoff, mask.shape,
+                                rows + win.yoff, cols + win.xoff,
+                                win.test[mask], win.mast[mask],
+                                win.diff[mask]))
+            return
+
+        if self.ds is None:
+            self._to_dense(win.diff.dtype)
+
+        self._write(win.xoff, win.yoff, np.where(mask, win.diff, 0))
+
+    def _to_dense(self, dtype):
+        """Create the GeoTIFF and move the sparse pixels into it."""
+        from image_io import RasterIO
+
+        try:
+            from osgeo import gdal
+        except ImportError:
+            import gdal
+
+        logging.info("More than {0} pixels differ; writing {1}.tif".
+                     format(self.limit, self.fn_base))
+
+        self.ds = gdal.GetDriverByName("GTiff").Create(
+            self.fn_base + ".tif", int(self.shape[1]), int(self.shape[0]), 1,
+            RasterIO.gdal_type(dtype),
+            options=["TILED=YES", "COMPRESS=DEFLATE"])
+
+        if self.geo is not None:
+            self.ds.SetProjection(self.geo[0])
+            self.ds.SetGeoTransform(self.geo[1])
+
+        for xoff, yoff, shape, rows, cols, test, mast, diff in self.chunks:
+            arr = np.zeros(shape, dtype=dtype)
+            arr[rows - yoff, cols - xoff] = diff
+            self._write(xoff, yoff, arr)
+
+        self.chunks = []
+
+    def _write(self, xoff, yoff, arr):
+        """Write a window of differences to the GeoTIFF."""
+        with tracing.span("diff_record"):
+            self.ds.GetRasterBand(1).WriteArray(arr, xoff, yoff)
+
+    def write(self):
+        """Finish the record and get its path (.npz or .tif)."""
+        if self.ds is not None:
+            self.ds.FlushCache()
+            self.ds = None
+            return self.fn_base + ".tif"
+
+        with tracing.span("diff_record"):
+            parts = list(zip(*[c[3:] for c in self.chunks])) or \
+                [[np.zeros(0, dtype=np.int64)]] * 5
+
+            np.savez_compressed(self.fn_base + ".npz",
+                                row=np.concatenate(parts[0]),
+                                col=np.concatenate(parts[1]),
+                                test=np.concatenate(parts[2]),
+                                mast=np.concatenate(parts[3]),
+                                diff=np.concatenate(parts[4]),
+                                shape=np.array(self.shape, dtype=np.int64))
+
+        return self.fn_base + ".npz"
+
+
+class BandCheck:
+    """Judges and summarizes the difference windows of one test/master band
+    pair as they are read (see call_stats)."""
+    def __init__(self, test, mast, shape, fn_out, dir_out, rast_num=0,
+                 policy=None, geo=None):
+        """
+        Args:
+            test <str>: name of test file
+            mast <str>: name of master file
+            shape <tuple>: (rows, cols) of the full raster
+            fn_out <str>: file path of image
+            dir_out <str>: path to output directory
+            rast_num <int>: individual number of image (default=0)
+            policy <Policy>: how differences are judged, exact if None
+                (default=None)
+            geo <tuple>: (projection, geotransform) of the test raster, for
+                the difference record (default=None)
+        """
+        import os
+        import stats
+
+        self.test = test
+        self.mast = mast
+        self.shape = shape
+        self.fn_out = fn_out
+        self.dir_out = dir_out
+        self.rast_num = rast_num
+        self.policy = policy if policy is not None else Policy()
+
+        # True once no more windows are needed
+        self.done = False
+
+        self.geo = geo
+        self.result = {"band": rast_num, "status": "match", "violations": 0,
+                       "row": None, "plots": [], "diff_file": None,
+                       "heatmap": None}
+
+        if not self.policy.verdict_only:
+            self.preview = Preview(shape)
+            self.acc = stats.StatsAccumulator()
+            self.heatmap = Heatmap(shape)
+            self.record = DiffRecord(shape, dir_out + os.sep +
+                                     fn_out.split(os.sep)[-1] + "_diff_" +
+                                     str(rast_num), geo=geo)
+
+    def add(self, win):
+        """Add one window of the band pair.
+
+        Args:
+            win <Window>: window from iter_diff
+        """
+        if win.diff is False:
+            if self.policy.verdict_only:
+                logging.warning("Target raster is not a valid numpy array. "
+                                "Cannot compare!")
+            else:
+                logging.warning("Target raster is not a valid numpy array or "
+                                "numpy masked array. Cannot run statistics!")
+            self.result["status"] = "error"
+            self.done = True
+            return
+
+        if self.policy.verdict_only:
+            if self.policy.violations(win).any():
+                # stop reading the band
+                logging.warning("Image difference found! Test: {0} | "
+                                "Master: {1}".format(self.test, self.mast))
+                self.result.update(status="diff", violations=None)
+                self.done = True
+            return
+
+        # only differing, valid pixels go to stats (nodata pixels are 0)
+        with tracing.span("accumulate"):
+            self.acc.update(win.diff[win.diff != 0])
+
+            self.preview.update(win.xoff, win.yoff, win.diff)
+            self.heatmap.update(win.xoff, win.yoff, win.diff)
+
+            bad = self.policy.violations(win)
+            self.result["violations"] += int(np.count_nonzero(bad))
+
+            self.record.update(win, bad)
+
+    def finish(self):
+        """Get the band result once all windows are added; queue plots and
+        build the stats row of differing bands.
+
+        Returns:
+            <dict>: band result; "status" ("match", "diff" or "error"),
+                number of pixels violating the policy ("violations", None if
+                stopped early), stats.csv "row", "plots" queued, the
+                "diff_file" recording them (see DiffRecord) and the
+                "heatmap" files (see Heatmap)
+        """
+        import os
+        import stats
+        from file_io import ImWrite
+
+        result = self.result
+        policy = self.policy
+
+        if result["status"] != "match":
+            return result
+
+        if policy.verdict_only:
+            logging.info("No {0} tolerance violations.".format(policy.mode))
+            return result
+
+        test = self.test
+        mast = self.mast
+        acc = self.acc
+        dir_out = self.dir_out
+        rast_num = self.rast_num
+        shape = self.shape
+
+        if acc.count > 0 and result["violations"] == 0:
+            logging.info("{0} pixels differ, all within {1} tolerance {2}.".
+                         format(acc.count, policy.mode, policy.tolerance))
+
+        if result["violations"] > 0:
             logging.warning("Image difference found!")
             logging.warning("Test: {0} | Master: {1}".format(test, mast))
             # find file name (for saving plot)
-            fout = fn_out.split(os.sep)[-1]
+            fout = self.fn_out.split(os.sep)[-1]
 
             # do stats of difference
-            stats.img_stats(test, mast, rast_arr, os.path.dirname(fn_out),
-                            fout, dir_out, rast_num)
+            row = stats.img_stats(test, mast, acc,
+                                  os.path.dirname(self.fn_out), fout,
+                                  dir_out, rast_num)
+
+            plots = []
+            prev = self.preview.array
 
             # plot diff image
-            ImWrite.plot_diff_image(test, mast, rast_arr, fout, "diff_" +
-                                    str(rast_num), dir_out)
+            plots.append(ImWrite.render(ImWrite.plot_diff_image, test, mast,
+                                        prev, fout, "diff_" + str(rast_num),
+                                        dir_out))
 
             # plot abs diff image
-            ImWrite.plot_diff_image(test, mast, rast_arr, fout, "abs_diff_" +
-                                    str(rast_num), dir_out, do_abs=True)
+            plots.append(ImWrite.render(ImWrite.plot_diff_image, test, mast,
+                                        prev, fout,
+                                        "abs_diff_" + str(rast_num),
+                                        dir_out, do_abs=True))
+
+            # plot diff histograms from the accumulated counts
+            plots.append(ImWrite.render(ImWrite.plot_hist, test, mast, acc,
+                                        fout, "diff_" + str(rast_num),
+                                        dir_out,
+                                        n_pix=int(shape[0]) * int(shape[1])))
+
+            heatmap = self.heatmap.write(
+                dir_out + os.sep + fout + "_heatmap_" + str(rast_num),
+                geo=self.geo, info={"test": test, "mast": mast,
+                                    "band": rast_num})
 
-            # plot diff histograms
-            ImWrite.plot_hist(test, mast, rast_arr, fout, "diff_" +
-                              str(rast_num), dir_out)
+            result.update(status="diff", row=row, plots=plots,
+                          diff_file=self.record.write(), heatmap=heatmap)
 
         else:
             logging.info("Binary data match.")
 
-    else:
-        logging.warning("Target raster is not a valid numpy array or numpy "
-                        "masked array. Cannot run statistics!")
+        return result
+
+
+def call_stats(test, mast, windows, shape, fn_out, dir_out, rast_num=0,
+               policy=None):
+    """Call stats function(s) if data are valid. Consumes the diff windows in
+    a single pass; stats (including the histogram counts) are accumulated
+    per window, and only a reduced plot preview is kept. Plots are queued on
+    the render threads; "plots" holds their pending results until collected
+    with ImWrite.wait (see GeoImage.check_pairs).
+
+    Args:
+        test <str>: name of test file
+        mast <str>: name of master file
+        windows <generator>: Window tuples of the band pair (see iter_diff)
+        shape <tuple>: (rows, cols) of the full raster
+        fn_out <str>: file path of image
+        dir_out <str>: path to output directory
+        rast_num <int>: individual number of image (default=0)
+        policy <Policy>: how differences are judged, exact if None
+            (default=None)
+
+    Returns:
+        <dict>: band result (see BandCheck.finish)
+    """
+    check = BandCheck(test, mast, shape, fn_out, dir_out, rast_num=rast_num,
+                      policy=policy)
+
+    for win in windows:
+        check.add(win)
+
+        if check.done:
+            # stop reading the band
+            windows.close()
+            break
+
+    return check.finish()
 
 
 class ArrayImage:
@@ -129,100 +918,426 @@ class ArrayImage:
 
 class GeoImage:
     @staticmethod
-    def check_images(test, mast, dir_out, ext, include_nd=False):
-        """Compare the test and master images, both for their raw contents and
-        geographic parameters. If differences exist, produce diff plot + CSV
-        stats file.
+    def compare_bands_multi(tests, mast, t_bands, m_band, dir_outs,
+                            rast_num=0, include_nd=False, win_size=None,
+                            policy=None, nodata=None, geo=None):
+        """Stream a master band and the matching band of several test images
+        through the diff and stats, reading each master window once.
+
+        Args:
+            tests <list>: paths to test images
+            mast <str>: path to master image
+            t_bands <list>: test raster bands (osgeo.gdal.Band)
+            m_band <osgeo.gdal.Band>: master raster band
+            dir_outs <list>: path to output directory of each test image
+            rast_num <int>: individual number of band (default=0)
+            include_nd <bool>: incl. nodata values in file cmp (default=False)
+            win_size <int>: window size, native blocks if None (default=None)
+            policy <Policy>: how differences are judged, exact if None
+                (default=None)
+            nodata <list>: NoData value of each test band (see
+                RasterDataset.nodata), read from the bands if None
+                (default=None)
+            geo <list>: (projection, geotransform) of each test band (see
+                RasterDataset.geo), for difference records (default=None)
+
+        Returns:
+            <list>: band result of each test image (see BandCheck.finish)
+        """
+        from image_io import RasterIO
+
+        if nodata is None:
+            nodata = [RasterIO.get_nodata(t_band) for t_band in t_bands]
+
+        nodata = [None if t_nd is None or include_nd else int(t_nd)
+                  for t_nd in nodata]
+
+        if geo is None:
+            geo = [None] * len(t_bands)
+
+        checks = [BandCheck(test, mast, (t_band.YSize, t_band.XSize), test,
+                            dir_out, rast_num=rast_num, policy=policy,
+                            geo=t_geo)
+                  for test, t_band, dir_out, t_geo in zip(tests, t_bands,
+                                                          dir_outs, geo)]
+
+        # bands whose result is known are no longer read
+        active = [True] * len(checks)
+
+        for wins in iter_diff_multi(t_bands, m_band, nodata=nodata,
+                                    win_size=win_size, active=active):
+            for c, win in enumerate(wins):
+                if win is None:
+                    continue
+
+                checks[c].add(win)
+                if checks[c].done:
+                    active[c] = False
+
+        # call stats functions to write out results/plots/etc.
+        return [check.finish() for check in checks]
+
+    @staticmethod
+    def compare_bands(test, mast, t_band, m_band, dir_out, rast_num=0,
+                      include_nd=False, win_size=None, policy=None):
+        """Stream a test/master band pair through the diff and stats.
 
         Args:
             test <str>: path to test image
             mast <str>: path to master image
+            t_band <osgeo.gdal.Band>: test raster band
+            m_band <osgeo.gdal.Band>: master raster band
             dir_out <str>: path to output directory
-            ext <str>: file extension
+            rast_num <int>: individual number of band (default=0)
             include_nd <bool>: incl. nodata values in file cmp (default=False)
+            win_size <int>: window size, native blocks if None (default=None)
+            policy <Policy>: how differences are judged, exact if None
+                (default=None)
+
+        Returns:
+            <dict>: band result (see BandCheck.finish)
         """
-        from image_io import RasterIO, RasterCmp
-        from file_io import Cleanup, Find
-        import logging
+        return GeoImage.compare_bands_multi(
+            [test], mast, [t_band], m_band, [dir_out], rast_num=rast_num,
+            include_nd=include_nd, win_size=win_size, policy=policy)[0]
 
-        print("Checking {0} files...".format(ext))
+    @staticmethod
+    def check_pairs(tests, j, dir_outs, ext, include_nd=False, win_size=None,
+                    policy=None, band_cache=None, band_threads=None):
+        """Compare several test images against one master image, both for
+        their geographic parameters and band-by-band contents. Each master
+        band is read once for all test images.
 
-        # clean up non-matching files
-        test, mast = Cleanup.remove_nonmatching_files(test, mast)
+        Args:
+            tests <list>: paths to test images
+            j <str>: path to master image
+            dir_outs <list>: path to output directory of each test image
+            ext <str>: file extension
+            include_nd <bool>: incl. nodata values in file cmp (default=False)
+            win_size <int>: window size, native blocks if None (default=None)
+            policy <Policy>: how differences are judged, exact if None
+                (default=None)
+            band_cache <band_cache.BandCache>: read master bands from this
+                cache (default=None)
+            band_threads <int>: compare this many bands (or subdatasets) of
+                a multiband image at a time, BAND_THREADS if None
+                (default=None)
 
-        # make sure there are actually files to check
-        if mast is None or test is None:
-            logging.error("No {0} files to check in test and/or mast "
-                          "directories.".format(ext))
-            return False
+        Returns:
+            <list>: pair result of each test image; "verdict" ("match",
+                "diff", "geo_mismatch", "band_mismatch" or "error"), "geo"
+                checks, "n_bands" and a result per band in "bands"
+        """
+        import threading
+        from image_io import RasterIO, RasterCmp, RasterDataset
+        from file_io import Find, ImWrite
 
-        # do other comparison checks, return stats + plots if diffs exist
-        for i, j in zip(test, mast):
+        results = [{"test": i, "mast": j, "ext": ext, "verdict": None,
+                    "geo": {}, "n_bands": None, "bands": []} for i in tests]
 
+        # Open each raster
+        ds_mast = RasterIO.open_raster(j)
+        ds_tests = []
+
+        # test images that passed the checks below
+        live = []
+
+        for c, i in enumerate(tests):
             logging.info("Checking Test {0} against Master {1}".format(i, j))
-            # Open each raster
             ds_test = RasterIO.open_raster(i)
-            ds_mast = RasterIO.open_raster(j)
+            ds_tests.append(ds_test)
 
             # Compare various raster parameters
-            status = []
-            status.append(RasterCmp.compare_proj_ref(ds_test, ds_mast))
-            status.append(RasterCmp.compare_geo_trans(ds_test, ds_mast))
-            status.append(RasterCmp.extent_diff_cols(ds_test, ds_mast))
-            status.append(RasterCmp.extent_diff_rows(ds_test, ds_mast))
-
-            # If any above tests fail, go to next iteration
-            if any(stat == False for stat in status):
+            geo = results[c]["geo"]
+            geo["proj"] = RasterCmp.compare_proj_ref(ds_test, ds_mast)
+            geo["geo_trans"] = RasterCmp.compare_geo_trans(ds_test, ds_mast)
+            geo["cols"] = RasterCmp.extent_diff_cols(ds_test, ds_mast)
+            geo["rows"] = RasterCmp.extent_diff_rows(ds_test, ds_mast)
+
+            # If any above tests fail, go to next image
+            if any(stat == False for stat in geo.values()):
+                results[c]["verdict"] = "geo_mismatch"
                 continue
 
             # Count number of sub-bands in the files
             d_range = Find.count(i, ds_test, j, ds_mast, ext)
+            results[c]["n_bands"] = d_range
 
             if d_range is None:
                 logging.critical("Number of files different; data cannot be "
                                  "tested successfully.")
+                results[c]["verdict"] = "band_mismatch"
+                continue
+
+            live.append(c)
+
+        # every live test image has the master's band count; a count of 0
+        # (e.g. a .nc/.hdf without subdatasets) is read as a single band
+        d_range = results[live[0]]["n_bands"] if live else 0
+        sds = d_range > 1 and ext != ".img"
+        n_read = max(d_range, 1)
+
+        if band_threads is None:
+            band_threads = BAND_THREADS
+        threads = max(1, min(band_threads, d_range))
+
+        # subdatasets and bands are opened once; bands of a multiband raster
+        # get a dataset handle each if they are read on several threads
+        r_mast = RasterDataset(j, ds_mast, separate=threads > 1)
+        r_tests = [RasterDataset(i, ds_test, separate=threads > 1)
+                   for i, ds_test in zip(tests, ds_tests)]
+
+        lock = threading.Lock()
+
+        def compare(ii):
+            """Compare band ii of the master and the live test images."""
+            with lock:
+                cands = list(live)
+
+            if not cands:
+                return []
+
+            for c in cands:
+                if d_range <= 1:  # singleband raster
+                    logging.info("Reading {0}...".format(tests[c]))
+                elif sds:
+                    logging.info("Reading .hdf/.nc SDS {0} from file "
+                                 "{1}...".format(ii, tests[c]))
+                else:
+                    logging.info("Reading sub-band {0} from .img {1}...".
+                                 format(ii, tests[c]))
+
+            m_band = r_mast.band(ii, sds)
+            if band_cache is not None:
+                m_band = band_cache.band(j, r_mast.name(ii, sds), m_band)
+
+            bands = GeoImage.compare_bands_multi(
+                [tests[c] for c in cands], j,
+                [r_tests[c].band(ii, sds) for c in cands], m_band,
+                [dir_outs[c] for c in cands], rast_num=ii,
+                include_nd=include_nd, win_size=win_size, policy=policy,
+                nodata=[r_tests[c].nodata(ii, sds) for c in cands],
+                geo=[r_tests[c].geo(ii, sds) for c in cands])
+
+            # the verdict of these pairs is known
+            if policy is not None and policy.verdict_only:
+                with lock:
+                    for c, band in zip(cands, bands):
+                        if band["status"] == "diff" and c in live:
+                            live.remove(c)
+
+            return list(zip(cands, bands))
+
+        # if sub-bands exist, read them (on several threads) and do diffs +
+        # stats; GDAL releases the GIL while reading
+        if threads > 1:
+            from multiprocessing.pool import ThreadPool
+
+            # bytes read on the pool threads count for the open pair span
+            spans = tracing.open_spans()
+
+            def compare_attached(ii):
+                with tracing.attach(spans):
+                    return compare(ii)
+
+            pool = ThreadPool(threads)
+            try:
+                done = pool.map(compare_attached, range(0, n_read),
+                                chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            done = [compare(ii) for ii in range(0, n_read)]
+
+        for band_results in done:
+            for c, band in band_results:
+                results[c]["bands"].append(band)
+
+        for result in results:
+            if result["verdict"] is not None:
                 continue
 
-            # if sub-bands exist, read them one-by-one and do diffs + stats
-            if d_range > 1:
-                for ii in range(0, d_range):
-                    # Get the first band from each raster
-                    if ext == ".img":
-                        logging.info("Reading sub-band {0} from .img {1}...".
-                                     format(ii, i))
-                        ds_tband = RasterIO.read_band_as_array(ds_test, ii)
-                        ds_mband = RasterIO.read_band_as_array(ds_mast, ii)
-                    else:
-                        logging.info("Reading .hdf/.nc SDS {0} from file "
-                                     "{0}...".format(ii, i))
-                        sds_tband = RasterIO.open_raster(
-                            RasterIO.get_sds(ds_test)[ii][0])
-                        sds_mband = RasterIO.open_raster(
-                            RasterIO.get_sds(ds_mast)[ii][0])
-                        ds_tband, t_nd = RasterIO.read_band_as_array(sds_tband)
-                        ds_mband, m_nd = RasterIO.read_band_as_array(sds_mband)
-
-                    # do diff
-                    if type(t_nd) is type(None) or include_nd:
-                        diff = do_diff(ds_tband, ds_mband)
-                    else:
-                        diff = do_diff(ds_tband, ds_mband, nodata=int(t_nd))
-
-                    # call stats functions to write out results/plots/etc.
-                    call_stats(i, j, diff, i, dir_out, rast_num=ii)
-
-            else:  # else it's a singleband raster
-                logging.info("Reading {0}...".format(i))
-
-                # read in band as array
-                ds_tband, t_nd = RasterIO.read_band_as_array(ds_test)
-                ds_mband, m_nd = RasterIO.read_band_as_array(ds_mast)
-
-                # do diff
-                if type(t_nd) is type(None) or include_nd:
-                    diff = do_diff(ds_tband, ds_mband)
+            # plots of each band rendered while the next band was read
+            for b in result["bands"]:
+                b["plots"] = ImWrite.wait(b["plots"])
+
+            status = [b["status"] for b in result["bands"]]
+            if "error" in status:
+                result["verdict"] = "error"
+            elif "diff" in status:
+                result["verdict"] = "diff"
+            else:
+                result["verdict"] = "match"
+
+        return results
+
+    @staticmethod
+    def check_pair(i, j, dir_out, ext, include_nd=False, win_size=None,
+                   policy=None, band_cache=None, band_threads=None):
+        """Compare one test/master image pair, both for their geographic
+        parameters and band-by-band contents.
+
+        Args:
+            i <str>: path to test image
+            j <str>: path to master image
+            dir_out <str>: path to output directory
+            ext <str>: file extension
+            include_nd <bool>: incl. nodata values in file cmp (default=False)
+            win_size <int>: window size, native blocks if None (default=None)
+            policy <Policy>: how differences are judged, exact if None
+                (default=None)
+            band_cache <band_cache.BandCache>: read master bands from this
+                cache (default=None)
+            band_threads <int>: bands compared at a time, BAND_THREADS if
+                None (default=None)
+
+        Returns:
+            <dict>: pair result (see check_pairs)
+        """
+        return GeoImage.check_pairs([i], j, [dir_out], ext,
+                                    include_nd=include_nd, win_size=win_size,
+                                    policy=policy, band_cache=band_cache,
+                                    band_threads=band_threads)[0]
+
+    @staticmethod
+    def check_images_multi(tests, mast, dir_outs, ext, include_nd=False,
+                           win_size=None, cache=None, policy=None,
+                           band_cache=None, band_threads=None):
+        """Compare the images of several test candidates against the same
+        master images, both for their raw contents and geographic parameters.
+        Each master image is read once for all candidates that need it
+        (cached pairs are skipped). If differences exist, produce diff plot +
+        CSV stats file in the candidate's output directory.
+
+        Args:
+            tests <list>: paths to test images of each candidate
+            mast <list>: paths to master images
+            dir_outs <list>: path to output directory of each candidate
+            ext <str>: file extension
+            include_nd <bool>: incl. nodata values in file cmp (default=False)
+            win_size <int>: window size, native blocks if None (default=None)
+            cache <cache.ResultCache>: reuse results of unchanged file pairs
+                (default=None)
+            policy <Policy>: how differences are judged, exact if None
+                (default=None)
+            band_cache <band_cache.BandCache>: read master bands from this
+                cache (default=None)
+            band_threads <int>: bands compared at a time, BAND_THREADS if
+                None (default=None)
+
+        Returns:
+            <list>: pair results (see check_pairs) in master file order, each
+                with its "candidate" number, the "seconds" taken and whether
+                it was "cached"
+        """
+        import os
+        import time
+        from file_io import Cleanup
+
+        print("Checking {0} files...".format(ext))
+
+        if policy is None:
+            policy = Policy()
+
+        # test image of each candidate, by file name
+        found = []
+        for test in tests:
+            # clean up non-matching files
+            test, mast_c = Cleanup.remove_nonmatching_files(test, mast)
+
+            # make sure there are actually files to check
+            if mast_c is None or test is None:
+                logging.error("No {0} files to check in test and/or mast "
+                              "directories.".format(ext))
+                found.append({})
+            else:
+                found.append(dict((os.path.basename(i), i) for i in test))
+
+        results = []
+
+        # do other comparison checks, return stats + plots if diffs exist
+        for j in mast or []:
+            name = os.path.basename(j)
+            pending = []
+
+            for c in range(len(tests)):
+                if name not in found[c]:
+                    continue
+
+                i = found[c][name]
+                t0 = time.time()
+                result = None
+                key = None
+
+                if cache is not None:
+                    with tracing.span("cache"):
+                        key = cache.key(i, j, include_nd=include_nd,
+                                        **policy.settings())
+                        result = cache.get(key)
+
+                if result is None:
+                    pending.append((c, i, key))
                 else:
-                    diff = do_diff(ds_tband, ds_mband, nodata=int(t_nd))
+                    result.update(candidate=c, cached=True,
+                                  seconds=round(time.time() - t0, 3))
+                    results.append(result)
+
+            if not pending:
+                continue
+
+            t0 = time.time()
+            i_list = [i for c, i, key in pending]
+
+            with tracing.span("pair", cat="pair",
+                              test=i_list[0] if len(i_list) == 1 else i_list,
+                              mast=j):
+                checked = GeoImage.check_pairs(
+                    i_list, j, [dir_outs[c] for c, i, key in pending], ext,
+                    include_nd=include_nd, win_size=win_size, policy=policy,
+                    band_cache=band_cache, band_threads=band_threads)
+
+            # time of the shared pass
+            seconds = round(time.time() - t0, 3)
 
-                # call stats functions to write out results/plots/etc.
-                call_stats(i, j, diff, i, dir_out)
+            for (c, i, key), result in zip(pending, checked):
+                if cache is not None:
+                    cache.put(key, result)
+                result.update(candidate=c, cached=False, seconds=seconds)
+                results.append(result)
+
+        return results
+
+    @staticmethod
+    def check_images(test, mast, dir_out, ext, include_nd=False,
+                     win_size=None, cache=None, policy=None, band_cache=None,
+                     band_threads=None):
+        """Compare the test and master images, both for their raw contents and
+        geographic parameters. If differences exist, produce diff plot + CSV
+        stats file.
+
+        Args:
+            test <str>: path to test image
+            mast <str>: path to master image
+            dir_out <str>: path to output directory
+            ext <str>: file extension
+            include_nd <bool>: incl. nodata values in file cmp (default=False)
+            win_size <int>: window size, native blocks if None (default=None)
+            cache <cache.ResultCache>: reuse results of unchanged file pairs
+                (default=None)
+            policy <Policy>: how differences are judged, exact if None
+                (default=None)
+            band_cache <band_cache.BandCache>: read master bands from this
+                cache (default=None)
+            band_threads <int>: bands compared at a time, BAND_THREADS if
+                None (default=None)
+
+        Returns:
+            <list>: pair results (see check_images_multi)
+        """
+        return GeoImage.check_images_multi([test], mast, [dir_out], ext,
+                                           include_nd=include_nd,
+                                           win_size=win_size, cache=cache,
+                                           policy=policy,
+                                           band_cache=band_cache,
+                                           band_threads=band_threads)
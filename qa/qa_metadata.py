@@ -7,42 +7,124 @@ class MetadataQA:
     @staticmethod
     def check_xml_schema(test, schema):
         """Ensure XML matches ESPA schema.
-        :param test: <str> XML metadata file to compare with schema.
-        :param schema: <str> Path to XML schema file.
-        :return: None
+
+        Args:
+            test <str|list>: XML metadata file(s) to validate, validated
+                several at a time
+            schema <str>: path to XML schema file
+
+        Returns:
+            <dict>: schema errors of each file, by path (see
+                SchemaValidator.validate)
         """
-        from lxml import etree
+        from schema_validator import SchemaValidator
 
-        # read schema
-        xmlschema = etree.XMLSchema(etree.parse(schema))
+        if not isinstance(test, (list, tuple)):
+            test = [test]
 
-        # read XML
-        xmlfile = etree.parse(test)
+        # each file once, in order
+        seen = set()
+        test = [fn for fn in test if not (fn in seen or seen.add(fn))]
 
-        # do validation
-        result = xmlschema.validate(xmlfile)
+        errors = SchemaValidator.get(schema).validate_many(test)
 
-        if result:
-            logging.warning('XML file {0} is valid with XML schema {1}.'
-                            .format(test, schema))
+        for fn in test:
+            if not errors[fn]:
+                logging.warning('XML file {0} is valid with XML schema {1}.'
+                                .format(fn, schema))
 
-        else:
-            logging.critical('XML file {0} is NOT valid with XML schema {1}.'
-                             .format(test, schema))
+            else:
+                logging.critical('XML file {0} is NOT valid with XML schema '
+                                 '{1}: {2} error(s), first at line {3}: {4}'
+                                 .format(fn, schema, len(errors[fn]),
+                                         errors[fn][0]["line"],
+                                         errors[fn][0]["message"]))
+
+        return errors
+
+    @staticmethod
+    def check_xml_files(test, mast, tolerance=0, schema=None):
+        """Compare master and test XML files element by element (see
+        xml_cmp.compare_xml), several pairs at a time.
+
+        Args:
+            test <list>: paths to test XML files
+            mast <list>: paths to matching master XML files
+            tolerance <float>: relative tolerance of numeric values
+                (default=0)
+            schema <str>: also validate all files with this XML schema
+                (default=None)
+
+        Returns:
+            <list>: result of each pair; "verdict" ("match", "diff",
+                "invalid" or "error") and the comparison report in "xml",
+                with the schema errors of each file in "valid" (None if
+                valid) if validated
+        """
+        import xml_cmp
+
+        # validate every file once, in one batch
+        errors = MetadataQA.check_xml_schema(list(test) + list(mast),
+                                             schema) if schema else None
+
+        results = []
+
+        for report in xml_cmp.compare_pairs(test, mast, tolerance):
+            i = report.pop("test")
+            j = report.pop("mast")
 
+            if errors is not None:
+                report["valid"] = {"test": errors[i] or None,
+                                   "mast": errors[j] or None}
+
+            if "error" in report:
+                verdict = "error"
+
+            elif any(report.get("valid", {}).values()):
+                verdict = "invalid"
+
+            elif report["differences"]:
+                verdict = "diff"
+
+            else:
+                verdict = "match"
+
+            for d in report.get("differences", []):
+                logging.error(".xml changes: {0} {1}: Test {2} | Master {3}".
+                              format(d["key"], d["attr"] or d["kind"],
+                                     d["test"], d["mast"]))
+
+            if verdict == "match":
+                logging.info("No differences between {0} and {1}.".
+                             format(i, j))
+
+            results.append({"test": i, "mast": j, "ext": ".xml",
+                            "verdict": verdict, "geo": {}, "n_bands": None,
+                            "bands": [], "xml": report})
+
+        return results
 
     @staticmethod
-    def check_text_files(test, mast, ext):
+    def check_text_files(test, mast, ext, tolerance=0, schema=None):
         """Check master and test text-based files (headers, XML, etc.)
         line-by-line for differences.
-        Sort all the lines to attempt to capture new entries.
+        Sort all the lines to attempt to capture new entries. XML files are
+        compared element by element instead (see check_xml_files).
 
         Args:
             test <str>: path to test text file
             mast <str>: path to master text file
             ext <str>: file extension (should be .txt, .xml or .gtf
+            tolerance <float>: relative tolerance of numeric XML values
+                (default=0)
+            schema <str>: also validate XML files with this XML schema
+                (default=None)
+
+        Returns:
+            <list>: XML pair results (see check_xml_files), None for other
+                files
         """
-        from file_io import Cleanup
+        from file_io import Cleanup, Read
 
         logging.info("Checking {0} files...".format(ext))
 
@@ -59,17 +141,13 @@ class MetadataQA:
                 " {2}".format(ext, len(mast), len(test)))
             return
 
-        for i, j in zip(test, mast):
-            topen = open(i)
-            mopen = open(j)
+        if ext.lower() == ".xml":
+            return MetadataQA.check_xml_files(test, mast, tolerance, schema)
 
+        for i, j in zip(test, mast):
             # Read text line-by-line from file
-            file_topen = topen.readlines()
-            file_mopen = mopen.readlines()
-
-            # Close files
-            topen.close()
-            mopen.close()
+            file_topen = Read.read_lines(i)
+            file_mopen = Read.read_lines(j)
 
             # Check file names for name differences.
             # Print non-matching names in details.
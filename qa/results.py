@@ -0,0 +1,261 @@
+"""results.py
+
+Purpose: write structured QA results (one record per image pair) from a
+         single writer thread, in batches.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# per-pair results, one JSON object per line
+RESULTS_NAME = "results.jsonl"
+
+# optional Parquet copy, one row per band
+PARQUET_NAME = "results.parquet"
+
+# records written at once, and longest wait before a partial batch is written
+BATCH_SIZE = 100
+FLUSH_SECONDS = 5.0
+
+# stats.csv columns that are numbers (see stats.STATS_HEADER)
+STATS_FIELDS = ("mean", "min", "max", "25_percentile", "75_percentile",
+                "1_percentile", "99_percentile", "std_dev", "median")
+
+
+def pair_record(result, run_id):
+    """Convert a pair result to its JSON Lines record.
+
+    Args:
+        result <dict>: pair result from GeoImage.check_pair
+        run_id <str>: ID of the QA run
+    """
+    from stats import STATS_HEADER
+
+    record = {"run_id": run_id}
+    record.update(result)
+
+    bands = []
+    for b in result["bands"]:
+        band = {"band": b["band"], "status": b["status"],
+                "violations": b.get("violations"), "plots": b["plots"],
+                "diff_file": b.get("diff_file"),
+                "heatmap": b.get("heatmap"), "stats": None}
+        if b["row"]:
+            band["stats"] = dict(zip(STATS_HEADER, b["row"]))
+        bands.append(band)
+
+    record["bands"] = bands
+
+    return record
+
+
+def parquet_rows(record):
+    """Flatten a pair record to one row per band (one row if no bands were
+    compared).
+
+    Args:
+        record <dict>: record from pair_record
+    """
+    base = {"run_id": record["run_id"],
+            "test": record["test"],
+            "mast": record["mast"],
+            "ext": record["ext"],
+            "verdict": record["verdict"],
+            "n_bands": record["n_bands"],
+            "seconds": record.get("seconds"),
+            "cached": record.get("cached")}
+
+    for k in ("proj", "geo_trans", "cols", "rows"):
+        base["geo_" + k] = record["geo"].get(k)
+
+    rows = []
+    for b in record["bands"] or [None]:
+        row = dict(base)
+        row["band"] = b["band"] if b else None
+        row["status"] = b["status"] if b else None
+        row["violations"] = b["violations"] if b else None
+        row["diff_file"] = b["diff_file"] if b else None
+        for k in STATS_FIELDS:
+            row[k] = b["stats"][k] if b and b["stats"] else None
+        rows.append(row)
+
+    return rows
+
+
+class ResultsSink:
+    """Collects pair results from any thread and writes them from one writer
+    thread: each result as a line of results.jsonl (and optionally rows of
+    results.parquet), and its stats rows to stats.csv. Records are written
+    in the order they were added, in batches.
+    """
+    def __init__(self, dir_out, parquet=False, run_id=None,
+                 batch_size=BATCH_SIZE):
+        """
+        Args:
+            dir_out <str>: output directory
+            parquet <bool>: also write results.parquet, needs pyarrow
+                (default=False)
+            run_id <str>: ID added to each record, random if None
+                (default=None)
+            batch_size <int>: records written at once (default=BATCH_SIZE)
+        """
+        self.dir_out = dir_out
+        self.run_id = run_id or uuid.uuid4().hex
+        self.batch_size = batch_size
+        self.n_written = 0
+
+        self.pq_writer = None
+        self.pq_schema = None
+        if parquet:
+            self._open_parquet()
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run,
+                                       name="ResultsSink")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _open_parquet(self):
+        """Open the Parquet writer, if pyarrow is available."""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            logging.warning("pyarrow not found; results.parquet will not be "
+                            "written.")
+            return
+
+        fields = [("run_id", pa.string()),
+                  ("test", pa.string()),
+                  ("mast", pa.string()),
+                  ("ext", pa.string()),
+                  ("verdict", pa.string()),
+                  ("geo_proj", pa.bool_()),
+                  ("geo_geo_trans", pa.bool_()),
+                  ("geo_cols", pa.bool_()),
+                  ("geo_rows", pa.bool_()),
+                  ("n_bands", pa.int64()),
+                  ("seconds", pa.float64()),
+                  ("cached", pa.bool_()),
+                  ("band", pa.int64()),
+                  ("status", pa.string()),
+                  ("violations", pa.int64()),
+                  ("diff_file", pa.string())]
+        fields += [(k, pa.float64()) for k in STATS_FIELDS]
+
+        self.pq_schema = pa.schema(fields)
+        self.pq_writer = pq.ParquetWriter(
+            self.dir_out + os.sep + PARQUET_NAME, self.pq_schema)
+
+    def put(self, result):
+        """Queue a pair result for writing.
+
+        Args:
+            result <dict>: pair result from GeoImage.check_pair
+        """
+        self.queue.put(result)
+
+    def close(self):
+        """Write all queued results and stop the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.pq_writer is not None:
+            self.pq_writer.close()
+
+        logging.warning("{0} pair results written to {1}.".format(
+            self.n_written, self.dir_out + os.sep + RESULTS_NAME))
+
+    def _run(self):
+        """Writer thread: write queued results in batches until closed."""
+        batch = []
+        deadline = time.time() + FLUSH_SECONDS
+
+        while True:
+            try:
+                item = self.queue.get(
+                    timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                item = False
+
+            if item:
+                batch.append(item)
+
+            if item is None or item is False or \
+                    len(batch) >= self.batch_size:
+                if batch:
+                    self._write_batch(batch)
+                batch = []
+                deadline = time.time() + FLUSH_SECONDS
+
+            if item is None:
+                break
+
+    def _write_batch(self, batch):
+        """Write a batch of results; if that fails, write them one at a time
+        so a single bad result does not lose the others.
+
+        Args:
+            batch <list>: pair results
+        """
+        try:
+            self._write(batch)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                logging.error("Could not write result of Test {0}: {1}".
+                              format(batch[0].get("test"), e))
+                return
+
+            logging.warning("Could not write {0} results ({1}); writing them "
+                            "one at a time.".format(len(batch), e))
+
+        for result in batch:
+            try:
+                self._write([result])
+            except Exception as e:
+                logging.error("Could not write result of Test {0}: {1}".
+                              format(result.get("test"), e))
+
+    def _write(self, batch):
+        """Append a batch of results to the output files. Everything is
+        built before anything is written, so a result that cannot be
+        converted leaves the files untouched.
+
+        Args:
+            batch <list>: pair results
+        """
+        import stats
+
+        records = [pair_record(r, self.run_id) for r in batch]
+        lines = [json.dumps(record, sort_keys=True) + "\n"
+                 for record in records]
+        rows = [b["row"] for r in batch for b in r["bands"] if b["row"]]
+
+        table = None
+        if self.pq_writer is not None:
+            import pyarrow as pa
+
+            pq_rows = [row for record in records
+                       for row in parquet_rows(record)]
+            columns = dict((f.name, [row[f.name] for row in pq_rows])
+                           for f in self.pq_schema)
+            table = pa.Table.from_pydict(columns, schema=self.pq_schema)
+
+        with open(self.dir_out + os.sep + RESULTS_NAME, "a") as f:
+            f.writelines(lines)
+
+        stats.write_stats(self.dir_out, rows)
+
+        if table is not None:
+            self.pq_writer.write_table(table)
+
+        self.n_written += len(batch)
@@ -0,0 +1,141 @@
+"""schema_validator.py
+
+Purpose: validate XML files against XML schemas. Each schema is compiled once
+         per process and kept while its file is unchanged; batches of files
+         are validated on several threads, and each file's errors are
+         returned as a list instead of logged.
+"""
+import os
+import logging
+import threading
+
+# XML files validated at a time
+VALIDATE_THREADS = 4
+
+# shared validators, by schema path
+_validators = {}
+_validators_lock = threading.Lock()
+
+
+class SchemaValidator:
+    """Validator of XML files against one XML schema. The compiled schema is
+    kept with the modification time of its file and compiled again if the
+    file changes. Files are parsed in parallel; the compiled schema is used
+    by one thread at a time, since its error log is shared.
+    """
+    def __init__(self, schema):
+        """
+        Args:
+            schema <str>: path to XML schema file
+        """
+        self.schema = schema
+        self.mtime = None
+        self.xmlschema = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get(schema):
+        """Get the validator of a schema shared by this process.
+
+        Args:
+            schema <str>: path to XML schema file
+        """
+        path = os.path.abspath(schema)
+
+        with _validators_lock:
+            if path not in _validators:
+                _validators[path] = SchemaValidator(path)
+
+            return _validators[path]
+
+    def compiled(self):
+        """Get the compiled schema, compiling it on first use or if its file
+        has changed since.
+
+        Returns:
+            <lxml.etree.XMLSchema>: compiled schema
+        """
+        from lxml import etree
+
+        mtime = os.path.getmtime(self.schema)
+
+        with self.lock:
+            if self.xmlschema is None or mtime != self.mtime:
+                logging.info("Compiling XML schema {0}...".format(
+                    self.schema))
+                self.xmlschema = etree.XMLSchema(etree.parse(self.schema))
+                self.mtime = mtime
+
+            return self.xmlschema
+
+    @staticmethod
+    def _errors(error_log):
+        """Convert an lxml error log to a list of dicts."""
+        return [{"line": e.line, "column": e.column, "type": e.type_name,
+                 "message": e.message} for e in error_log]
+
+    def validate(self, path):
+        """Validate one XML file.
+
+        Args:
+            path <str>: path to XML file, possibly inside an archive
+
+        Returns:
+            <list>: errors ("line", "column", "type" and "message"), empty if
+                the file is valid
+        """
+        from lxml import etree
+        from file_io import Read
+
+        xmlschema = self.compiled()
+
+        try:
+            f = Read.open_file(path)
+            try:
+                doc = etree.parse(f)
+            finally:
+                f.close()
+
+        except etree.XMLSyntaxError as e:
+            return self._errors(e.error_log) or \
+                [{"line": None, "column": None, "type": "PARSER",
+                  "message": str(e)}]
+
+        except (IOError, OSError) as e:
+            return [{"line": None, "column": None, "type": "IO",
+                     "message": str(e)}]
+
+        with self.lock:
+            if xmlschema.validate(doc):
+                return []
+
+            return self._errors(xmlschema.error_log)
+
+    def validate_many(self, paths, threads=VALIDATE_THREADS):
+        """Validate XML files on several threads.
+
+        Args:
+            paths <list>: paths to XML files, possibly inside archives
+            threads <int>: files validated at a time
+                (default=VALIDATE_THREADS)
+
+        Returns:
+            <dict>: errors of each file (see validate), by path
+        """
+        from multiprocessing.pool import ThreadPool
+
+        paths = list(paths)
+
+        # compile before starting the threads
+        self.compiled()
+
+        if threads <= 1 or len(paths) <= 1:
+            return dict((p, self.validate(p)) for p in paths)
+
+        pool = ThreadPool(min(threads, len(paths)))
+        try:
+            return dict(zip(paths, pool.map(self.validate, paths,
+                                            chunksize=1)))
+        finally:
+            pool.close()
+            pool.join()
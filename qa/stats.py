@@ -3,9 +3,17 @@
 Purpose: get comparision results, run statistics, write out to files.
 """
 import os
+import sys
 import csv
 import numpy as np
 import logging
+import tracing
+
+# relative error bound of the percentile sketch used for non-integer data
+SKETCH_ALPHA = 0.001
+
+# widest value range kept in an exact histogram before switching to sketch
+HIST_MAX_BINS = 1 << 24
 
 
 def pct_diff_raster(ds_tband, ds_mband, diff_rast, nodata=-9999):
@@ -38,52 +46,444 @@ def pct_diff_raster(ds_tband, ds_mband, diff_rast, nodata=-9999):
     return pct_diff_raster
 
 
+def _lerp(a, b, t):
+    """Interpolate between two order statistics the way numpy.percentile
+    does, so histogram percentiles match the whole-array result.
+
+    Args:
+        a <float>: lower order statistic
+        b <float>: upper order statistic
+        t <float>: fraction of the way from a to b
+    """
+    diff_b_a = b - a
+    if t >= 0.5:
+        return b - diff_b_a * (1.0 - t)
+    return a + diff_b_a * t
+
+
+def _add_counts(lo, counts, lo_add, counts_add):
+    """Add two histograms that start at different bins.
+
+    Args:
+        lo <int>: key of the first bin of counts (None if empty)
+        counts <numpy.ndarray>: bin counts
+        lo_add <int>: key of the first bin of counts_add
+        counts_add <numpy.ndarray>: bin counts to add
+    """
+    if lo_add is None:
+        return lo, counts
+
+    if lo is None:
+        return lo_add, counts_add.astype(np.int64)
+
+    new_lo = min(lo, lo_add)
+    new_hi = max(lo + len(counts), lo_add + len(counts_add))
+
+    if new_lo != lo or new_hi != lo + len(counts):
+        grown = np.zeros(new_hi - new_lo, dtype=np.int64)
+        grown[lo - new_lo:lo - new_lo + len(counts)] = counts
+        counts = grown
+
+    counts[lo_add - new_lo:lo_add - new_lo + len(counts_add)] += counts_add
+
+    return new_lo, counts
+
+
+class StatsAccumulator:
+    """Single-pass, mergeable summary of difference values.
+
+    Count, mean, min, max and the sum of squared deviations are updated once
+    per block. Percentiles come from an exact histogram while every value
+    seen is an integer; after the first non-integer value the histogram is
+    folded into a log-bucketed sketch whose percentiles are within
+    SKETCH_ALPHA relative error. Accumulators built from different windows,
+    bands or processes are combined with merge().
+
+    NaN values are skipped. Infinite values are counted apart from the
+    finite ones: they rank below (-inf) or above (inf) all finite values in
+    the percentiles and set min and max, and mean and std follow numpy
+    (inf, -inf or NaN). A percentile at or next to an infinite value is
+    that value (NaN between -inf and inf), where numpy.percentile gives
+    NaN.
+    """
+    def __init__(self, alpha=SKETCH_ALPHA):
+        """
+        Args:
+            alpha <float>: relative error of sketch (default=SKETCH_ALPHA)
+        """
+        # moments, min and max of finite values
+        self.n_finite = 0
+        self.f_mean = 0.0
+        self.m2 = 0.0
+        self.abs_total = 0.0
+        self.f_min = None
+        self.f_max = None
+
+        # infinite values
+        self.n_neg_inf = 0
+        self.n_pos_inf = 0
+
+        self.gamma = (1.0 + alpha) / (1.0 - alpha)
+
+        # exact histogram of integer values
+        self.exact = True
+        self.h_lo = None
+        self.h_counts = None
+
+        # sketch buckets of positive [0] and negative [1] values
+        self.s_lo = [None, None]
+        self.s_counts = [None, None]
+        self.s_zero = 0
+
+    @property
+    def count(self):
+        """Number of values, infinite ones included."""
+        return self.n_finite + self.n_neg_inf + self.n_pos_inf
+
+    @property
+    def mean(self):
+        """Mean of all values (same as numpy.mean)."""
+        if self.count == 0:
+            return float("nan")
+        if self.n_neg_inf and self.n_pos_inf:
+            return float("nan")
+        if self.n_neg_inf:
+            return float("-inf")
+        if self.n_pos_inf:
+            return float("inf")
+        return self.f_mean
+
+    @property
+    def min(self):
+        """Smallest value, None if none."""
+        if self.n_neg_inf:
+            return float("-inf")
+        if self.f_min is None and self.n_pos_inf:
+            return float("inf")
+        return self.f_min
+
+    @property
+    def max(self):
+        """Largest value, None if none."""
+        if self.n_pos_inf:
+            return float("inf")
+        if self.f_max is None and self.n_neg_inf:
+            return float("-inf")
+        return self.f_max
+
+    @property
+    def total(self):
+        """Sum of all values."""
+        if self.count == 0:
+            return 0.0
+        return self.mean * self.count
+
+    @property
+    def abs_mean(self):
+        """Mean of absolute values."""
+        if self.count == 0:
+            return float("nan")
+        if self.n_neg_inf or self.n_pos_inf:
+            return float("inf")
+        return self.abs_total / self.count
+
+    @property
+    def std(self):
+        """Population standard deviation (same as numpy.std)."""
+        if self.count == 0 or self.n_neg_inf or self.n_pos_inf:
+            return float("nan")
+        return float(np.sqrt(self.m2 / self.n_finite))
+
+    def _add_moments(self, count, mean, m2, vmin, vmax):
+        """Combine moments of finite values with those of another set of
+        values (Chan et al. parallel variance)."""
+        if count == 0:
+            return
+
+        n = self.n_finite + count
+        delta = mean - self.f_mean
+        self.m2 += m2 + delta * delta * self.n_finite * count / n
+        self.f_mean += delta * count / n
+        self.n_finite = n
+
+        self.f_min = vmin if self.f_min is None else min(self.f_min, vmin)
+        self.f_max = vmax if self.f_max is None else max(self.f_max, vmax)
+
+    def _add_sketch(self, vals, weights):
+        """Add weighted values to the sketch buckets.
+
+        Args:
+            vals <numpy.ndarray>: values
+            weights <numpy.ndarray>: count of each value
+        """
+        vals = np.asarray(vals, dtype=np.float64)
+
+        self.s_zero += int(weights[vals == 0].sum())
+
+        for side, sel in enumerate((vals > 0, vals < 0)):
+            if not np.any(sel):
+                continue
+
+            keys = np.ceil(np.log(np.abs(vals[sel])) /
+                           np.log(self.gamma)).astype(np.int64)
+            lo = int(keys.min())
+            counts = np.bincount(keys - lo, weights=weights[sel])
+
+            self.s_lo[side], self.s_counts[side] = _add_counts(
+                self.s_lo[side], self.s_counts[side], lo,
+                np.round(counts).astype(np.int64))
+
+    def _add_hist(self, lo, counts):
+        """Add an exact histogram, to the sketch if no longer exact."""
+        if lo is None:
+            return
+
+        if self.exact:
+            self.h_lo, self.h_counts = _add_counts(self.h_lo, self.h_counts,
+                                                   lo, counts)
+        else:
+            keep = counts > 0
+            self._add_sketch(np.arange(lo, lo + len(counts))[keep],
+                             counts[keep])
+
+    def _to_sketch(self):
+        """Fold the exact histogram into sketch buckets."""
+        if not self.exact:
+            return
+
+        self.exact = False
+        self._add_hist(self.h_lo, self.h_counts)
+        self.h_lo = None
+        self.h_counts = None
+
+    def update(self, vals):
+        """Add a block of values.
+
+        Args:
+            vals <numpy.ndarray>: values (masked values are skipped)
+        """
+        if isinstance(vals, np.ma.MaskedArray):
+            vals = vals.compressed()
+        vals = np.ravel(vals)
+
+        if vals.dtype.kind == "f":
+            finite = np.isfinite(vals)
+            if not finite.all():
+                inf = np.isinf(vals)
+                self.n_pos_inf += int(np.count_nonzero(inf & (vals > 0)))
+                self.n_neg_inf += int(np.count_nonzero(inf & (vals < 0)))
+                vals = vals[finite]
+
+        if vals.size == 0:
+            return
+
+        mean = float(vals.mean(dtype=np.float64))
+        dev = vals.astype(np.float64) - mean
+        self._add_moments(vals.size, mean, float(np.dot(dev, dev)),
+                          float(vals.min()), float(vals.max()))
+        self.abs_total += float(np.abs(vals).sum(dtype=np.float64))
+
+        lo = np.floor(vals.min())
+        hi = max(self.f_max, vals.max())
+        if self.h_lo is not None:
+            lo = min(lo, self.h_lo)
+
+        if self.exact and hi - lo < HIST_MAX_BINS and \
+                (vals.dtype.kind in "iub" or np.all(np.mod(vals, 1) == 0)):
+            ivals = vals.astype(np.int64)
+            lo = int(ivals.min())
+            self._add_hist(lo, np.bincount(ivals - lo))
+
+        else:
+            self._to_sketch()
+            self._add_sketch(vals, np.ones(vals.shape, dtype=np.int64))
+
+    def merge(self, other):
+        """Merge another accumulator into this one.
+
+        Args:
+            other <StatsAccumulator>: accumulator to merge
+        """
+        self._add_moments(other.n_finite, other.f_mean, other.m2,
+                          other.f_min, other.f_max)
+        self.abs_total += other.abs_total
+        self.n_neg_inf += other.n_neg_inf
+        self.n_pos_inf += other.n_pos_inf
+
+        if not other.exact:
+            self._to_sketch()
+            self.s_zero += other.s_zero
+            for side in (0, 1):
+                self.s_lo[side], self.s_counts[side] = _add_counts(
+                    self.s_lo[side], self.s_counts[side], other.s_lo[side],
+                    other.s_counts[side])
+        else:
+            self._add_hist(other.h_lo, other.h_counts)
+
+        return self
+
+    def histogram(self):
+        """Sorted distinct values (bucket representatives in sketch mode) and
+        their counts."""
+        if self.exact:
+            if self.h_lo is None:
+                return np.array([]), np.array([], dtype=np.int64)
+            keep = self.h_counts > 0
+            return (np.arange(self.h_lo, self.h_lo + len(self.h_counts),
+                              dtype=np.float64)[keep],
+                    self.h_counts[keep])
+
+        values = []
+        counts = []
+        for side, sign in ((1, -1.0), (0, 1.0)):
+            if side == 0 and self.s_zero:
+                values.append(np.zeros(1))
+                counts.append(np.array([self.s_zero], dtype=np.int64))
+
+            if self.s_lo[side] is None:
+                continue
+
+            keys = np.arange(self.s_lo[side],
+                             self.s_lo[side] + len(self.s_counts[side]))
+            est = sign * 2.0 * self.gamma ** keys / (self.gamma + 1.0)
+            cts = self.s_counts[side]
+
+            # negative values: larger key is a smaller value
+            if side == 1:
+                est = est[::-1]
+                cts = cts[::-1]
+
+            keep = cts > 0
+            values.append(est[keep])
+            counts.append(cts[keep])
+
+        if not values:
+            return np.array([]), np.array([], dtype=np.int64)
+
+        return np.concatenate(values), np.concatenate(counts)
+
+    def percentile(self, q):
+        """Percentile of the values, using the same interpolation as
+        numpy.percentile.
+
+        Args:
+            q <float>: percentile, 0-100
+        """
+        if self.count == 0:
+            return float("nan")
+
+        values, counts = self.histogram()
+        cum = np.cumsum(counts)
+
+        rank = (q / 100.0) * (self.count - 1)
+        below = int(np.floor(rank))
+        above = min(below + 1, self.count - 1)
+
+        def value(r):
+            # -inf values rank first, inf values last
+            if r < self.n_neg_inf:
+                return float("-inf")
+            r -= self.n_neg_inf
+            if r >= self.n_finite:
+                return float("inf")
+
+            v = values[np.searchsorted(cum, r, side="right")]
+
+            # sketch buckets can overshoot the true extremes
+            return min(max(v, self.f_min), self.f_max)
+
+        a = value(below)
+        b = value(above)
+        t = rank - below
+
+        if t == 0 or a == b:
+            return float(a)
+
+        # -inf + b is -inf, a + inf is inf, -inf + inf is NaN
+        if np.isinf(a) or np.isinf(b):
+            return float(a + b)
+
+        return float(_lerp(a, b, t))
+
+
+# column names of stats.csv
+STATS_HEADER = ("dir",
+                "test_file",
+                "master_file",
+                "mean",
+                "min",
+                "max",
+                "25_percentile",
+                "75_percentile",
+                "1_percentile",
+                "99_percentile",
+                "std_dev",
+                "median")
+
+
 def img_stats(test, mast, diff_img, dir_in, fn_in, dir_out, sds_ct=0):
-    """Log stats from array
+    """Get stats.csv row of a band pair. Rows are written by write_stats
+    (see results.ResultsSink).
 
     Args:
         test <str>: name of test file
         mast <str>: name of master file
-        diff_img <numpy.ndarray>: image array
+        diff_img <StatsAccumulator>: accumulated differences, or an image
+            array (zero-valued pixels are ignored)
         dir_in <str>: directory where test data exists
         fn_in <str>: input filename (to identify csv entry)
         dir_out <str>: output directory
         sds_ct <int>: index of SDS (default=0)
     """
-    diff_img = np.ma.masked_where(diff_img == 0, diff_img)
+    with tracing.span("stats"):
+        if isinstance(diff_img, StatsAccumulator):
+            acc = diff_img
+        else:
+            acc = StatsAccumulator()
+            acc.update(np.ma.masked_where(diff_img == 0, diff_img))
+
+        logging.info("Writing stats for {0} to {1}.".
+                     format(fn_in, dir_out + os.sep + "stats.csv"))
+
+        return (dir_in,
+                test + "_" + str(sds_ct),
+                mast + "_" + str(sds_ct),
+                acc.mean,
+                acc.min,
+                acc.max,
+                acc.percentile(25),
+                acc.percentile(75),
+                acc.percentile(1),
+                acc.percentile(99),
+                acc.std,
+                acc.percentile(50))
+
+
+def write_stats(dir_out, rows):
+    """Append rows to stats.csv, writing the header if the file is new.
+
+    Args:
+        dir_out <str>: output directory
+        rows <list>: rows from img_stats
+    """
+    if not rows:
+        return
 
     fn_out = dir_out + os.sep + "stats.csv"
-    logging.info("Writing stats for {0} to {1}.".format(fn_in, fn_out))
 
     file_exists = os.path.isfile(fn_out)
 
-    with open(fn_out, "ab") as f:
+    # csv needs a binary file on Python 2, a text file on Python 3
+    if sys.version_info[0] < 3:
+        f = open(fn_out, "ab")
+    else:
+        f = open(fn_out, "a", newline="")
+
+    with f:
         writer = csv.writer(f)
 
         # write header if file didn't already exist
         if not file_exists:
-            writer.writerow(("dir",
-                             "test_file",
-                             "master_file",
-                             "mean",
-                             "min",
-                             "max",
-                             "25_percentile",
-                             "75_percentile",
-                             "1_percentile",
-                             "99_percentile",
-                             "std_dev",
-                             "median"))
-
-        writer.writerow((dir_in,
-                        test + "_" + str(sds_ct),
-                        mast + "_" + str(sds_ct),
-                        np.mean(diff_img),
-                        np.amin(diff_img),
-                        np.amax(diff_img),
-                        np.percentile(diff_img.compressed(), 25),
-                        np.percentile(diff_img.compressed(), 75),
-                        np.percentile(diff_img.compressed(), 1),
-                        np.percentile(diff_img.compressed(), 99),
-                        np.std(diff_img),
-                        np.median(diff_img.compressed())))
+            writer.writerow(STATS_HEADER)
+
+        writer.writerows(rows)
@@ -0,0 +1,217 @@
+"""test_qa_images.py
+
+Purpose: check the numerics of image differences: the data type diffs are
+         computed in (diff_dtype) never overflows, distances in units in the
+         last place (ulp) match numpy.nextafter, and NaN and nodata pixels
+         never violate a tolerance policy. Also checks which bands
+         GeoImage.check_pairs compares, with the GDAL side (image_io)
+         replaced by stand-ins. Run with python -m pytest (or python -m
+         unittest) from this directory.
+"""
+import sys
+import types
+import unittest
+import numpy as np
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import tracing
+from file_io import Find
+from qa_images import diff_dtype, do_diff, nodata_mask, Policy, Window, \
+    GeoImage, _ordered_bits
+
+INT_TYPES = (np.bool_, np.uint8, np.int8, np.uint16, np.int16, np.uint32,
+             np.int32, np.int64)
+
+
+def window(test, mast, nodata=None):
+    """Build a window of a test/master pair."""
+    test = np.asarray(test)
+    mast = np.asarray(mast)
+    nd_mask = None
+    if nodata is not None:
+        nd_mask = nodata_mask(test, mast, nodata)
+    return Window(0, 0, test, mast, do_diff(test, mast, nodata), nd_mask)
+
+
+class FakeDataset:
+    """Stand-in for image_io.RasterDataset: bands are (path, number,
+    whether opened as a subdataset)."""
+    def __init__(self, path, ds=None, separate=False):
+        self.path = path
+
+    def band(self, ii, sds=False):
+        return (self.path, ii, sds)
+
+    def name(self, ii, sds=False):
+        return "band_" + str(ii + 1)
+
+    def nodata(self, ii, sds=False):
+        return None
+
+    def geo(self, ii, sds=False):
+        return None, None
+
+
+def fake_image_io():
+    """Module standing in for image_io in GeoImage.check_pairs."""
+    module = types.ModuleType("image_io")
+    module.RasterIO = mock.Mock()
+    module.RasterCmp = mock.Mock()
+    for check in ("compare_proj_ref", "compare_geo_trans",
+                  "extent_diff_cols", "extent_diff_rows"):
+        getattr(module.RasterCmp, check).return_value = True
+    module.RasterDataset = FakeDataset
+    return module
+
+
+class DiffDtypeTest(unittest.TestCase):
+    def test_widening(self):
+        for t, m, want in [(np.uint8, np.uint8, np.int16),
+                           (np.int8, np.int8, np.int16),
+                           (np.bool_, np.bool_, np.int8),
+                           (np.uint16, np.uint16, np.int32),
+                           (np.int16, np.int16, np.int32),
+                           (np.uint8, np.int16, np.int32),
+                           (np.int32, np.int32, np.int64),
+                           (np.uint32, np.uint32, np.int64),
+                           (np.uint64, np.uint64, np.float64),
+                           (np.int64, np.int64, np.float64),
+                           (np.float32, np.float32, np.float32),
+                           (np.float32, np.float64, np.float64),
+                           (np.int16, np.float32, np.float32),
+                           (np.uint8, np.float16, np.float32)]:
+            self.assertEqual(diff_dtype(t, m), np.dtype(want), (t, m))
+
+    def test_no_overflow(self):
+        # extremes of every integer pair give the exact difference, or the
+        # nearest float64 where no integer type holds it
+        for t in INT_TYPES:
+            for m in INT_TYPES:
+                dt = diff_dtype(t, m)
+                info_t = np.iinfo(t) if t is not np.bool_ else None
+                info_m = np.iinfo(m) if m is not np.bool_ else None
+                t_ext = [0, 1] if info_t is None else [info_t.min, info_t.max]
+                m_ext = [0, 1] if info_m is None else [info_m.min, info_m.max]
+                for a in t_ext:
+                    for b in m_ext:
+                        d = do_diff(np.array([a], dtype=t),
+                                    np.array([b], dtype=m))
+                        self.assertEqual(d.dtype, dt)
+                        want = int(a) - int(b)
+                        if dt.kind == "f":
+                            want = float(want)
+                        self.assertEqual(d[0], want, (t, m, a, b))
+
+
+class UlpTest(unittest.TestCase):
+    def test_distance(self):
+        for dt in (np.float32, np.float64):
+            info = np.finfo(dt)
+            vals = np.array([0.0, 1.0, -1.0, 1e-30, -2.5, info.tiny,
+                             -info.max], dtype=dt)
+            for k in (1, 2, 5):
+                up = vals.copy()
+                for _ in range(k):
+                    up = np.nextafter(up, dt(np.inf))
+                dist = np.abs(_ordered_bits(up) - _ordered_bits(vals))
+                self.assertEqual(dist.tolist(), [k] * len(vals), (dt, k))
+
+            # the largest float is one ulp from infinity
+            top = np.array([info.max, np.inf], dtype=dt)
+            self.assertEqual(np.ptp(_ordered_bits(top)), 1)
+
+    def test_across_zero(self):
+        for dt in (np.float32, np.float64):
+            zeros = np.array([0.0, -0.0], dtype=dt)
+            self.assertEqual(np.ptp(_ordered_bits(zeros)), 0)
+
+            # smallest subnormals either side of zero are 2 ulp apart
+            tiny = np.nextafter(dt(0), dt(1))
+            pair = np.array([-tiny, tiny], dtype=dt)
+            self.assertEqual(np.ptp(_ordered_bits(pair)), 2)
+
+    def test_policy(self):
+        mast = np.array([1.0, 1.0, 1.0, 1.0], dtype=np.float32)
+        test = np.nextafter(mast, np.float32(2))
+        test[1] = np.nextafter(test[1], np.float32(2))
+        test[2] = 2.0
+        win = window(test, mast)
+
+        self.assertEqual(Policy("ulp", 0).violations(win).tolist(),
+                         [True, True, True, True])
+        self.assertEqual(Policy("ulp", 1).violations(win).tolist(),
+                         [False, True, True, False])
+        self.assertEqual(Policy("ulp", 2).violations(win).tolist(),
+                         [False, False, True, False])
+
+
+class NanPolicyTest(unittest.TestCase):
+    def test_nan_never_violates(self):
+        nan = np.nan
+        test = np.array([nan, 1.0, nan, 5.0, -9999.0], dtype=np.float64)
+        mast = np.array([nan, nan, 1.0, 1.0, 2.0], dtype=np.float64)
+        win = window(test, mast, nodata=-9999.0)
+
+        for mode in Policy.MODES:
+            out = Policy(mode, 0).violations(win)
+            self.assertEqual(out.tolist(), [False, False, False, True, False],
+                             mode)
+
+
+class CheckPairsTest(unittest.TestCase):
+    def check_pairs(self, n_bands, ext, compare_bands, band_threads=None):
+        """Run check_pairs on a test/master pair whose band count is
+        n_bands."""
+        with mock.patch.dict(sys.modules, {"image_io": fake_image_io()}), \
+                mock.patch.object(Find, "count", return_value=n_bands), \
+                mock.patch.object(GeoImage, "compare_bands_multi",
+                                  side_effect=compare_bands):
+            return GeoImage.check_pairs(["test" + ext], "mast" + ext,
+                                        ["out"], ext,
+                                        band_threads=band_threads)[0]
+
+    def test_no_subdatasets_read_as_single_band(self):
+        # e.g. a single-variable NetCDF: Find.count gives 0
+        calls = []
+
+        def compare_bands(tests, mast, t_bands, m_band, dir_outs, **kwargs):
+            calls.append((t_bands, m_band))
+            return [{"status": "diff", "plots": []}]
+
+        for ext in (".nc", ".hdf"):
+            del calls[:]
+            result = self.check_pairs(0, ext, compare_bands)
+            self.assertEqual(calls, [([("test" + ext, 0, False)],
+                                      ("mast" + ext, 0, False))])
+            self.assertEqual(result["verdict"], "diff")
+
+    def test_pair_bytes_from_band_threads(self):
+        import threading
+
+        threads = set()
+
+        def compare_bands(tests, mast, t_bands, m_band, dir_outs, **kwargs):
+            threads.add(threading.current_thread().ident)
+            tracing.add_bytes(1000)
+            return [{"status": "match", "plots": []}]
+
+        tracing.enable()
+        try:
+            with tracing.span("pair", cat="pair") as pair:
+                result = self.check_pairs(2, ".img", compare_bands,
+                                          band_threads=2)
+        finally:
+            tracing.enable(False)
+            tracing.drain()
+
+        self.assertEqual(result["verdict"], "match")
+        self.assertNotIn(threading.current_thread().ident, threads)
+        self.assertEqual(pair.bytes, 2000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+"""test_stats.py
+
+Purpose: check that StatsAccumulator matches numpy on the values it has
+         seen: exact percentiles of integer values (also when merged from
+         blocks), bounded error of the sketch, and NaN and inf handling.
+         Run with python -m pytest (or python -m unittest) from this
+         directory.
+"""
+import unittest
+import numpy as np
+
+from stats import StatsAccumulator, SKETCH_ALPHA
+
+PERCENTILES = (0, 1, 25, 50, 75, 99, 100)
+
+
+def accumulate(vals, blocks=1):
+    """Build an accumulator from blocks of values, merged one by one."""
+    acc = StatsAccumulator()
+    for block in np.array_split(vals, blocks):
+        part = StatsAccumulator()
+        part.update(block)
+        acc.merge(part)
+    return acc
+
+
+def same(a, b):
+    """Equal, or both NaN."""
+    return (np.isnan(a) and np.isnan(b)) or a == b
+
+
+def inf_percentile(vals, q):
+    """Percentile of sorted values next to an infinite one: that value, NaN
+    between -inf and inf (numpy.percentile gives NaN)."""
+    rank = (q / 100.0) * (len(vals) - 1)
+    below = int(np.floor(rank))
+    a = vals[below]
+    b = vals[min(below + 1, len(vals) - 1)]
+    if rank == below or a == b:
+        return a
+    return a + b
+
+
+class TestStatsAccumulator(unittest.TestCase):
+    def test_integer_percentiles_exact(self):
+        rng = np.random.RandomState(0)
+        for blocks in (1, 3, 7):
+            vals = rng.randint(-500, 500, 10000)
+            acc = accumulate(vals, blocks)
+            for q in PERCENTILES:
+                self.assertEqual(acc.percentile(q), np.percentile(vals, q))
+
+    def test_moments(self):
+        rng = np.random.RandomState(1)
+        vals = rng.standard_normal(5000) * 100
+        acc = accumulate(vals, 4)
+        self.assertEqual(acc.count, vals.size)
+        self.assertAlmostEqual(acc.mean, np.mean(vals), places=9)
+        self.assertAlmostEqual(acc.std, np.std(vals), places=9)
+        self.assertEqual(acc.min, vals.min())
+        self.assertEqual(acc.max, vals.max())
+
+    def test_sketch_percentiles_bounded(self):
+        rng = np.random.RandomState(2)
+        vals = rng.standard_normal(20000) * 1000
+        acc = accumulate(vals, 5)
+        for q in PERCENTILES:
+            ref = np.percentile(vals, q)
+            self.assertLessEqual(abs(acc.percentile(q) - ref),
+                                 2 * SKETCH_ALPHA * abs(ref) + 1e-9)
+
+    def test_nan_skipped(self):
+        vals = np.array([1.0, np.nan, 3.0, 2.0, np.nan])
+        acc = accumulate(vals, 2)
+        self.assertEqual(acc.count, 3)
+        self.assertEqual(acc.percentile(50), 2.0)
+        self.assertEqual(acc.mean, 2.0)
+
+    def test_inf(self):
+        acc = StatsAccumulator()
+        acc.update(np.array([1.5, np.inf, 2.0]))
+        self.assertEqual(acc.count, 3)
+        self.assertEqual(acc.min, 1.5)
+        self.assertEqual(acc.max, np.inf)
+        self.assertEqual(acc.mean, np.inf)
+        self.assertTrue(np.isnan(acc.std))
+        self.assertEqual(acc.percentile(0), 1.5)
+        self.assertEqual(acc.percentile(100), np.inf)
+
+    def test_inf_percentiles_match_numpy(self):
+        rng = np.random.RandomState(3)
+        for trial in range(200):
+            vals = rng.randint(-20, 20, rng.randint(1, 50)).astype(np.float64)
+            special = rng.randint(0, len(vals), rng.randint(0, 4))
+            vals[special] = rng.choice([np.inf, -np.inf, np.nan],
+                                       len(special))
+            acc = accumulate(vals, rng.randint(1, 4))
+
+            finite = vals[~np.isnan(vals)]
+            if not finite.size:
+                self.assertEqual(acc.count, 0)
+                continue
+
+            with np.errstate(invalid="ignore"):
+                for q in PERCENTILES:
+                    ref = np.percentile(finite, q)
+                    if np.isnan(ref):
+                        ref = inf_percentile(np.sort(finite), q)
+                    self.assertTrue(same(acc.percentile(q), ref))
+
+                ref = np.mean(finite)
+                if np.isfinite(ref):
+                    self.assertAlmostEqual(acc.mean, ref, places=9)
+                else:
+                    self.assertTrue(same(acc.mean, ref))
+            self.assertEqual(acc.min, finite.min())
+            self.assertEqual(acc.max, finite.max())
+
+    def test_only_inf(self):
+        acc = accumulate(np.array([-np.inf, -np.inf]))
+        self.assertEqual(acc.min, -np.inf)
+        self.assertEqual(acc.max, -np.inf)
+        self.assertEqual(acc.percentile(50), -np.inf)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+"""tracing.py
+
+Purpose: optional per-stage timing, bytes read and memory instrumentation.
+         Spans are collected in memory and written as a JSON summary and a
+         Chrome trace (chrome://tracing, Perfetto). When tracing is off, a
+         span is a shared no-op object.
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# output file names, in the QA output directory
+TRACE_NAME = "trace.json"
+SUMMARY_NAME = "trace_summary.json"
+
+_enabled = False
+_events = []
+_local = threading.local()
+
+# spans attached to several threads are charged bytes from each of them
+_bytes_lock = threading.Lock()
+
+
+def enable(on=True):
+    """Turn tracing on (or off) in this process.
+
+    Args:
+        on <bool>: record spans (default=True)
+    """
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    """Check if tracing is on."""
+    return _enabled
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KB, None if unknown."""
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, KB elsewhere
+    if sys.platform == "darwin":
+        rss //= 1024
+
+    return rss
+
+
+def _stack():
+    """Open spans of the calling thread."""
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def add_bytes(n):
+    """Count bytes read against every open span of the calling thread,
+    including spans attached to it (see attach).
+
+    Args:
+        n <int>: number of bytes
+    """
+    if not _enabled:
+        return
+
+    with _bytes_lock:
+        for s in _stack():
+            s.bytes += n
+
+
+def open_spans():
+    """Get the open spans of the calling thread, e.g. to attach them to
+    threads doing work for them (see attach)."""
+    if not _enabled:
+        return []
+
+    return list(_stack())
+
+
+class attach:
+    """Charge bytes read on this thread to spans opened on another one, e.g.
+    the file pair span of bands read on a thread pool. Use as a context
+    manager on the worker thread:
+
+        spans = tracing.open_spans()
+        ...
+        with tracing.attach(spans):
+            ...
+    """
+    def __init__(self, spans):
+        """
+        Args:
+            spans <list>: spans from open_spans()
+        """
+        self.spans = spans
+
+    def __enter__(self):
+        stack = _stack()
+        self.depth = len(stack)
+        stack.extend(self.spans)
+        return self
+
+    def __exit__(self, *exc):
+        del _stack()[self.depth:]
+        return False
+
+
+class _NullSpan:
+    """Span used when tracing is off."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """Timed stage; see span()."""
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.bytes = 0
+
+    def __enter__(self):
+        _stack().append(self)
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        t1 = time.time()
+        _stack().pop()
+
+        args = dict(self.args)
+        args["bytes"] = self.bytes
+        args["peak_rss_kb"] = peak_rss_kb()
+
+        # Chrome trace "complete" event, times in microseconds
+        _events.append({"name": self.name,
+                        "cat": self.cat,
+                        "ph": "X",
+                        "ts": int(self.t0 * 1e6),
+                        "dur": int((t1 - self.t0) * 1e6),
+                        "pid": os.getpid(),
+                        "tid": threading.current_thread().ident,
+                        "args": args})
+        return False
+
+
+def span(name, cat="stage", **args):
+    """Time a stage of the pipeline. Use as a context manager:
+
+        with tracing.span("read", band=1):
+            ...
+
+    Args:
+        name <str>: stage name, spans are summarized by name
+        cat <str>: category, "pair" for file pair spans (default="stage")
+        **args: details shown in the trace (e.g. file names)
+    """
+    if not _enabled:
+        return _NULL_SPAN
+
+    return _Span(name, cat, args)
+
+
+def drain():
+    """Take the spans recorded so far in this process (e.g. to hand them from
+    a worker to the parent)."""
+    global _events
+
+    events = _events
+    _events = []
+
+    return events
+
+
+def extend(events):
+    """Add spans recorded by another process.
+
+    Args:
+        events <list>: spans from drain()
+    """
+    _events.extend(events)
+
+
+def summarize(events):
+    """Summarize spans per stage and per file pair.
+
+    Args:
+        events <list>: spans from drain()
+    """
+    stages = {}
+    pairs = []
+
+    for e in events:
+        if e["cat"] == "pair":
+            pairs.append({"test": e["args"].get("test"),
+                          "mast": e["args"].get("mast"),
+                          "seconds": e["dur"] / 1e6,
+                          "bytes": e["args"]["bytes"],
+                          "peak_rss_kb": e["args"]["peak_rss_kb"]})
+            continue
+
+        s = stages.setdefault(e["name"], {"count": 0, "seconds": 0.0,
+                                          "bytes": 0, "peak_rss_kb": None})
+        s["count"] += 1
+        s["seconds"] += e["dur"] / 1e6
+        s["bytes"] += e["args"]["bytes"]
+        if e["args"]["peak_rss_kb"] is not None:
+            s["peak_rss_kb"] = max(s["peak_rss_kb"] or 0,
+                                   e["args"]["peak_rss_kb"])
+
+    return {"stages": stages, "pairs": pairs}
+
+
+def write(dir_out):
+    """Write all spans as a Chrome trace and a JSON summary.
+
+    Args:
+        dir_out <str>: output directory
+    """
+    events = drain()
+
+    with open(dir_out + os.sep + TRACE_NAME, "w") as f:
+        json.dump({"traceEvents": events}, f)
+
+    with open(dir_out + os.sep + SUMMARY_NAME, "w") as f:
+        json.dump(summarize(events), f, indent=2, sort_keys=True)
+
+    return dir_out + os.sep + SUMMARY_NAME
@@ -0,0 +1,201 @@
+"""xml_cmp.py
+
+Purpose: compare XML metadata files element by element. Files are parsed in
+         streaming mode; elements are keyed by their path and identifying
+         attributes, so a difference is reported where it is, whatever its
+         line, and numeric values are compared with a tolerance.
+"""
+import re
+import logging
+
+# attributes that identify an element among its siblings (e.g. ESPA bands)
+KEY_ATTRS = ("name", "product", "location", "id")
+
+# XML file pairs compared at a time
+XML_THREADS = 4
+
+
+def iter_elements(path):
+    """Stream the elements of an XML file, each once it is complete. Parsed
+    elements are freed as the file is read.
+
+    Args:
+        path <str>: path to XML file, possibly inside an archive
+
+    Yields:
+        <tuple>: element key, attributes (dict) and stripped text
+    """
+    from lxml import etree
+    from file_io import Read
+
+    f = Read.open_file(path)
+
+    # (key, number of each child key seen) of the open elements
+    stack = []
+
+    try:
+        for event, el in etree.iterparse(f, events=("start", "end"),
+                                         remove_comments=True):
+            if event == "start":
+                ids = ",".join("{0}={1}".format(a, el.get(a))
+                               for a in KEY_ATTRS if el.get(a) is not None)
+                step = etree.QName(el).localname
+                if ids:
+                    step += "[" + ids + "]"
+
+                if stack:
+                    counts = stack[-1][1]
+                    n = counts.get(step, 0)
+                    counts[step] = n + 1
+
+                    # repeated siblings with the same key
+                    if n:
+                        step += "#" + str(n + 1)
+
+                    key = stack[-1][0] + "/" + step
+                else:
+                    key = "/" + step
+
+                stack.append((key, {}))
+                continue
+
+            key = stack.pop()[0]
+            attrs = dict((etree.QName(k).localname, v)
+                         for k, v in el.attrib.items())
+
+            yield key, attrs, (el.text or "").strip()
+
+            # free what has been compared
+            el.clear()
+            while el.getprevious() is not None:
+                del el.getparent()[0]
+
+    finally:
+        f.close()
+
+
+def values_equal(a, b, tolerance=0):
+    """Compare two XML values; numbers are equal within a relative
+    tolerance.
+
+    Args:
+        a <str>: test value
+        b <str>: master value
+        tolerance <float>: relative tolerance of numbers (default=0)
+    """
+    if a == b:
+        return True
+
+    try:
+        fa = float(a)
+        fb = float(b)
+    except (TypeError, ValueError):
+        return False
+
+    return abs(fa - fb) <= tolerance * abs(fb)
+
+
+def band_of(key):
+    """Name of the band an element key belongs to, None if none.
+
+    Args:
+        key <str>: element key from iter_elements
+    """
+    m = re.search(r"/band\[([^\]]*)\]", key)
+    if m is None:
+        return None
+
+    ids = dict(p.split("=", 1) for p in m.group(1).split(",") if "=" in p)
+
+    return ids.get("name", m.group(1))
+
+
+def compare_xml(test, mast, tolerance=0):
+    """Compare a test XML file with its master, element by element. The
+    master is held as a dict of its elements; the test file is streamed
+    against it.
+
+    Args:
+        test <str>: path to test XML file
+        mast <str>: path to master XML file
+        tolerance <float>: relative tolerance of numeric values (default=0)
+
+    Returns:
+        <dict>: "differences" (key, band, kind "added", "removed",
+            "attribute" or "text", attribute name, test and master values)
+            and differences grouped by "bands"
+    """
+    mast_el = dict((key, (attrs, text))
+                   for key, attrs, text in iter_elements(mast))
+
+    diffs = []
+
+    def compare(key, attrs, text):
+        if key not in mast_el:
+            diffs.append({"key": key, "kind": "added", "attr": None,
+                          "test": text, "mast": None})
+            return
+
+        m_attrs, m_text = mast_el.pop(key)
+
+        for a in sorted(set(attrs) | set(m_attrs)):
+            if not values_equal(attrs.get(a), m_attrs.get(a), tolerance):
+                diffs.append({"key": key, "kind": "attribute", "attr": a,
+                              "test": attrs.get(a), "mast": m_attrs.get(a)})
+
+        if not values_equal(text, m_text, tolerance):
+            diffs.append({"key": key, "kind": "text", "attr": None,
+                          "test": text, "mast": m_text})
+
+    for key, attrs, text in iter_elements(test):
+        compare(key, attrs, text)
+
+    for key in sorted(mast_el):
+        diffs.append({"key": key, "kind": "removed", "attr": None,
+                      "test": None, "mast": mast_el[key][1]})
+
+    bands = {}
+    for d in diffs:
+        d["band"] = band_of(d["key"])
+        if d["band"] is not None:
+            bands.setdefault(d["band"], []).append(d)
+
+    return {"differences": diffs, "bands": bands}
+
+
+def compare_pairs(test, mast, tolerance=0, threads=XML_THREADS):
+    """Compare XML file pairs on several threads.
+
+    Args:
+        test <list>: paths to test XML files
+        mast <list>: paths to matching master XML files
+        tolerance <float>: relative tolerance of numeric values (default=0)
+        threads <int>: pairs compared at a time (default=XML_THREADS)
+
+    Returns:
+        <list>: report of each pair (see compare_xml), with its "test" and
+            "mast" paths, or its "error" if it could not be compared
+    """
+    from multiprocessing.pool import ThreadPool
+
+    def run(pair):
+        report = {"test": pair[0], "mast": pair[1]}
+        try:
+            report.update(compare_xml(pair[0], pair[1], tolerance))
+        except Exception as e:
+            logging.error("Cannot compare {0} and {1}: {2}".format(
+                pair[0], pair[1], e))
+            report["error"] = str(e)
+        return report
+
+    pairs = list(zip(test, mast))
+
+    if threads <= 1 or len(pairs) <= 1:
+        return [run(p) for p in pairs]
+
+    pool = ThreadPool(min(threads, len(pairs)))
+    try:
+        return pool.map(run, pairs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()